@@ -3,37 +3,52 @@
 """Determine likelihood of positive outcome in a given series of fights"""
 
 
+from collections import Counter, namedtuple
 import argparse
+import functools
+import json
 import logging
+import random
+import sys
 
-from quantum import CARDS, Attacker, Defender
+from quantum import CARDS, Attacker, Defender, exact_win_probability
 from qq import qq
 
 logger = logging.getLogger(__name__)
 
+# The best attack to make next, along with the probability of winning the battle
+# if it (and every plan after it) is followed. on_win and on_loss are the plans
+# to follow next, depending on how the attack goes (None once there's nothing
+# left to decide)
+AttackPlan = namedtuple("AttackPlan", ["probability", "attack", "on_win", "on_loss"])
 
-def do_fight(attacker_ship_die, defender_ship_die, attacker_cards, defender_cards):
+
+def do_fight(
+    attacker_ship_die, defender_ship_die, attacker_cards, defender_cards, rng=None
+):
     attacker = Attacker(
         ship_die=attacker_ship_die,
         # combat_die_rolls=[6],
         cards=attacker_cards,
+        rng=rng,
     )
     defender = Defender(
         ship_die=defender_ship_die,
         # combat_die_rolls=[1],
         cards=defender_cards,
+        rng=rng,
     )
 
     res = attacker.attack(defender)
     return res
 
 
-def do_battle_win_any(fights, attacker_cards, defender_cards):
+def do_battle_win_any(fights, attacker_cards, defender_cards, rng=None):
     attacker_wins_battle = False
     attacker_wins_total = 0
     for attacker_ship_die, defender_ship_die in fights:
         attacker_wins = do_fight(
-            attacker_ship_die, defender_ship_die, attacker_cards, defender_cards
+            attacker_ship_die, defender_ship_die, attacker_cards, defender_cards, rng
         )
         if attacker_wins:
             attacker_wins_total += 1
@@ -42,12 +57,12 @@ def do_battle_win_any(fights, attacker_cards, defender_cards):
     return attacker_wins_battle, attacker_wins_total
 
 
-def do_battle_win_all(fights, attacker_cards, defender_cards):
+def do_battle_win_all(fights, attacker_cards, defender_cards, rng=None):
     attacker_wins_battle = True
     attacker_wins_total = 0
     for attacker_ship_die, defender_ship_die in fights:
         attacker_wins = do_fight(
-            attacker_ship_die, defender_ship_die, attacker_cards, defender_cards
+            attacker_ship_die, defender_ship_die, attacker_cards, defender_cards, rng
         )
         if attacker_wins:
             attacker_wins_total += 1
@@ -57,27 +72,293 @@ def do_battle_win_all(fights, attacker_cards, defender_cards):
     return attacker_wins_battle, attacker_wins_total
 
 
-def do_battle(fights, attacker_cards, defender_cards, win_condition="all"):
+def do_battle(fights, attacker_cards, defender_cards, win_condition="all", rng=None):
     if win_condition == "all":
-        return do_battle_win_all(fights, attacker_cards, defender_cards)
+        return do_battle_win_all(fights, attacker_cards, defender_cards, rng)
 
     if win_condition == "any":
-        return do_battle_win_any(fights, attacker_cards, defender_cards)
+        return do_battle_win_any(fights, attacker_cards, defender_cards, rng)
 
-    raise ValueError(f"win_condition must be 'all' or 'any'; got: {win_condition:!r}")
+    raise ValueError(f"win_condition must be 'all' or 'any'; got: {win_condition!r}")
 
 
-def battle_summary(fights, attacker_cards, defender_cards, win_condition):
-    substr = "ALL fights" if win_condition == "all" else "ANY fight"
-    print(f"Attacker must win {substr} to win battle")
-    for fight_num, fight in enumerate(fights, 1):
-        attacker_ship_die, defender_ship_die = fight
-        prob = qq(
+def compile_fights(fights, attacker_cards, defender_cards, rng=None):
+    """Build the Attacker and Defender of each fight once
+
+    The sides are reset (rather than rebuilt) by do_compiled_battle, so a battle
+    can be simulated any number of times without constructing new ones"""
+
+    return [
+        (
+            Attacker(ship_die=attacker_ship_die, cards=attacker_cards, rng=rng),
+            Defender(ship_die=defender_ship_die, cards=defender_cards, rng=rng),
+        )
+        for attacker_ship_die, defender_ship_die in fights
+    ]
+
+
+def do_compiled_battle(compiled_fights, needed, stop_early=False):
+    """Fight every compiled fight (see compile_fights) once
+
+    The attacker wins the battle if it wins at least needed fights. If
+    stop_early, fighting stops as soon as the battle is decided (e.g. at the
+    first loss if every fight must be won), so the number of fights won is then
+    only counted up to that point.
+
+    Return whether the attacker won the battle, and how many fights it won"""
+
+    attacker_wins_total = 0
+    num_fights_remaining = len(compiled_fights)
+    for attacker, defender in compiled_fights:
+        attacker.reset()
+        defender.reset()
+        attacker_wins_total += attacker.attack(defender)
+        num_fights_remaining -= 1
+        if stop_early and (
+            attacker_wins_total >= needed
+            or attacker_wins_total + num_fights_remaining < needed
+        ):
+            break
+
+    return attacker_wins_total >= needed, attacker_wins_total
+
+
+def fight_win_probabilities(fights, attacker_cards, defender_cards, exact=True):
+    """Return the probability that the attacker wins each fight
+
+    If exact, the probabilities are calculated by the exact engine (as
+    Fractions); otherwise they are looked up in the results table (see qq)"""
+
+    if exact:
+        return [
+            exact_win_probability(
+                Attacker(ship_die=attacker_ship_die, cards=attacker_cards),
+                Defender(ship_die=defender_ship_die, cards=defender_cards),
+            )
+            for attacker_ship_die, defender_ship_die in fights
+        ]
+
+    return [
+        qq(
             attacker_ship_die=attacker_ship_die,
             defender_ship_die=defender_ship_die,
             attacker_cards=tuple(attacker_cards) if attacker_cards else (),
             defender_cards=tuple(defender_cards) if defender_cards else (),
         )
+        for attacker_ship_die, defender_ship_die in fights
+    ]
+
+
+def wins_distribution(probabilities):
+    """Return the distribution of the number of fights won
+
+    Since every fight is independent, this is the Poisson binomial distribution
+    of the given per-fight probabilities, built up by convolving in one fight at
+    a time. Element k of the result is the probability of winning exactly k
+    fights"""
+
+    distribution = [1]
+    for probability in probabilities:
+        new_distribution = [0] * (len(distribution) + 1)
+        for num_wins, num_wins_probability in enumerate(distribution):
+            new_distribution[num_wins] += num_wins_probability * (1 - probability)
+            new_distribution[num_wins + 1] += num_wins_probability * probability
+        distribution = new_distribution
+
+    return distribution
+
+
+def min_wins(num_fights, win_condition="all", at_least=None):
+    """Return the number of fights the attacker must win to win the battle"""
+
+    if at_least is not None:
+        if not 1 <= at_least <= num_fights:
+            raise ValueError(
+                f"at_least must be between 1 and {num_fights}; got: {at_least}"
+            )
+        return at_least
+
+    if win_condition == "all":
+        return num_fights
+
+    if win_condition == "any":
+        return 1
+
+    raise ValueError(f"win_condition must be 'all' or 'any'; got: {win_condition!r}")
+
+
+def battle_win_probability(distribution, win_condition="all", at_least=None):
+    """Return the probability of winning the battle, given a wins_distribution
+
+    The attacker must win all fights, any fight, or (if given) at least
+    at_least fights"""
+
+    return sum(distribution[min_wins(len(distribution) - 1, win_condition, at_least) :])
+
+
+@functools.lru_cache(maxsize=None)
+def fight_win_probability(
+    attacker_ship_die, defender_ship_die, attacker_cards, defender_cards, exact=True
+):
+    """Cached, single-fight version of fight_win_probabilities
+
+    The cards must be given as tuples"""
+
+    return float(
+        fight_win_probabilities(
+            [(attacker_ship_die, defender_ship_die)],
+            attacker_cards,
+            defender_cards,
+            exact=exact,
+        )[0]
+    )
+
+
+def plan_attacks(
+    attacker_ship_dice,
+    defender_ship_dice,
+    attacker_cards=None,
+    defender_cards=None,
+    win_condition="all",
+    at_least=None,
+    exact=True,
+):
+    """Find the best way to attack the given defenders with the given ships
+
+    Each ship can attack once, and a defender is destroyed once any ship beats
+    it. The attacker wins the battle by destroying every defender, any defender,
+    or at least at_least of them. Since the best next attack depends on how the
+    previous ones went, the result is an AttackPlan for the first attack, which
+    leads on to the plans for every later one.
+
+    Every (ships left, defenders left) state is only solved once, so even six
+    ships against six defenders only takes a moment"""
+
+    attacker_cards = tuple(attacker_cards or ())
+    defender_cards = tuple(defender_cards or ())
+    needed = min_wins(len(defender_ship_dice), win_condition, at_least)
+    num_defenders = len(defender_ship_dice)
+
+    @functools.lru_cache(maxsize=None)
+    def best_plan(ships, defenders):
+        if num_defenders - len(defenders) >= needed:
+            return AttackPlan(1.0, None, None, None)
+        if not ships or not defenders:
+            return AttackPlan(0.0, None, None, None)
+
+        best = None
+        # Dice are interchangeable, so only try each distinct matchup once
+        for ship in set(ships):
+            ships_left = _remove_one(ships, ship)
+            for defender in set(defenders):
+                on_win = best_plan(ships_left, _remove_one(defenders, defender))
+                on_loss = best_plan(ships_left, defenders)
+                win_probability = fight_win_probability(
+                    ship, defender, attacker_cards, defender_cards, exact
+                )
+                probability = (
+                    win_probability * on_win.probability
+                    + (1 - win_probability) * on_loss.probability
+                )
+                if best is None or probability > best.probability:
+                    best = AttackPlan(probability, (ship, defender), on_win, on_loss)
+        return best
+
+    return best_plan(
+        tuple(sorted(attacker_ship_dice)), tuple(sorted(defender_ship_dice))
+    )
+
+
+def _remove_one(dice, die):
+    index = dice.index(die)
+    return dice[:index] + dice[index + 1 :]
+
+
+def canonical_cards(cards):
+    """Return the given cards as a tuple, in the order of CARDS
+
+    This is the order the results table uses for hands"""
+
+    return tuple(card for card in CARDS if card in (cards or ()))
+
+
+def evaluate_battles(battles, exact=False, fight_probability=None):
+    """Yield each given battle along with the probability the attacker wins it
+
+    Each battle is a dict, with:
+
+        fights: a list of [attacker ship die, defender ship die] pairs, each
+            optionally followed by the attacker's and defender's cards for just
+            that fight
+        attacker_cards, defender_cards: the cards used by any fight that
+            doesn't give its own (default: no cards)
+        win_condition, at_least: as for battle_win_probability
+
+    By default, the win probability of each fight is looked up in the results
+    table (or, if exact, calculated by the exact engine); fight_probability may
+    instead be any function taking (attacker ship die, defender ship die,
+    attacker cards, defender cards). Since the same fights come up over and
+    over again, each is only looked up once no matter how many battles it's in.
+
+    Battles are consumed (and results yielded) one at a time, so any number of
+    them can be streamed through"""
+
+    if fight_probability is None:
+        fight_probability = functools.partial(fight_win_probability, exact=exact)
+    fight_probability = functools.lru_cache(maxsize=None)(fight_probability)
+
+    for battle in battles:
+        probabilities = []
+        for attacker_ship_die, defender_ship_die, *cards in battle["fights"]:
+            if cards:
+                attacker_cards, defender_cards = cards
+            else:
+                attacker_cards = battle.get("attacker_cards")
+                defender_cards = battle.get("defender_cards")
+            probabilities.append(
+                fight_probability(
+                    attacker_ship_die,
+                    defender_ship_die,
+                    canonical_cards(attacker_cards),
+                    canonical_cards(defender_cards),
+                )
+            )
+
+        yield battle, battle_win_probability(
+            wins_distribution(probabilities),
+            battle.get("win_condition", "all"),
+            battle.get("at_least"),
+        )
+
+
+def win_condition_label(num_fights, win_condition="all", at_least=None):
+    """Return a description of the fights the attacker must win (e.g. "ALL
+    fights", or "at least 2 fights") to win the battle"""
+
+    needed = min_wins(num_fights, win_condition, at_least)
+    if needed == num_fights:
+        return "ALL fights"
+    if needed == 1:
+        return "ANY fight"
+    return f"at least {needed} fights"
+
+
+def battle_summary(
+    fights,
+    attacker_cards,
+    defender_cards,
+    win_condition,
+    probabilities=None,
+    at_least=None,
+):
+    label = win_condition_label(len(fights), win_condition, at_least)
+    print(f"Attacker must win {label} to win battle")
+    if probabilities is None:
+        probabilities = fight_win_probabilities(
+            fights, attacker_cards, defender_cards, exact=False
+        )
+    for fight_num, (fight, prob) in enumerate(zip(fights, probabilities), 1):
+        attacker_ship_die, defender_ship_die = fight
         print(
             f"Fight {fight_num}: "
             f"{attacker_ship_die} ({attacker_cards}) attacks "
@@ -94,26 +375,89 @@ def main():
     # print(f"{args.fights=}")
     fights = parse_fights(args.fights)
     # print(f"{fights=}")
-    battle_summary(fights, args.attacker_cards, args.defender_cards, args.win_condition)
+    if args.battles:
+        with open(args.battles) if args.battles != "-" else sys.stdin as file:
+            battles = (json.loads(line) for line in file if line.strip())
+            for battle, probability in evaluate_battles(battles, exact=args.exact):
+                print(json.dumps({**battle, "probability": float(probability)}))
+        return
+
+    if args.ships:
+        plan = plan_attacks(
+            args.ships,
+            args.targets,
+            args.attacker_cards,
+            args.defender_cards,
+            args.win_condition,
+            args.at_least,
+            exact=not args.table,
+        )
+        print(f"{plan.probability:.2%} chance that attacker wins, attacking:")
+        # The plan as long as every attack succeeds; after a loss, it changes
+        while plan.attack:
+            attacker_ship_die, defender_ship_die = plan.attack
+            print(
+                f"  {attacker_ship_die} -> {defender_ship_die} "
+                f"({plan.probability:.2%} from here)"
+            )
+            plan = plan.on_win
+        return
+
+    win_condition_str = win_condition_label(
+        len(fights), args.win_condition, args.at_least
+    )
 
-    attacker_wins_battle_total = 0
-    foo = {}
-    for __ in range(args.num_trials):
-        attacker_wins_battle, num_attacker_wins = do_battle(
+    if args.exact or args.table:
+        probabilities = fight_win_probabilities(
+            fights, args.attacker_cards, args.defender_cards, exact=args.exact
+        )
+        battle_summary(
             fights,
             args.attacker_cards,
             args.defender_cards,
-            win_condition=args.win_condition,
+            args.win_condition,
+            probabilities=[float(probability) for probability in probabilities],
+            at_least=args.at_least,
+        )
+        distribution = wins_distribution(probabilities)
+        for num_attacker_wins, probability in enumerate(distribution):
+            print(f"  Wins {num_attacker_wins} fights: {float(probability):.2%}")
+        win_ratio = battle_win_probability(
+            distribution, args.win_condition, args.at_least
+        )
+        print(f"{float(win_ratio):.2%} chance that attacker wins {win_condition_str}")
+        return
+
+    battle_summary(
+        fights,
+        args.attacker_cards,
+        args.defender_cards,
+        args.win_condition,
+        at_least=args.at_least,
+    )
+
+    compiled_fights = compile_fights(
+        fights, args.attacker_cards, args.defender_cards, rng=random.Random(args.seed)
+    )
+    needed = min_wins(len(fights), args.win_condition, args.at_least)
+    attacker_wins_battle_total = 0
+    num_attacker_wins_counts = Counter()
+    for __ in range(args.num_trials):
+        attacker_wins_battle, num_attacker_wins = do_compiled_battle(
+            compiled_fights, needed, stop_early=args.stop_early
         )
         if attacker_wins_battle:
             attacker_wins_battle_total += 1
 
-        foo[num_attacker_wins] = num_attacker_wins
-        # print(attacker_wins_battle)
+        num_attacker_wins_counts[num_attacker_wins] += 1
 
+    if not args.stop_early:
+        # Battles that stopped early don't count every fight won
+        for num_attacker_wins in range(len(fights) + 1):
+            ratio = num_attacker_wins_counts[num_attacker_wins] / args.num_trials
+            print(f"  Wins {num_attacker_wins} fights: {ratio:.2%}")
     win_ratio = attacker_wins_battle_total / args.num_trials
     print(f"{attacker_wins_battle_total} / {args.num_trials} = {win_ratio:.2%}")
-    print(foo)
 
 
 # TODO: parse 1to6
@@ -124,13 +468,71 @@ def parse_fights(fights_str):
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("fights", nargs="+")
+    parser.add_argument("fights", nargs="*")
+    parser.add_argument(
+        "--ships",
+        nargs="+",
+        type=int,
+        help="Instead of simulating the given fights, plan which of these ship "
+        "dice should attack which --targets, in what order",
+    )
+    parser.add_argument(
+        "--targets", nargs="+", type=int, help="Defender ship dice (see --ships)"
+    )
+    parser.add_argument(
+        "-B",
+        "--battles",
+        help="Instead of simulating the given fights, evaluate every battle in "
+        "this file (- for stdin), one JSON object per line (see "
+        "evaluate_battles), against the results table (or, with --exact, the "
+        "exact engine). Prints each battle with its probability as it goes",
+    )
     parser.add_argument("-a", "--attacker-cards", nargs="+", choices=CARDS)
     parser.add_argument("-d", "--defender-cards", nargs="+", choices=CARDS)
     parser.add_argument("-n", "--num-trials", type=int, default=1000)
-    parser.add_argument("-w", "--win-condition", choices=["all", "any"])
+    parser.add_argument(
+        "-w", "--win-condition", choices=["all", "any"], default="all"
+    )
+    parser.add_argument(
+        "-k",
+        "--at-least",
+        type=int,
+        help="Instead of --win-condition, the attacker must win at least this "
+        "many fights",
+    )
+    parser.add_argument(
+        "-e",
+        "--exact",
+        action="store_true",
+        help="Calculate the exact distribution of fights won, using the exact "
+        "engine, instead of running trials",
+    )
+    parser.add_argument(
+        "-t",
+        "--table",
+        action="store_true",
+        help="Calculate the distribution of fights won from the results table "
+        "(see qq.py) instead of running trials",
+    )
+    parser.add_argument(
+        "-s",
+        "--stop-early",
+        action="store_true",
+        help="Stop each simulated battle as soon as it is decided. Faster, but "
+        "doesn't count how many fights are won",
+    )
+    parser.add_argument("--seed", type=int, help="Random seed")
     parser.add_argument("-v", "--verbose", action="store_true")
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.ships and not args.targets:
+        parser.error("--ships requires --targets")
+    if not (args.fights or args.ships or args.battles):
+        parser.error("Either fights, --ships, or --battles are required")
+    if args.at_least is not None and not args.battles:
+        num_fights = len(args.targets) if args.ships else len(args.fights)
+        if not 1 <= args.at_least <= num_fights:
+            parser.error(f"--at-least must be between 1 and {num_fights}")
+    return args
 
 
 def init_logging(level):
@@ -0,0 +1,163 @@
+"""Enumerating hands of cards, and pairs of hands that don't share a card
+
+Hands are ordered by size, then in the order itertools.combinations gives for
+the cards they're drawn from; pairs of (attacker, defender) hands are ordered
+by attacker hand, then defender hand (drawn from the cards left over). Every
+hand and pair has a rank (its index in that order). Ranking and unranking work
+out the index directly rather than enumerating anything, so they stay cheap
+however many cards (and however big hands) there are"""
+
+import itertools
+from math import comb
+
+# The most cards a hand can hold
+MAX_HAND_SIZE = 3
+
+
+def iter_hands(cards, max_hand_size=MAX_HAND_SIZE):
+    """Lazily yield every hand of up to max_hand_size of the given cards, in
+    order"""
+
+    for hand_size in range(max_hand_size + 1):
+        yield from itertools.combinations(cards, hand_size)
+
+
+def iter_hand_pairs(cards, max_hand_size=MAX_HAND_SIZE):
+    """Lazily yield every (attacker hand, defender hand) pair that doesn't share
+    a card, in order"""
+
+    for attacker_hand in iter_hands(cards, max_hand_size):
+        remaining_cards = [card for card in cards if card not in attacker_hand]
+        for defender_hand in iter_hands(remaining_cards, max_hand_size):
+            yield attacker_hand, defender_hand
+
+
+def count_hands(num_cards, max_hand_size=MAX_HAND_SIZE):
+    """Return the number of hands of up to max_hand_size of num_cards cards"""
+    return sum(comb(num_cards, hand_size) for hand_size in range(max_hand_size + 1))
+
+
+def count_hand_pairs(num_cards, max_hand_size=MAX_HAND_SIZE):
+    """Return the number of pairs of hands of num_cards cards that don't share a
+    card"""
+
+    return sum(
+        comb(num_cards, hand_size) * count_hands(num_cards - hand_size, max_hand_size)
+        for hand_size in range(min(max_hand_size, num_cards) + 1)
+    )
+
+
+def _positions(hand, cards):
+    """Return the (sorted) positions of the cards of a hand in cards"""
+
+    positions = sorted(cards.index(card) for card in hand if card in cards)
+    if len(positions) != len(hand):
+        raise ValueError(f"{hand} isn't a hand of {cards}")
+    if len(set(positions)) != len(positions):
+        raise ValueError(f"{hand} holds the same card more than once")
+    return positions
+
+
+def _rank_combination(positions, num_cards):
+    """Return the rank of a combination (given by its sorted positions) among
+    the combinations of as many of num_cards, in itertools.combinations order"""
+
+    hand_size = len(positions)
+    rank = 0
+    previous = -1
+    for i, position in enumerate(positions):
+        # Skip every combination that has a lower card in this position
+        for skipped in range(previous + 1, position):
+            rank += comb(num_cards - 1 - skipped, hand_size - 1 - i)
+        previous = position
+    return rank
+
+
+def _unrank_combination(rank, hand_size, num_cards):
+    """Return the sorted positions of the combination with the given rank; the
+    inverse of _rank_combination"""
+
+    positions = []
+    position = 0
+    for i in range(hand_size):
+        while True:
+            num_with_position = comb(num_cards - 1 - position, hand_size - 1 - i)
+            if rank < num_with_position:
+                break
+            rank -= num_with_position
+            position += 1
+        positions.append(position)
+        position += 1
+    return positions
+
+
+def rank_hand(hand, cards, max_hand_size=MAX_HAND_SIZE):
+    """Return the rank of a hand (in any order) among the hands of cards"""
+
+    if len(hand) > max_hand_size:
+        raise ValueError(f"{hand} holds more than {max_hand_size} cards")
+    # Every smaller hand comes first
+    offset = sum(comb(len(cards), smaller) for smaller in range(len(hand)))
+    return offset + _rank_combination(_positions(hand, cards), len(cards))
+
+
+def unrank_hand(rank, cards, max_hand_size=MAX_HAND_SIZE):
+    """Return the hand of cards with the given rank; the inverse of rank_hand"""
+
+    if not 0 <= rank < count_hands(len(cards), max_hand_size):
+        raise IndexError(f"No hand of {cards} has rank {rank}")
+    hand_size = 0
+    while rank >= comb(len(cards), hand_size):
+        rank -= comb(len(cards), hand_size)
+        hand_size += 1
+    return tuple(
+        cards[position]
+        for position in _unrank_combination(rank, hand_size, len(cards))
+    )
+
+
+def rank_hand_pair(attacker_hand, defender_hand, cards, max_hand_size=MAX_HAND_SIZE):
+    """Return the rank of a pair of hands (each in any order) among the pairs
+    of hands of cards that don't share a card"""
+
+    if len(attacker_hand) > max_hand_size:
+        raise ValueError(f"{attacker_hand} holds more than {max_hand_size} cards")
+    num_cards = len(cards)
+    hand_size = len(attacker_hand)
+    num_defender_hands = count_hands(num_cards - hand_size, max_hand_size)
+    # Every pair with a smaller attacker hand comes first
+    rank = sum(
+        comb(num_cards, smaller) * count_hands(num_cards - smaller, max_hand_size)
+        for smaller in range(hand_size)
+    )
+    rank += (
+        _rank_combination(_positions(attacker_hand, cards), num_cards)
+        * num_defender_hands
+    )
+    remaining_cards = [card for card in cards if card not in attacker_hand]
+    return rank + rank_hand(defender_hand, remaining_cards, max_hand_size)
+
+
+def unrank_hand_pair(rank, cards, max_hand_size=MAX_HAND_SIZE):
+    """Return the (attacker hand, defender hand) pair with the given rank; the
+    inverse of rank_hand_pair"""
+
+    if not 0 <= rank < count_hand_pairs(len(cards), max_hand_size):
+        raise IndexError(f"No pair of hands of {cards} has rank {rank}")
+    num_cards = len(cards)
+    hand_size = 0
+    while True:
+        num_defender_hands = count_hands(num_cards - hand_size, max_hand_size)
+        num_pairs = comb(num_cards, hand_size) * num_defender_hands
+        if rank < num_pairs:
+            break
+        rank -= num_pairs
+        hand_size += 1
+
+    attacker_rank, defender_rank = divmod(rank, num_defender_hands)
+    attacker_hand = tuple(
+        cards[position]
+        for position in _unrank_combination(attacker_rank, hand_size, num_cards)
+    )
+    remaining_cards = [card for card in cards if card not in attacker_hand]
+    return attacker_hand, unrank_hand(defender_rank, remaining_cards, max_hand_size)
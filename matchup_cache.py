@@ -0,0 +1,270 @@
+"""Persistent, content-addressed cache of matchup results
+
+Results are keyed by everything that can change them: both hands, the
+attacker's advantage, how the result was calculated (exact, or Monte Carlo with
+a given number of trials, seed, etc.), and a hash of the code implementing the
+combat rules and the method used to calculate it. Changing the rules therefore
+invalidates every existing entry, and changing how one method works invalidates
+every entry calculated that way"""
+
+from pathlib import Path
+import functools
+import hashlib
+import inspect
+import json
+import pickle
+import sqlite3
+import time
+
+from quantum import (
+    DEFAULT_CACHE_PATH,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    Attacker,
+    Defender,
+    Side,
+    _combat_die_faces,
+    derive_seed,
+    do_adaptive_iterations,
+    do_iterations,
+    estimate_matchup,
+    estimate_matchup_importance,
+    evaluate_matchups,
+    exact_win_probability,
+    make_rng,
+    matchup_seed_key,
+    run_matchup_chunk,
+    totals_by_combat_die,
+    wilson_interval,
+)
+
+# The code that determines the outcome of a matchup
+RULES = (Side, Attacker, Defender)
+
+
+@functools.lru_cache(maxsize=None)
+def source_version(kernels):
+    """Return a hash of the given kernels: the source code of functions and
+    classes, and the values of constants"""
+
+    source = "\n".join(
+        inspect.getsource(kernel) if callable(kernel) else repr(kernel)
+        for kernel in kernels
+    )
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def rules_version():
+    """Return a hash of the source code of the combat rules"""
+    return source_version(RULES)
+
+
+def method_kernels(method):
+    """Return everything (functions, classes, and constants) that a matchup's
+    result is calculated with by the given method (see matchup_key), besides
+    the combat rules themselves"""
+
+    if method.get("exact"):
+        return (exact_win_probability, _combat_die_faces, totals_by_combat_die)
+
+    # How trials are split up, and where their random numbers come from
+    kernels = [
+        evaluate_matchups,
+        DEFAULT_CHUNK_SIZE,
+        run_matchup_chunk,
+        derive_seed,
+        matchup_seed_key,
+    ]
+    if method.get("importance_sampling") or method.get("batch"):
+        # NumPy is only needed for these methods
+        import quantum_batch
+
+        kernels += [
+            quantum_batch.BatchSide,
+            quantum_batch.MAX_ATTACKER_ROLLS,
+            quantum_batch.MAX_DEFENDER_ROLLS,
+            quantum_batch.DEFAULT_BATCH_SIZE,
+            totals_by_combat_die,
+            quantum_batch.batch_attack,
+        ]
+    if method.get("importance_sampling"):
+        return (
+            *kernels,
+            estimate_matchup_importance,
+            quantum_batch.do_iterations_importance,
+            quantum_batch.PILOT_TRIALS,
+            quantum_batch.RARE_THRESHOLD,
+            quantum_batch.TILTS,
+            quantum_batch.importance_weights,
+            quantum_batch.tilted_face_probabilities,
+            quantum_batch.relative_variance,
+        )
+
+    if method.get("batch"):
+        kernels += [quantum_batch.do_iterations_batch, quantum_batch.draw_combat_dice]
+    else:
+        kernels += [make_rng, do_iterations]
+    if method.get("target_half_width"):
+        kernels += [estimate_matchup, do_adaptive_iterations, wilson_interval]
+    return tuple(kernels)
+
+
+def method_version(method):
+    """Return a hash of everything that calculates a matchup's result by the
+    given method"""
+    return source_version(method_kernels(method))
+
+
+def matchup_key(attacker_cards, defender_cards, attacker_advantage, method):
+    """Return the cache key for a single matchup
+
+    method is a dict describing how the result is calculated, e.g.
+    {"exact": True} or {"num_trials": 1000, "seed": 1}"""
+
+    key = {
+        "attacker_cards": sorted(attacker_cards or ()),
+        "defender_cards": sorted(defender_cards or ()),
+        "attacker_advantage": attacker_advantage,
+        "method": method,
+        "rules_version": rules_version(),
+        "method_version": method_version(method),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+# How many reads' updates to when entries were last used are held back, to be
+# written at once
+TOUCH_BATCH_SIZE = 100
+
+
+class MatchupCache:
+    """A size-limited, least-recently-used cache of matchup results on disk
+
+    This is safe to share between processes (e.g. dask workers): each process
+    opens its own connection to the underlying SQLite database on first use.
+    Reads don't write anything until TOUCH_BATCH_SIZE of them have been made
+    (or something is added), so recency is only tracked approximately"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_CACHE_SIZE):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._connection = None
+        # Maps keys that have been read to when, until that's written
+        self._touched = {}
+        # How many entries there are, as far as this process knows (other
+        # processes' additions are only noticed when it reopens)
+        self._num_entries = None
+
+    def __getstate__(self):
+        # Connections can't be pickled; the unpickled cache will open its own
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_touched"] = {}
+        state["_num_entries"] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS matchups ("
+                    "key TEXT PRIMARY KEY, rules_version TEXT, value BLOB, "
+                    "last_used REAL)"
+                )
+                self._connection.execute(
+                    "CREATE INDEX IF NOT EXISTS matchups_last_used "
+                    "ON matchups (last_used)"
+                )
+                # Anything calculated under different rules can never be hit
+                self._connection.execute(
+                    "DELETE FROM matchups WHERE rules_version != ?",
+                    (rules_version(),),
+                )
+        return self._connection
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM matchups").fetchone()[0]
+
+    def get(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM matchups WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return default
+
+        self._touched[key] = time.time()
+        if len(self._touched) >= TOUCH_BATCH_SIZE:
+            with self.connection:
+                self._write_touched()
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        with self.connection:
+            self._write_touched()
+            if self._num_entries is None:
+                self._num_entries = len(self)
+            replaced = self.connection.execute(
+                "SELECT 1 FROM matchups WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO matchups VALUES (?, ?, ?, ?)",
+                (key, rules_version(), pickle.dumps(value), time.time()),
+            )
+            if replaced is None:
+                self._num_entries += 1
+
+            # Evict the least-recently-used entries beyond the size limit
+            if self._num_entries > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM matchups WHERE key IN ("
+                    "SELECT key FROM matchups ORDER BY last_used LIMIT ?)",
+                    (self._num_entries - self.max_entries,),
+                )
+                self._num_entries = self.max_entries
+
+    def flush(self):
+        """Write when entries that have been read were last used"""
+        with self.connection:
+            self._write_touched()
+
+    def _write_touched(self):
+        self.connection.executemany(
+            "UPDATE matchups SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def get_matchup(self, attacker_cards, defender_cards, attacker_advantage, method):
+        """Return the cached result for a matchup, or None"""
+        return self.get(
+            matchup_key(attacker_cards, defender_cards, attacker_advantage, method)
+        )
+
+    def set_matchup(
+        self, attacker_cards, defender_cards, attacker_advantage, method, result
+    ):
+        self.set(
+            matchup_key(attacker_cards, defender_cards, attacker_advantage, method),
+            result,
+        )
+
+    def get_or_calculate(
+        self, attacker_cards, defender_cards, attacker_advantage, method, calculate
+    ):
+        """Return the cached result for a matchup, calculating it if necessary"""
+
+        key = matchup_key(attacker_cards, defender_cards, attacker_advantage, method)
+        result = self.get(key)
+        if result is None:
+            result = calculate()
+            self.set(key, result)
+        return result
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM matchups")
+        self._touched.clear()
+        self._num_entries = 0
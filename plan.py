@@ -0,0 +1,142 @@
+"""Plan how many actions to spend reconfiguring a ship before attacking
+
+Reconfiguring changes a ship's die, and each ship die has a different chance of
+winning a given fight. This combines the two: every possible way of
+reconfiguring (see roll.best_reconfigure) is weighed by the win probability of
+the ship die it ends up on (see battle.fight_win_probability). Both are cached,
+so planning many fights (e.g. a whole board) only solves each piece once"""
+
+import argparse
+
+from battle import canonical_cards, fight_win_probability
+from quantum import CARDS
+from roll import best_reconfigure
+
+# Attacking itself takes an action
+ATTACK_COST = 1
+
+
+def attack_rewards(
+    defender_ship_die, attacker_cards=None, defender_cards=None, exact=True
+):
+    """Return the probability of winning the fight with each ship die, 1-6"""
+
+    return tuple(
+        fight_win_probability(
+            ship_die,
+            defender_ship_die,
+            canonical_cards(attacker_cards),
+            canonical_cards(defender_cards),
+            exact,
+        )
+        for ship_die in range(1, 7)
+    )
+
+
+def plan_reconfigure_attack(
+    ship_die,
+    defender_ship_die,
+    abilities,
+    actions,
+    attacker_cards=None,
+    defender_cards=None,
+    exact=True,
+):
+    """Return the best chance of winning a fight, reconfiguring first if worth it
+
+    Any actions not needed for the attack can be spent reconfiguring, along with
+    any abilities. Return a (probability, move) tuple, where move is the first
+    move to make: "attack", or a reconfigure move (see roll.best_reconfigure)"""
+
+    if actions < ATTACK_COST:
+        return 0.0, None
+
+    probability, move = best_reconfigure(
+        ship_die,
+        attack_rewards(defender_ship_die, attacker_cards, defender_cards, exact),
+        abilities,
+        actions - ATTACK_COST,
+    )
+    return probability, move or "attack"
+
+
+def plan_board(
+    ship_dice,
+    defender_ship_dice,
+    abilities,
+    actions,
+    attacker_cards=None,
+    defender_cards=None,
+    exact=True,
+):
+    """Plan every ship's attack on every defender
+
+    Return a dict mapping each (ship die, defender ship die) to its
+    plan_reconfigure_attack"""
+
+    return {
+        (ship_die, defender_ship_die): plan_reconfigure_attack(
+            ship_die,
+            defender_ship_die,
+            abilities,
+            actions,
+            attacker_cards,
+            defender_cards,
+            exact,
+        )
+        for ship_die in ship_dice
+        for defender_ship_die in defender_ship_dice
+    }
+
+
+def main():
+    args = parse_args()
+    exact = not args.table
+    print(
+        f"Attacking with {args.ship_die} ({args.attacker_cards}) vs. "
+        f"{args.defender_ship_die} ({args.defender_cards}):"
+    )
+    for actions in range(ATTACK_COST, args.actions + 1):
+        probability, move = plan_reconfigure_attack(
+            args.ship_die,
+            args.defender_ship_die,
+            args.abilities,
+            actions,
+            args.attacker_cards,
+            args.defender_cards,
+            exact,
+        )
+        print(
+            f"  With {actions} actions: {float(probability):.2%} chance of winning "
+            f"(first move: {move})"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Plan reconfiguring a ship before attacking with it"
+    )
+    parser.add_argument("ship_die", type=int, choices=range(1, 7))
+    parser.add_argument("defender_ship_die", type=int, choices=range(1, 7))
+    parser.add_argument("-a", "--abilities", type=int, default=1)
+    parser.add_argument(
+        "-A",
+        "--actions",
+        type=int,
+        default=3,
+        help="Actions available, including the one for the attack itself",
+    )
+    parser.add_argument("--attacker-cards", nargs="+", choices=CARDS)
+    parser.add_argument("--defender-cards", nargs="+", choices=CARDS)
+    parser.add_argument(
+        "-t",
+        "--table",
+        action="store_true",
+        help="Look up win probabilities in the results table (see qq.py) instead "
+        "of calculating them exactly",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 """Take interval-based images from a webcam"""
 
 from datetime import datetime, timedelta
-from functools import reduce
+from functools import lru_cache, reduce
 from pathlib import Path
 from pprint import pprint
 import operator
@@ -14,7 +14,7 @@ import random
 import subprocess
 
 from quantum import Attacker, Defender, CARDS
-from table import load
+from results_table import DEFAULT_RESULTS_TABLE_PATH, ResultsTable
 
 logger = logging.getLogger(__name__)
 
@@ -31,18 +31,23 @@ def prob_of_win2(probabilities):
     return 1 - reduce(operator.mul, [1 - p for p in probabilities])
 
 
+@lru_cache(maxsize=None)
+def load_results(path):
+    """Open a results table once, so that repeated lookups don't reopen it"""
+    return ResultsTable(path)
+
+
 def qq(
-    attacker_ship_die, defender_ship_die, attacker_cards, defender_cards, input_path=None
+    attacker_ship_die,
+    defender_ship_die,
+    attacker_cards,
+    defender_cards,
+    input_path=DEFAULT_RESULTS_TABLE_PATH,
 ):
-    if input_path is None:
-        input_path = (
-            f"attacker_{','.join(attacker_cards) if attacker_cards else 'empty'}.pkl"
-        )
-    results_for_attacker_cards = load(input_path)
-
-    return results_for_attacker_cards[defender_cards][
-        attacker_ship_die, defender_ship_die
-    ]
+    ratio, _num_trials = load_results(str(input_path)).get(
+        attacker_cards, defender_cards, attacker_ship_die - defender_ship_die
+    )
+    return ratio
 
 
 def main():
@@ -60,11 +65,11 @@ def main():
             )
 
     res = qq(
-        args.input,
         args.attacker_ship_die,
         args.defender_ship_die,
         tuple(args.attacker_cards) if args.attacker_cards else (),
         tuple(args.defender_cards) if args.defender_cards else (),
+        input_path=args.input,
     )
     attacker = Attacker(args.attacker_ship_die, args.attacker_cards)
     defender = Defender(args.defender_ship_die, args.defender_cards)
@@ -81,7 +86,7 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("attacker_ship_die", type=int)
     parser.add_argument("defender_ship_die", type=int)
-    parser.add_argument("-i", "--input", default="./all_results.pkl", type=Path)
+    parser.add_argument("-i", "--input", default=DEFAULT_RESULTS_TABLE_PATH, type=Path)
     parser.add_argument("-n", "--trials", type=int)
     parser.add_argument("-a", "--attacker-cards", nargs="+", choices=CARDS)
     parser.add_argument("-d", "--defender-cards", nargs="+", choices=CARDS)
@@ -1,9 +1,15 @@
 """Take interval-based images from a webcam"""
 
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from fractions import Fraction
 from pathlib import Path
 from pprint import pprint
 import argparse
+import functools
+import hashlib
+import itertools
 import logging
 import math
 import operator
@@ -15,6 +21,11 @@ import subprocess
 
 logger = logging.getLogger(__name__)
 
+# Whether to log a trace of every roll, recalc and attack (at DEBUG level). The
+# combat code checks this before building any log message, so tracing costs
+# next to nothing when it's off. Use set_tracing to change it
+TRACE = False
+
 CARDS = [
     "ferocious",
     "relentless",
@@ -25,9 +36,34 @@ CARDS = [
     "stubborn",
 ]
 
+# Every possible difference between attacker and defender ship dice
+ATTACKER_ADVANTAGES = range(1 - 6, 6 - 1 + 1)
+
+# Number of trials run between precision checks in do_adaptive_iterations
+DEFAULT_CHUNK_SIZE = 1000
+
+# Where (and how many) matchup results are cached; see matchup_cache
+DEFAULT_CACHE_PATH = Path("~/.cache/quantum_bg/matchups.sqlite3").expanduser()
+DEFAULT_CACHE_SIZE = 100000
+
+# An attacker win ratio along with the number of trials it was calculated over
+# and its (low, high) confidence interval
+Estimate = namedtuple("Estimate", ["ratio", "num_trials", "low", "high"])
+
 
 class Side:
-    def __init__(self, ship_die, cards=None, combat_die_rolls=None):
+    # Where random combat die rolls come from; anything with a randint method
+    # (e.g. a random.Random instance) can be given to __init__ instead
+    rng = random
+
+    def __init__(
+        self,
+        ship_die,
+        cards=None,
+        combat_die_rolls=None,
+        combat_log_size=0,
+        rng=None,
+    ):
         if not (1 <= ship_die <= 6):
             raise ValueError(f"ship_die must be between 1 and 6! Got: {ship_die}")
 
@@ -53,8 +89,17 @@ class Side:
                     f"All combat_die_rolls must be between 1 and 6! Got: {combat_die}"
                 )
 
+        if rng is not None:
+            self.rng = rng
+
         self.roll_counter = 0
-        self.combat_log = []
+        # Combat logging is opt-in, since it allocates on every recalc. A size of
+        # 0 disables it, None keeps everything, and anything else keeps only
+        # that many of the most recent entries
+        if combat_log_size == 0:
+            self.combat_log = None
+        else:
+            self.combat_log = deque(maxlen=combat_log_size)
 
     def __repr__(self):
         return f"{self.__class__.__name__}(ship_die={self.ship_die}, combat_die={self.combat_die}, cards={self.cards})"
@@ -81,7 +126,8 @@ class Side:
 
     def roll(self):
         if "rational" in self.cards:
-            logger.debug("Presence of rational card forces roll of 3!")
+            if TRACE:
+                logger.debug("Presence of rational card forces roll of 3!")
             the_roll = 3
 
         elif self.predefined_combat_die_rolls:
@@ -90,11 +136,14 @@ class Side:
             except IndexError:
                 # TODO: We can do better than this
                 raise ValueError("You need to give more predifined rolls!")
-            logger.debug(
-                f"Returning explicitly-defined roll #{self.roll_counter}: {the_roll}"
-            )
+            if TRACE:
+                logger.debug(
+                    "Returning explicitly-defined roll #%s: %s",
+                    self.roll_counter,
+                    the_roll,
+                )
         else:
-            the_roll = random.randint(1, 6)
+            the_roll = self.rng.randint(1, 6)
 
         self.combat_die = the_roll
         self.combat_die_rolls.append(the_roll)
@@ -109,11 +158,13 @@ class Side:
             return total
 
         if "ferocious" in self.cards:
-            logger.debug("Lowered effective roll by 1 due to Ferocious")
+            if TRACE:
+                logger.debug("Lowered effective roll by 1 due to Ferocious")
             total -= 1
 
         if "strategic" in self.cards:
-            logger.debug("Lowered effective roll by 1 due to Strategic")
+            if TRACE:
+                logger.debug("Lowered effective roll by 2 due to Strategic")
             total -= 2
 
         return total
@@ -121,11 +172,12 @@ class Side:
     def reset(self):
         self.combat_die = None
         self.roll_counter = 0
-        self.combat_die_rolls = []
+        # Cleared in place, so that trials don't allocate a new list each
+        self.combat_die_rolls.clear()
 
     def history(self):
         history = []
-        for attacker, defender, attacker_wins in self.combat_log:
+        for attacker, defender, attacker_wins in self.combat_log or ():
             attacker_ship_die, attacker_combat_die, attacker_total = attacker
             defender_ship_die, defender_combat_die, defender_total = defender
             vstring = "Attacker" if attacker_wins else "Defender"
@@ -142,28 +194,36 @@ class Attacker(Side):
         attacker_total = attacker.total()
         defender_total = defender.total()
         attacker_wins = comparator(attacker_total, defender_total)
-        logger.debug(f"recalc {attacker_total=} {defender_total=}")
+        if TRACE:
+            logger.debug(
+                "recalc attacker_total=%s defender_total=%s",
+                attacker_total,
+                defender_total,
+            )
         winner, loser = (attacker, defender) if attacker_wins else (defender, attacker)
 
-        self.combat_log.append(
-            (
-                (attacker.ship_die, attacker.combat_die, attacker.total()),
-                (defender.ship_die, defender.combat_die, defender.total()),
-                attacker == winner,
+        if self.combat_log is not None:
+            self.combat_log.append(
+                (
+                    (attacker.ship_die, attacker.combat_die, attacker.total()),
+                    (defender.ship_die, defender.combat_die, defender.total()),
+                    attacker == winner,
+                )
             )
-        )
         return winner, loser
 
     def attack(self, defender):
         attacker = self
 
-        logger.debug(f"{attacker=} attacking {defender=}")
+        if TRACE:
+            logger.debug("attacker=%r attacking defender=%r", attacker, defender)
 
         attacker.roll()
         defender.roll()
         winner, loser = self.recalc(attacker, defender)
 
-        logger.debug(f"{winner=} vs. {loser=}")
+        if TRACE:
+            logger.debug("winner=%r vs. loser=%r", winner, loser)
 
         # If the LOSER holds Relentless, they can re-roll
         # We assume that the loser will ALWAYS do this, and that the winner
@@ -172,7 +232,7 @@ class Attacker(Side):
             prev_winner = winner
             loser.roll()
             winner, loser = self.recalc(attacker, defender)
-            if prev_winner != winner:
+            if TRACE and prev_winner != winner:
                 logger.debug("Upset due to Relentless!")
 
         # If the ATTACKER holds Scrappy, they can re-roll
@@ -182,7 +242,7 @@ class Attacker(Side):
             prev_winner = winner
             loser.roll()
             winner, loser = self.recalc(attacker, defender)
-            if prev_winner != winner:
+            if TRACE and prev_winner != winner:
                 logger.debug("Upset due to Scrappy!")
 
         # If the LOSER holds Cruel, they can force the WINNER to re-roll
@@ -192,8 +252,8 @@ class Attacker(Side):
             prev_winner = winner
             winner.roll()
             winner, loser = self.recalc(attacker, defender)
-            if prev_winner != winner:
-                logger.debug("Upset due to Relentless!")
+            if TRACE and prev_winner != winner:
+                logger.debug("Upset due to Cruel!")
 
         # If the DEFENDER holds Stubborn, then they break ties
         if loser == defender and "stubborn" in defender.cards:
@@ -202,7 +262,7 @@ class Attacker(Side):
             # EQUAL TO, it only wins if it is strictly LESS THAN the defender
             # total
             winner, loser = self.recalc(attacker, defender, comparator=operator.lt)
-            if prev_winner != winner:
+            if TRACE and prev_winner != winner:
                 logger.debug("Upset due to Stubborn!")
 
         if (
@@ -224,11 +284,10 @@ class Attacker(Side):
                 f"{defender.combat_die_rolls}"
             )
 
-        logger.debug(f"{attacker=} vs. {defender=}")
-        logger.debug(f"{winner=} vs. {loser=}")
-
-
-        logger.debug(f"end attack: {winner == attacker=}")
+        if TRACE:
+            logger.debug("attacker=%r vs. defender=%r", attacker, defender)
+            logger.debug("winner=%r vs. loser=%r", winner, loser)
+            logger.debug("end attack: attacker wins=%s", winner == attacker)
         return winner == attacker
 
 
@@ -240,6 +299,17 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--save", type=Path)
     parser.add_argument("-i", "--compare-to", type=Path)
+    parser.add_argument(
+        "--crn",
+        action="store_true",
+        help="Instead of comparing against saved results (see --compare-to), "
+        "compare against the base cards (see --base-attacker-cards and "
+        "--base-defender-cards) using the same combat dice for both. This "
+        "gives much more precise differences for the same number of trials "
+        "(requires NumPy)",
+    )
+    parser.add_argument("--base-attacker-cards", nargs="+", choices=CARDS)
+    parser.add_argument("--base-defender-cards", nargs="+", choices=CARDS)
     parser.add_argument("-a", "--attacker-cards", nargs="+", choices=CARDS)
     parser.add_argument(
         "-A", "--attackers", dest="attacker_ship_dice", nargs="+", type=int
@@ -255,6 +325,75 @@ def parse_args():
         type=int,
     )
     parser.add_argument("-n", "--num-trials", type=int, default=1000)
+    parser.add_argument(
+        "-e",
+        "--exact",
+        action="store_true",
+        help="Calculate exact win probabilities instead of running trials",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="Run trials in vectorized batches (requires NumPy)",
+    )
+    parser.add_argument(
+        "-r",
+        "--rare",
+        action="store_true",
+        help="Estimate win ratios by importance sampling, which gives much "
+        "tighter intervals for lopsided matchups (requires NumPy)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Root random seed. Each matchup derives its own stream from it, so "
+        "results are reproducible",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to spread trials across. Results for a given "
+        "--seed are the same no matter how many are used",
+    )
+    parser.add_argument(
+        "-p",
+        "--precision",
+        type=float,
+        help="Run trials in chunks until the confidence interval half-width of "
+        "each win ratio is at most this (e.g. 0.0025). --num-trials becomes "
+        "the maximum number of trials per matchup",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the intervals used by --precision",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of trials per chunk; trials are run (and, with "
+        "--precision, checked) a chunk at a time",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        nargs="?",
+        const=DEFAULT_CACHE_PATH,
+        type=Path,
+        help="Look up (and store) matchup results in an on-disk cache (only "
+        "exact or seeded ones). Uses %(const)s if no path is given",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help="Maximum number of matchups to keep in the cache (see --cache)",
+    )
 
     parser.add_argument("-v", "--verbose", action="store_true")
     return parser.parse_args()
@@ -268,28 +407,538 @@ def init_logging(level):
     console_handler.setFormatter(logging.Formatter("%(message)s"))
     _logger.addHandler(console_handler)
     _logger.setLevel(level)
+    set_tracing(level <= logging.DEBUG)
+
+
+def set_tracing(enabled):
+    """Turn tracing of every roll and recalc on or off; see TRACE"""
+    global TRACE
+    TRACE = enabled
+
+
+def load(path):
+    with open(path, "rb") as file:
+        results = pickle.load(file)
+
+    return results
+
+
+def save(results, path):
+    with open(path, "wb") as file:
+        pickle.dump(results, file, protocol=5)
+
+
+def derive_seed(seed, *key):
+    """Derive an independent seed for the task identified by key
+
+    The derived seed only depends on the root seed and the key, so every task
+    gets the same stream no matter which worker runs it, or when. If seed is
+    None, so is the derived seed (i.e. fresh entropy is used)"""
+
+    if seed is None:
+        return None
+
+    digest = hashlib.sha256(repr((seed, *key)).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def make_rng(seed, *key):
+    """Return a random.Random for the task identified by key; see derive_seed"""
+    return random.Random(derive_seed(seed, *key))
+
+
+def matchup_seed_key(attacker, defender):
+    """Return the key that identifies a matchup for derive_seed
+
+    Outcomes only depend on the attacker's advantage (see
+    verify_advantage_equivalence), so that's what's in the key rather than the
+    ship dice: every pair of ship dice with the same advantage gets the same
+    stream, and so the same result, whichever pair is evaluated"""
+
+    return (
+        tuple(sorted(attacker.cards)),
+        tuple(sorted(defender.cards)),
+        attacker.ship_die - defender.ship_die,
+    )
 
 
-def do_iterations(attacker, defender, num_trials):
+def do_iterations(attacker, defender, num_trials, rng=None):
+    """Run num_trials attacks; return the number the attacker won
+
+    If rng is given, both sides roll with it (rather than their own) for the
+    duration"""
+
+    # Only the sides' own rngs (not Side.rng, the random module, which can't
+    # be pickled) are put back
+    original_rngs = [side.__dict__.get("rng") for side in (attacker, defender)]
+    if rng is not None:
+        attacker.rng = rng
+        defender.rng = rng
+
     attacker_win_count = 0
-    logger.debug("-" * 80)
-    for __ in range(num_trials):
-        attacker.reset()
-        defender.reset()
-        result = attacker.attack(defender)
-        attacker_win_count += int(result)
-        logger.debug("-" * 80)
+    try:
+        for __ in range(num_trials):
+            attacker.reset()
+            defender.reset()
+            result = attacker.attack(defender)
+            attacker_win_count += int(result)
+            if TRACE:
+                logger.debug("-" * 80)
+    finally:
+        if rng is not None:
+            for side, original_rng in zip((attacker, defender), original_rngs):
+                if original_rng is None:
+                    del side.rng
+                else:
+                    side.rng = original_rng
 
     return attacker_win_count
 
 
+def wilson_interval(win_count, num_trials, confidence=0.95):
+    """Return the (low, high) Wilson score interval for the given win ratio"""
+    if not num_trials:
+        raise ValueError("Can't calculate an interval without any trials!")
+
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    ratio = win_count / num_trials
+    denominator = 1 + z ** 2 / num_trials
+    center = (ratio + z ** 2 / (2 * num_trials)) / denominator
+    half_width = (
+        z
+        * math.sqrt(ratio * (1 - ratio) / num_trials + z ** 2 / (4 * num_trials ** 2))
+        / denominator
+    )
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def do_adaptive_iterations(
+    run_trials,
+    target_half_width,
+    max_trials,
+    confidence=0.95,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """Run trials in chunks until the win ratio is known to the given precision
+
+    run_trials is called with a number of trials and must return the number of
+    those the attacker won. Chunks are run until the half-width of the Wilson
+    interval is at most target_half_width, or until max_trials have been run.
+    Return an Estimate"""
+
+    if max_trials < 1:
+        raise ValueError(f"Can't run {max_trials} trials!")
+    if chunk_size < 1:
+        raise ValueError(f"Can't run trials in chunks of {chunk_size}!")
+
+    attacker_win_count = 0
+    num_trials = 0
+    while num_trials < max_trials:
+        chunk = min(chunk_size, max_trials - num_trials)
+        attacker_win_count += run_trials(chunk)
+        num_trials += chunk
+        low, high = wilson_interval(attacker_win_count, num_trials, confidence)
+        if (high - low) / 2 <= target_half_width:
+            break
+
+    return Estimate(attacker_win_count / num_trials, num_trials, low, high)
+
+
+def _combat_die_faces(side):
+    """Return each combat die face the given side can roll, with its probability"""
+    if "rational" in side.cards:
+        return ((3, Fraction(1)),)
+
+    return tuple((face, Fraction(1, 6)) for face in range(1, 7))
+
+
+def totals_by_combat_die(side):
+    """Map each combat die face to the total it gives the given side"""
+    combat_die = side.combat_die
+    totals = {}
+    for face in range(1, 7):
+        side.combat_die = face
+        totals[face] = side.total()
+    side.combat_die = combat_die
+    return totals
+
+
+def exact_win_probability(attacker, defender):
+    """Return the exact probability (as a Fraction) that attacker beats defender
+
+    Rather than sampling, this walks the full tree of combat die rolls --
+    including re-rolls due to Relentless, Scrappy, and Cruel -- applying the
+    same rules as Attacker.attack at each step"""
+
+    attacker_faces = _combat_die_faces(attacker)
+    defender_faces = _combat_die_faces(defender)
+    attacker_totals = totals_by_combat_die(attacker)
+    defender_totals = totals_by_combat_die(defender)
+
+    def attacker_wins(attacker_die, defender_die, comparator=operator.le):
+        return comparator(attacker_totals[attacker_die], defender_totals[defender_die])
+
+    def reroll(outcomes, get_side):
+        """Re-roll whichever side get_side picks for each outcome (if any)"""
+        rerolled = defaultdict(Fraction)
+        for (attacker_die, defender_die), prob in outcomes.items():
+            side = get_side(attacker_die, defender_die)
+            if side is attacker:
+                for face, face_prob in attacker_faces:
+                    rerolled[(face, defender_die)] += prob * face_prob
+            elif side is defender:
+                for face, face_prob in defender_faces:
+                    rerolled[(attacker_die, face)] += prob * face_prob
+            else:
+                rerolled[(attacker_die, defender_die)] += prob
+        return rerolled
+
+    # Maps (attacker combat die, defender combat die) to its probability
+    outcomes = {
+        (attacker_die, defender_die): attacker_prob * defender_prob
+        for attacker_die, attacker_prob in attacker_faces
+        for defender_die, defender_prob in defender_faces
+    }
+
+    # If the LOSER holds Relentless, they re-roll
+    def relentless(attacker_die, defender_die):
+        loser = defender if attacker_wins(attacker_die, defender_die) else attacker
+        return loser if "relentless" in loser.cards else None
+
+    # If the ATTACKER holds Scrappy and is losing, they re-roll
+    def scrappy(attacker_die, defender_die):
+        if "scrappy" in attacker.cards and not attacker_wins(
+            attacker_die, defender_die
+        ):
+            return attacker
+        return None
+
+    # If the LOSER holds Cruel, they force the WINNER to re-roll
+    def cruel(attacker_die, defender_die):
+        if attacker_wins(attacker_die, defender_die):
+            winner, loser = attacker, defender
+        else:
+            winner, loser = defender, attacker
+        return winner if "cruel" in loser.cards else None
+
+    for get_side in (relentless, scrappy, cruel):
+        outcomes = reroll(outcomes, get_side)
+
+    # If the DEFENDER holds Stubborn, then they break ties
+    comparator = operator.lt if "stubborn" in defender.cards else operator.le
+    return sum(
+        (
+            prob
+            for (attacker_die, defender_die), prob in outcomes.items()
+            if attacker_wins(attacker_die, defender_die, comparator)
+        ),
+        Fraction(0),
+    )
+
+
+def canonical_ship_dice(attacker_advantage):
+    """Return the (attacker, defender) ship dice that represent an advantage"""
+    if attacker_advantage < 0:
+        return 1, 1 - attacker_advantage
+
+    return 1 + attacker_advantage, 1
+
+
+def verify_advantage_equivalence(attacker_cards=None, defender_cards=None):
+    """Check that outcomes only depend on the difference between ship dice
+
+    Compare the exact win probability of every pair of ship dice against that
+    of the canonical pair with the same advantage. Return a list of every
+    (attacker ship die, defender ship die) pair that doesn't match (which
+    should always be empty!)"""
+
+    canonical_probabilities = {}
+    for attacker_advantage in ATTACKER_ADVANTAGES:
+        attacker_ship_die, defender_ship_die = canonical_ship_dice(attacker_advantage)
+        canonical_probabilities[attacker_advantage] = exact_win_probability(
+            Attacker(attacker_ship_die, attacker_cards),
+            Defender(defender_ship_die, defender_cards),
+        )
+
+    mismatches = []
+    for attacker_ship_die in range(1, 7):
+        for defender_ship_die in range(1, 7):
+            probability = exact_win_probability(
+                Attacker(attacker_ship_die, attacker_cards),
+                Defender(defender_ship_die, defender_cards),
+            )
+            attacker_advantage = attacker_ship_die - defender_ship_die
+            if probability != canonical_probabilities[attacker_advantage]:
+                mismatches.append((attacker_ship_die, defender_ship_die))
+    return mismatches
+
+
+def behavior_key(attacker_cards, defender_cards, attacker_advantage):
+    """Return a key that's the same for every matchup that behaves identically
+
+    Matchups with the same key have the same outcome distribution, so only one
+    of them needs to be evaluated. Cards are dropped from the key when they can
+    never change anything:
+
+    * Stubborn only matters to the defender, and Scrappy to the attacker
+    * A Rational side always rolls a 3, so its own Relentless and Scrappy
+      re-rolls, and its opponent's Cruel (which only ever makes the winner --
+      i.e. the Rational side -- re-roll) are moot
+
+    Ferocious and Strategic just lower their holder's total, which is the same
+    as a change in ship dice, so they're folded into the advantage. See
+    verify_behavior_equivalence"""
+
+    attacker_cards = set(attacker_cards or ())
+    defender_cards = set(defender_cards or ())
+    attacker_rational = "rational" in attacker_cards
+    defender_rational = "rational" in defender_cards
+
+    def total_modifier(cards):
+        # See Side.total
+        return ("ferocious" in cards) + 2 * ("strategic" in cards)
+
+    return (
+        attacker_advantage
+        - total_modifier(attacker_cards)
+        + total_modifier(defender_cards),
+        attacker_rational,
+        defender_rational,
+        "relentless" in attacker_cards and not attacker_rational,
+        "relentless" in defender_cards and not defender_rational,
+        "scrappy" in attacker_cards and not attacker_rational,
+        "cruel" in attacker_cards and not defender_rational,
+        "cruel" in defender_cards and not attacker_rational,
+        "stubborn" in defender_cards,
+    )
+
+
+def verify_behavior_equivalence(matchups):
+    """Check that matchups with the same behavior_key have the same outcomes
+
+    matchups is an iterable of (attacker cards, defender cards) pairs, each of
+    which is checked at every attacker advantage with the exact engine. Return
+    a list of every (attacker cards, defender cards, attacker advantage) whose
+    win probability differs from that of the first matchup with the same key
+    (which should always be empty!)"""
+
+    probabilities = {}
+    mismatches = []
+    for attacker_cards, defender_cards in matchups:
+        for attacker_advantage in ATTACKER_ADVANTAGES:
+            attacker_ship_die, defender_ship_die = canonical_ship_dice(
+                attacker_advantage
+            )
+            probability = exact_win_probability(
+                Attacker(attacker_ship_die, attacker_cards),
+                Defender(defender_ship_die, defender_cards),
+            )
+            key = behavior_key(attacker_cards, defender_cards, attacker_advantage)
+            if probabilities.setdefault(key, probability) != probability:
+                mismatches.append((attacker_cards, defender_cards, attacker_advantage))
+    return mismatches
+
+
+def run_matchup_chunk(
+    attacker, defender, num_trials, chunk_index, seed=None, batch=False
+):
+    """Run one chunk of trials of a matchup; return the attacker's win count
+
+    Every chunk of every matchup draws from its own stream, derived from seed,
+    so chunks can be run in any order (or any process) with the same results"""
+
+    key = (*matchup_seed_key(attacker, defender), chunk_index)
+    if batch:
+        # NumPy is only needed for batch mode
+        from quantum_batch import do_iterations_batch
+
+        return do_iterations_batch(
+            attacker, defender, num_trials, seed=derive_seed(seed, *key)
+        )
+
+    return do_iterations(attacker, defender, num_trials, rng=make_rng(seed, *key))
+
+
+def estimate_matchup(
+    attacker,
+    defender,
+    target_half_width,
+    max_trials,
+    seed=None,
+    batch=False,
+    confidence=0.95,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """Return an Estimate of a matchup from do_adaptive_iterations"""
+
+    chunk_indices = itertools.count()
+
+    def run_trials(num_trials):
+        return run_matchup_chunk(
+            attacker, defender, num_trials, next(chunk_indices), seed, batch
+        )
+
+    return do_adaptive_iterations(
+        run_trials,
+        target_half_width,
+        max_trials=max_trials,
+        confidence=confidence,
+        chunk_size=chunk_size,
+    )
+
+
+def estimate_matchup_importance(
+    attacker, defender, num_trials, seed=None, confidence=0.95
+):
+    """Return an Estimate of a matchup by importance sampling (see
+    quantum_batch.do_iterations_importance)"""
+
+    # NumPy is only needed for importance sampling
+    from quantum_batch import do_iterations_importance
+
+    estimate = do_iterations_importance(
+        attacker,
+        defender,
+        num_trials,
+        seed=derive_seed(seed, *matchup_seed_key(attacker, defender)),
+        confidence=confidence,
+    )
+    # quantum_batch's Estimate isn't this one when this is run as a script
+    return Estimate(*estimate)
+
+
+def parallel_map(function, *iterables, jobs=1):
+    """Like map (but returning a list), spread across up to jobs processes"""
+
+    if jobs <= 1:
+        return list(map(function, *iterables))
+
+    iterables = [list(iterable) for iterable in iterables]
+    # Send work to the processes in batches, to cut down on overhead
+    chunksize = max(1, len(iterables[0]) // (jobs * 4))
+    with ProcessPoolExecutor(jobs) as executor:
+        return list(executor.map(function, *iterables, chunksize=chunksize))
+
+
+def evaluate_matchups(
+    matchups,
+    num_trials,
+    exact=False,
+    batch=False,
+    seed=None,
+    target_half_width=None,
+    confidence=0.95,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    jobs=1,
+    importance_sampling=False,
+):
+    """Evaluate every given matchup, using up to jobs processes
+
+    matchups maps keys to (attacker, defender) pairs; return a dict mapping the
+    same keys to the attacker's win ratio (or an Estimate, if target_half_width
+    is given or importance_sampling is set). Trials are split into chunks of
+    chunk_size, each with its own stream, so the results for a given seed are
+    the same for any number of jobs. In batch mode, each matchup's trials are
+    instead run as a single (vectorized) chunk, and only matchups are spread
+    across processes"""
+
+    if exact:
+        return {
+            key: float(exact_win_probability(attacker, defender))
+            for key, (attacker, defender) in matchups.items()
+        }
+
+    attackers = [attacker for attacker, __ in matchups.values()]
+    defenders = [defender for __, defender in matchups.values()]
+    if importance_sampling:
+        estimates = parallel_map(
+            functools.partial(
+                estimate_matchup_importance,
+                num_trials=num_trials,
+                seed=seed,
+                confidence=confidence,
+            ),
+            attackers,
+            defenders,
+            jobs=jobs,
+        )
+        return dict(zip(matchups, estimates))
+
+    if target_half_width:
+        # Whether to run another chunk depends on the last, so each matchup
+        # has to be handled by a single process
+        estimates = parallel_map(
+            functools.partial(
+                estimate_matchup,
+                target_half_width=target_half_width,
+                max_trials=num_trials,
+                seed=seed,
+                batch=batch,
+                confidence=confidence,
+                chunk_size=chunk_size,
+            ),
+            attackers,
+            defenders,
+            jobs=jobs,
+        )
+        return dict(zip(matchups, estimates))
+
+    if batch:
+        # Splitting up trials would only slow down the vectorized kernel
+        chunk_size = max(num_trials, 1)
+    chunks = [
+        (key, attacker, defender, chunk_index, min(chunk_size, num_trials - start))
+        for key, (attacker, defender) in matchups.items()
+        for chunk_index, start in enumerate(range(0, num_trials, chunk_size))
+    ]
+    win_counts = parallel_map(
+        functools.partial(run_matchup_chunk, seed=seed, batch=batch),
+        [attacker for __, attacker, __, __, __ in chunks],
+        [defender for __, __, defender, __, __ in chunks],
+        [chunk_trials for __, __, __, __, chunk_trials in chunks],
+        [chunk_index for __, __, __, chunk_index, __ in chunks],
+        jobs=jobs,
+    )
+    attacker_win_counts = defaultdict(int)
+    for (key, __, __, __, __), win_count in zip(chunks, win_counts):
+        attacker_win_counts[key] += win_count
+    return {key: attacker_win_counts[key] / num_trials for key in matchups}
+
+
 def get_results(
     num_trials,
     attacker_cards=None,
     defender_cards=None,
     attacker_ship_dice=None,
     defender_ship_dice=None,
+    exact=False,
+    batch=False,
+    seed=None,
+    target_half_width=None,
+    confidence=0.95,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    canonicalize=True,
+    cache=None,
+    jobs=1,
+    importance_sampling=False,
 ):
+    """Map each (attacker, defender) pair to the attacker's win ratio
+
+    If target_half_width is given, each pair is instead mapped to an Estimate
+    calculated by do_adaptive_iterations, with num_trials as the cap. If
+    importance_sampling is set, each pair is mapped to an Estimate calculated by
+    quantum_batch.do_iterations_importance, which is far more precise for
+    lopsided matchups (target_half_width is then ignored).
+
+    Since outcomes only depend on the attacker's advantage (see
+    verify_advantage_equivalence), by default each advantage is only
+    evaluated once and its result is shared by every pair with that advantage.
+    Pass canonicalize=False to evaluate every pair independently.
+
+    If a matchup_cache.MatchupCache is given, results are looked up in (and
+    added to) it rather than always being calculated, unless they're Monte
+    Carlo results without a seed. The evaluation itself is
+    spread across up to jobs processes; see evaluate_matchups"""
 
     if attacker_ship_dice:
         attacker_ship_dice = [*attacker_ship_dice]
@@ -304,13 +953,81 @@ def get_results(
     attackers = [Attacker(ship_die=n, cards=attacker_cards) for n in attacker_ship_dice]
     defenders = [Defender(ship_die=n, cards=defender_cards) for n in defender_ship_dice]
 
-    results = {}
+    # Everything (besides the matchup itself) that determines the result
+    if exact:
+        method = {"exact": True}
+    else:
+        method = {"batch": batch, "num_trials": num_trials, "seed": seed}
+        if importance_sampling:
+            method.update(importance_sampling=True, confidence=confidence)
+        elif target_half_width:
+            method.update(
+                target_half_width=target_half_width,
+                confidence=confidence,
+                chunk_size=chunk_size,
+            )
+
+    def group(attacker, defender):
+        if canonicalize:
+            return attacker.ship_die - defender.ship_die
+        return attacker.ship_die, defender.ship_die
+
+    # Maps each group of equivalent pairs to the one pair that is evaluated for
+    # all of them
+    matchups = {}
     for attacker in attackers:
         for defender in defenders:
-            attacker_win_count = do_iterations(attacker, defender, num_trials)
-            attacker_win_ratio = attacker_win_count / num_trials
-            results[(attacker, defender)] = attacker_win_ratio
-    return results
+            matchups.setdefault(group(attacker, defender), (attacker, defender))
+
+    # Unseeded trials are a fresh sample every time, not something to look up
+    if not exact and seed is None:
+        cache = None
+
+    results_by_group = {}
+    if cache is not None:
+        for key, (attacker, defender) in matchups.items():
+            result = cache.get_matchup(
+                attacker.cards,
+                defender.cards,
+                attacker.ship_die - defender.ship_die,
+                method,
+            )
+            if result is not None:
+                results_by_group[key] = result
+
+    new_results = evaluate_matchups(
+        {
+            key: matchup
+            for key, matchup in matchups.items()
+            if key not in results_by_group
+        },
+        num_trials,
+        exact=exact,
+        batch=batch,
+        seed=seed,
+        target_half_width=target_half_width,
+        confidence=confidence,
+        chunk_size=chunk_size,
+        jobs=jobs,
+        importance_sampling=importance_sampling,
+    )
+    if cache is not None:
+        for key, result in new_results.items():
+            attacker, defender = matchups[key]
+            cache.set_matchup(
+                attacker.cards,
+                defender.cards,
+                attacker.ship_die - defender.ship_die,
+                method,
+                result,
+            )
+    results_by_group.update(new_results)
+
+    return {
+        (attacker, defender): results_by_group[group(attacker, defender)]
+        for attacker in attackers
+        for defender in defenders
+    }
 
 
 def do_stats(args):
@@ -321,18 +1038,43 @@ def do_stats(args):
     else:
         base_results = None
 
+    if args.cache:
+        # Imported here to avoid a circular import
+        from matchup_cache import MatchupCache
+
+        cache = MatchupCache(args.cache, max_entries=args.cache_size)
+    else:
+        cache = None
+
     results = get_results(
         args.num_trials,
         attacker_cards=args.attacker_cards,
         defender_cards=args.defender_cards,
         attacker_ship_dice=args.attacker_ship_dice,
         defender_ship_dice=args.defender_ship_dice,
+        exact=args.exact,
+        batch=args.batch,
+        seed=args.seed,
+        target_half_width=args.precision,
+        confidence=args.confidence,
+        chunk_size=args.chunk_size,
+        cache=cache,
+        jobs=args.jobs,
+        importance_sampling=args.rare,
     )
+    over_str = "exactly" if args.exact else f"over {args.num_trials} trials"
 
     win_ratios = []
     base_win_ratios = []
     for key, attacker_win_ratio in results.items():
         attacker, defender = key
+        if isinstance(attacker_win_ratio, Estimate):
+            over_str = (
+                f"over {attacker_win_ratio.num_trials} trials; "
+                f"{args.confidence:.0%} CI {attacker_win_ratio.low:.2%} to "
+                f"{attacker_win_ratio.high:.2%}"
+            )
+            attacker_win_ratio = attacker_win_ratio.ratio
         if base_results:
             attacker_win_ratio_base = base_results[
                 (attacker.ship_die, defender.ship_die)
@@ -352,27 +1094,72 @@ def do_stats(args):
         defender.reset()
         print(
             f"<{attacker}> wins against <{defender}> "
-            f"{attacker_win_ratio:.2%} of the time (over {args.num_trials} trials){compare_str}"
+            f"{attacker_win_ratio:.2%} of the time ({over_str}){compare_str}"
         )
 
         win_ratios.append(attacker_win_ratio)
-        base_win_ratios.append(attacker_win_ratio_base)
+        if base_results:
+            base_win_ratios.append(attacker_win_ratio_base)
 
     avg_win_ratio = statistics.mean(win_ratios)
-    avg_base_win_ratio = statistics.mean(base_win_ratios)
-    print(f"{avg_win_ratio:.2%} vs. {avg_base_win_ratio:.2%} "
-        f"({avg_win_ratio - avg_base_win_ratio:.2%} diff from base)")
+    if base_win_ratios:
+        avg_base_win_ratio = statistics.mean(base_win_ratios)
+        print(
+            f"{avg_win_ratio:.2%} vs. {avg_base_win_ratio:.2%} "
+            f"({avg_win_ratio - avg_base_win_ratio:.2%} diff from base)"
+        )
+    else:
+        print(f"{avg_win_ratio:.2%} on average")
 
     if args.save:
         with open(args.save, "wb") as file:
             logger.debug(f"Wrote new results to {args.save.name}")
             results = {
-                (key[0].ship_die, key[1].ship_die): value
+                (key[0].ship_die, key[1].ship_die): getattr(value, "ratio", value)
                 for key, value in results.items()
             }
             pickle.dump(results, file)
 
 
+def do_crn_stats(args):
+    """Compare the given cards against base cards using common random numbers"""
+
+    # NumPy is only needed for batch mode
+    from quantum_batch import compare_common_random_numbers
+
+    comparisons_by_advantage = {}
+    differences = []
+    for attacker_ship_die in args.attacker_ship_dice or range(1, 7):
+        for defender_ship_die in args.defender_ship_dice or range(1, 7):
+            attacker = Attacker(attacker_ship_die, args.attacker_cards)
+            defender = Defender(defender_ship_die, args.defender_cards)
+            attacker_advantage = attacker_ship_die - defender_ship_die
+            if attacker_advantage not in comparisons_by_advantage:
+                comparisons_by_advantage[
+                    attacker_advantage
+                ] = compare_common_random_numbers(
+                    attacker,
+                    defender,
+                    Attacker(attacker_ship_die, args.base_attacker_cards),
+                    Defender(defender_ship_die, args.base_defender_cards),
+                    args.num_trials,
+                    seed=derive_seed(
+                        args.seed, *matchup_seed_key(attacker, defender)
+                    ),
+                )
+            comparison = comparisons_by_advantage[attacker_advantage]
+            print(
+                f"<{attacker}> wins against <{defender}> "
+                f"{comparison.ratio:.2%} of the time (vs. "
+                f"{comparison.base_ratio:.2%}; {comparison.difference:+.2%} "
+                f"± {comparison.standard_error:.2%} diff from base, over "
+                f"{args.num_trials} trials)"
+            )
+            differences.append(comparison.difference)
+
+    print(f"{statistics.mean(differences):+.2%} diff from base on average")
+
+
 def do_specific(args):
     (
         attacker_ship_die,
@@ -395,6 +1182,18 @@ def do_specific(args):
     print(f"Winner: {attacker if res else defender}")
 
 
+def check_shared_cards(attacker_cards, defender_cards):
+    """Raise a ValueError if the attacker and defender hold any of the same
+    cards"""
+
+    if attacker_cards and defender_cards:
+        shared = set(attacker_cards).intersection(set(defender_cards))
+        if shared:
+            raise ValueError(
+                f"Attacker and defender cannot have the same card! Shared cards: {shared}"
+            )
+
+
 def main():
     args = parse_args()
     if args.verbose:
@@ -402,16 +1201,14 @@ def main():
     else:
         init_logging(logging.INFO)
 
-    if args.attacker_cards and args.defender_cards:
-        shared = set(args.attacker_cards).intersection(set(args.defender_cards))
-        if shared:
-            raise ValueError(
-                f"Attacker and defender cannot have the same card! Shared cards: {shared}"
-            )
+    check_shared_cards(args.attacker_cards, args.defender_cards)
+    check_shared_cards(args.base_attacker_cards, args.base_defender_cards)
     results = {}
 
     if args.rolls:
         do_specific(args)
+    elif args.crn:
+        do_crn_stats(args)
     else:
         do_stats(args)
 
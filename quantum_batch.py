@@ -0,0 +1,374 @@
+"""Vectorized Monte Carlo combat simulation
+
+Rather than calling Attacker.attack once per trial, every combat die for a
+batch of trials is drawn up front and the card rules are applied as masked
+array operations. Given the same dice, each trial has exactly the same outcome
+that Attacker.attack would give it"""
+
+from collections import namedtuple
+import math
+import statistics
+
+import numpy as np
+
+from quantum import Estimate, totals_by_combat_die
+
+# The most combat dice each side can roll in a single attack. The attacker can
+# roll initially, then re-roll due to Relentless, Scrappy, and (the defender's)
+# Cruel; Scrappy does nothing for the defender, so it needs one fewer
+MAX_ATTACKER_ROLLS = 4
+MAX_DEFENDER_ROLLS = 3
+
+DEFAULT_BATCH_SIZE = 100000
+
+# How many trials do_iterations_importance runs, plainly and then at each
+# candidate tilt, to decide how to sample a matchup
+PILOT_TRIALS = 2000
+# Matchups whose rarer outcome is likelier than this are sampled plainly
+RARE_THRESHOLD = 0.05
+# The tilts do_iterations_importance picks between (see
+# tilted_face_probabilities)
+TILTS = (0.25, 0.5, 0.75, 1.0, 1.5)
+
+# The win ratios of a card configuration and a base configuration, along with
+# their difference (ratio - base_ratio) and that difference's standard error
+Comparison = namedtuple(
+    "Comparison", ["ratio", "base_ratio", "difference", "standard_error"]
+)
+
+
+class BatchSide:
+    """The combat die state of a single Side across a batch of trials"""
+
+    def __init__(self, side, dice):
+        self.cards = side.cards
+        self.dice = dice
+        num_trials = len(dice)
+        self.combat_die = np.zeros(num_trials, dtype=np.int64)
+        # The number of dice each trial has consumed so far
+        self.num_rolls = np.zeros(num_trials, dtype=np.int64)
+        # Maps combat die face to total; index 0 is unused
+        self.totals = np.zeros(7, dtype=np.int64)
+        for face, total in totals_by_combat_die(side).items():
+            self.totals[face] = total
+
+    def roll(self, mask):
+        if "rational" in self.cards:
+            self.combat_die[mask] = 3
+            return
+
+        trials = np.flatnonzero(mask)
+        self.combat_die[trials] = self.dice[trials, self.num_rolls[trials]]
+        self.num_rolls[trials] += 1
+
+    def total(self):
+        return self.totals[self.combat_die]
+
+
+def draw_combat_dice(rng, num_trials):
+    """Draw enough combat dice for both sides for the given number of trials"""
+    attacker_dice = rng.integers(1, 7, size=(num_trials, MAX_ATTACKER_ROLLS))
+    defender_dice = rng.integers(1, 7, size=(num_trials, MAX_DEFENDER_ROLLS))
+    return attacker_dice, defender_dice
+
+
+def batch_attack(attacker, defender, attacker_dice, defender_dice):
+    """Resolve one attack per row of the given combat dice
+
+    Each side consumes its dice in order, one row per trial. Return an array of
+    whether the attacker won each trial, along with the number of dice each
+    side actually consumed in each trial"""
+
+    _attacker = BatchSide(attacker, attacker_dice)
+    _defender = BatchSide(defender, defender_dice)
+    every_trial = np.ones(len(attacker_dice), dtype=bool)
+
+    _attacker.roll(every_trial)
+    _defender.roll(every_trial)
+    attacker_wins = _attacker.total() <= _defender.total()
+
+    # If the LOSER holds Relentless, they re-roll
+    if "relentless" in attacker.cards:
+        _attacker.roll(~attacker_wins)
+    elif "relentless" in defender.cards:
+        _defender.roll(attacker_wins)
+    attacker_wins = _attacker.total() <= _defender.total()
+
+    # If the ATTACKER holds Scrappy and is losing, they re-roll
+    if "scrappy" in attacker.cards:
+        _attacker.roll(~attacker_wins)
+    attacker_wins = _attacker.total() <= _defender.total()
+
+    # If the LOSER holds Cruel, they force the WINNER to re-roll
+    if "cruel" in attacker.cards:
+        _defender.roll(~attacker_wins)
+    elif "cruel" in defender.cards:
+        _attacker.roll(attacker_wins)
+    attacker_wins = _attacker.total() <= _defender.total()
+
+    # If the DEFENDER holds Stubborn, then they break ties
+    if "stubborn" in defender.cards:
+        attacker_wins = _attacker.total() < _defender.total()
+
+    return attacker_wins, _attacker.num_rolls, _defender.num_rolls
+
+
+def do_iterations_batch(
+    attacker, defender, num_trials, seed=None, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Vectorized equivalent of quantum.do_iterations
+
+    seed may be anything np.random.default_rng accepts; pass a Generator to
+    continue drawing from an existing stream. The dice come from NumPy's
+    stream rather than random's, so the same seed doesn't give the same count
+    as quantum.do_iterations; it does give the same count as
+    do_iterations_replayed"""
+
+    rng = np.random.default_rng(seed)
+    attacker_win_count = 0
+    for start in range(0, num_trials, batch_size):
+        attacker_dice, defender_dice = draw_combat_dice(
+            rng, min(batch_size, num_trials - start)
+        )
+        attacker_wins, __, __ = batch_attack(
+            attacker, defender, attacker_dice, defender_dice
+        )
+        attacker_win_count += int(attacker_wins.sum())
+
+    return attacker_win_count
+
+
+class ReplayedDice:
+    """Stands in for a Side's rng, handing out pre-drawn combat dice in order"""
+
+    def __init__(self):
+        self.dice = iter(())
+
+    def randint(self, low, high):
+        return int(next(self.dice))
+
+
+def do_iterations_replayed(
+    attacker, defender, num_trials, seed=None, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Scalar equivalent of do_iterations_batch
+
+    The combat dice are drawn exactly as do_iterations_batch draws them, but
+    each trial is resolved by Attacker.attack, so for the same seed (and
+    batch_size) the win count is the same"""
+
+    attacker_dice_rng = ReplayedDice()
+    defender_dice_rng = ReplayedDice()
+    # Copies, so that the given sides' rngs are left alone
+    _attacker = type(attacker)(attacker.ship_die, attacker.cards, rng=attacker_dice_rng)
+    _defender = type(defender)(defender.ship_die, defender.cards, rng=defender_dice_rng)
+
+    rng = np.random.default_rng(seed)
+    attacker_win_count = 0
+    for start in range(0, num_trials, batch_size):
+        attacker_dice, defender_dice = draw_combat_dice(
+            rng, min(batch_size, num_trials - start)
+        )
+        for attacker_row, defender_row in zip(attacker_dice, defender_dice):
+            _attacker.reset()
+            _defender.reset()
+            attacker_dice_rng.dice = iter(attacker_row)
+            defender_dice_rng.dice = iter(defender_row)
+            attacker_win_count += int(_attacker.attack(_defender))
+
+    return attacker_win_count
+
+
+def compare_common_random_numbers(
+    attacker,
+    defender,
+    base_attacker,
+    base_defender,
+    num_trials,
+    seed=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
+    """Compare two configurations by running both on the same combat dice
+
+    Since each trial of attacker vs. defender uses exactly the same dice as the
+    corresponding trial of base_attacker vs. base_defender, most of the noise
+    cancels out of the difference in win ratios. Return a Comparison"""
+
+    rng = np.random.default_rng(seed)
+    win_count = 0
+    base_win_count = 0
+    # Sums of the per-trial differences, and of their squares
+    difference_sum = 0
+    difference_sum_of_squares = 0
+    for start in range(0, num_trials, batch_size):
+        attacker_dice, defender_dice = draw_combat_dice(
+            rng, min(batch_size, num_trials - start)
+        )
+        attacker_wins, __, __ = batch_attack(
+            attacker, defender, attacker_dice, defender_dice
+        )
+        base_attacker_wins, __, __ = batch_attack(
+            base_attacker, base_defender, attacker_dice, defender_dice
+        )
+        differences = attacker_wins.astype(np.int64) - base_attacker_wins
+        win_count += int(attacker_wins.sum())
+        base_win_count += int(base_attacker_wins.sum())
+        difference_sum += int(differences.sum())
+        difference_sum_of_squares += int((differences ** 2).sum())
+
+    difference = difference_sum / num_trials
+    if num_trials > 1:
+        variance = (difference_sum_of_squares - num_trials * difference ** 2) / (
+            num_trials - 1
+        )
+        standard_error = math.sqrt(max(variance, 0) / num_trials)
+    else:
+        standard_error = math.nan
+
+    return Comparison(
+        win_count / num_trials, base_win_count / num_trials, difference, standard_error
+    )
+
+
+def tilted_face_probabilities(tilt):
+    """Return the probability of each combat die face, 1-6, when exponentially
+    tilted toward high faces (positive tilt) or low faces (negative tilt)"""
+
+    weights = np.exp(tilt * np.arange(1, 7))
+    return weights / weights.sum()
+
+
+def importance_weights(
+    attacker,
+    defender,
+    num_trials,
+    rng,
+    tilt,
+    attacker_wins_are_rare,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
+    """Run trials with combat dice tilted toward the rare outcome; return each
+    trial's importance weight
+
+    The weight of a trial with the rare outcome is how much likelier its dice
+    were under fair dice than under the tilted ones, and 0 otherwise, so the
+    mean weight is an unbiased estimate of the rare outcome's probability. A
+    tilt of 0 is plain Monte Carlo"""
+
+    if attacker_wins_are_rare:
+        tilt = -tilt
+    attacker_faces = tilted_face_probabilities(tilt)
+    defender_faces = tilted_face_probabilities(-tilt)
+    # Log likelihood ratio of each face, fair over tilted
+    attacker_log_ratios = np.log(1 / 6) - np.log(attacker_faces)
+    defender_log_ratios = np.log(1 / 6) - np.log(defender_faces)
+
+    faces = np.arange(1, 7)
+    weights = np.empty(num_trials)
+    for start in range(0, num_trials, batch_size):
+        size = min(batch_size, num_trials - start)
+        attacker_dice = rng.choice(
+            faces, size=(size, MAX_ATTACKER_ROLLS), p=attacker_faces
+        )
+        defender_dice = rng.choice(
+            faces, size=(size, MAX_DEFENDER_ROLLS), p=defender_faces
+        )
+        attacker_wins, attacker_rolls, defender_rolls = batch_attack(
+            attacker, defender, attacker_dice, defender_dice
+        )
+        # Only the dice that were actually rolled count toward the weights
+        log_weights = np.where(
+            np.arange(MAX_ATTACKER_ROLLS) < attacker_rolls[:, None],
+            attacker_log_ratios[attacker_dice - 1],
+            0,
+        ).sum(axis=1)
+        log_weights += np.where(
+            np.arange(MAX_DEFENDER_ROLLS) < defender_rolls[:, None],
+            defender_log_ratios[defender_dice - 1],
+            0,
+        ).sum(axis=1)
+        rare = attacker_wins if attacker_wins_are_rare else ~attacker_wins
+        weights[start : start + size] = np.exp(log_weights) * rare
+
+    return weights
+
+
+def relative_variance(weights):
+    """Return the variance of importance weights relative to their squared mean
+    (infinite if none of them are nonzero)"""
+
+    mean = weights.mean()
+    if not mean:
+        return math.inf
+    return weights.var() / mean ** 2
+
+
+def do_iterations_importance(
+    attacker,
+    defender,
+    num_trials,
+    seed=None,
+    tilt=None,
+    confidence=0.95,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
+    """Estimate the attacker's win ratio by importance sampling
+
+    When one side is far ahead, the outcome it rarely gets (a win for one side,
+    a loss for the other) hardly ever comes up in plain trials, so its
+    probability can't be told apart from 0 without millions of them. Instead,
+    every combat die here is drawn from a distribution tilted toward that rare
+    outcome, and each trial is weighted by how much likelier its dice were under
+    fair dice than under the tilted ones. The weighted average is an unbiased
+    estimate with a much smaller relative error.
+
+    Which outcome is rare (and whether either is rare enough to be worth
+    tilting for, see RARE_THRESHOLD) comes from a pilot run of plain trials,
+    since rerolls make it hard to tell from the dice and modifiers alone. Unless
+    a tilt is given, the one of TILTS (or none) with the smallest relative
+    variance over a pilot run of its own is used. Pilot trials don't count
+    toward the estimate. Return an Estimate, with a normal confidence interval"""
+
+    rng = np.random.default_rng(seed)
+    pilot_trials = min(PILOT_TRIALS, num_trials)
+    attacker_win_ratio = importance_weights(
+        attacker, defender, pilot_trials, rng, 0, True, batch_size
+    ).mean()
+    attacker_wins_are_rare = attacker_win_ratio < 0.5
+    if min(attacker_win_ratio, 1 - attacker_win_ratio) > RARE_THRESHOLD:
+        tilt = 0
+    elif tilt is None:
+        variances = {
+            candidate: relative_variance(
+                importance_weights(
+                    attacker,
+                    defender,
+                    pilot_trials,
+                    rng,
+                    candidate,
+                    attacker_wins_are_rare,
+                    batch_size,
+                )
+            )
+            for candidate in (0, *TILTS)
+        }
+        # If the rare outcome never came up, tilt as far as possible
+        tilt = min(variances, key=lambda candidate: (variances[candidate], -candidate))
+
+    weights = importance_weights(
+        attacker, defender, num_trials, rng, tilt, attacker_wins_are_rare, batch_size
+    )
+    rare_ratio = weights.mean()
+    if num_trials > 1:
+        standard_error = math.sqrt(weights.var(ddof=1) / num_trials)
+    else:
+        standard_error = math.nan
+
+    ratio = rare_ratio if attacker_wins_are_rare else 1 - rare_ratio
+    half_width = statistics.NormalDist().inv_cdf((1 + confidence) / 2) * standard_error
+    return Estimate(
+        float(ratio),
+        num_trials,
+        max(float(ratio - half_width), 0.0),
+        min(float(ratio + half_width), 1.0),
+    )
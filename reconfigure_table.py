@@ -0,0 +1,119 @@
+"""Precomputed table of reconfigure success probabilities
+
+Every (current ship die, desired ship die, abilities, actions) combination up to
+some maximum budget is solved exactly once, with roll.reconfigure_probability,
+and stored in a flat array of doubles. Lookups are then just an index
+calculation"""
+
+from array import array
+import argparse
+import pickle
+
+from roll import DEFAULT_RECONFIGURE_TABLE_PATH, reconfigure_probability
+
+DEFAULT_MAX_ABILITIES = 3
+DEFAULT_MAX_ACTIONS = 10
+
+
+class ReconfigureTable:
+    """Reconfigure success probabilities for every state within a budget"""
+
+    def __init__(self, max_abilities, max_actions, probabilities):
+        self.max_abilities = max_abilities
+        self.max_actions = max_actions
+        if len(probabilities) != 6 * 6 * (max_abilities + 1) * (max_actions + 1):
+            raise ValueError(
+                f"Expected a probability for every state, but got "
+                f"{len(probabilities)}"
+            )
+        self.probabilities = probabilities
+
+    @classmethod
+    def build(
+        cls, max_abilities=DEFAULT_MAX_ABILITIES, max_actions=DEFAULT_MAX_ACTIONS
+    ):
+        probabilities = array(
+            "d",
+            (
+                reconfigure_probability(
+                    current_ship_die, desired_ship_die, abilities, actions
+                )
+                for current_ship_die in range(1, 7)
+                for desired_ship_die in range(1, 7)
+                for abilities in range(max_abilities + 1)
+                for actions in range(max_actions + 1)
+            ),
+        )
+        return cls(max_abilities, max_actions, probabilities)
+
+    @classmethod
+    def load(cls, path=DEFAULT_RECONFIGURE_TABLE_PATH):
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+
+        probabilities = array("d")
+        probabilities.frombytes(state["probabilities"])
+        return cls(state["max_abilities"], state["max_actions"], probabilities)
+
+    def save(self, path=DEFAULT_RECONFIGURE_TABLE_PATH):
+        state = {
+            "max_abilities": self.max_abilities,
+            "max_actions": self.max_actions,
+            "probabilities": self.probabilities.tobytes(),
+        }
+        with open(path, "wb") as file:
+            pickle.dump(state, file, protocol=5)
+
+    def __contains__(self, budget):
+        abilities, actions = budget
+        return 0 <= abilities <= self.max_abilities and 0 <= actions <= self.max_actions
+
+    def probability(self, current_ship_die, desired_ship_die, abilities, actions):
+        """Return the probability that full_reconfigure succeeds
+
+        Budgets beyond the table are solved on the fly instead"""
+
+        for ship_die in (current_ship_die, desired_ship_die):
+            if not 1 <= ship_die <= 6:
+                raise ValueError(f"ship_die must be between 1 and 6! Got: {ship_die}")
+        if abilities < 0 or actions < 0:
+            raise ValueError(
+                f"Abilities and actions must be >= 0! Got: {abilities}, {actions}"
+            )
+
+        if (abilities, actions) not in self:
+            return float(
+                reconfigure_probability(
+                    current_ship_die, desired_ship_die, abilities, actions
+                )
+            )
+
+        index = (
+            ((current_ship_die - 1) * 6 + desired_ship_die - 1)
+            * (self.max_abilities + 1)
+            + abilities
+        ) * (self.max_actions + 1) + actions
+        return self.probabilities[index]
+
+
+def main():
+    args = parse_args()
+    table = ReconfigureTable.build(args.max_abilities, args.max_actions)
+    table.save(args.output)
+    print(f"Saved {len(table.probabilities)} probabilities to {args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Precompute reconfigure success probabilities"
+    )
+    parser.add_argument(
+        "-a", "--max-abilities", type=int, default=DEFAULT_MAX_ABILITIES
+    )
+    parser.add_argument("-A", "--max-actions", type=int, default=DEFAULT_MAX_ACTIONS)
+    parser.add_argument("-o", "--output", default=DEFAULT_RECONFIGURE_TABLE_PATH)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
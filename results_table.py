@@ -0,0 +1,201 @@
+"""The table of every matchup's result, stored as sparse memory-mapped chunks
+
+A table is a directory. header.json describes the cards hands are drawn from,
+the biggest hand, and how the results were calculated. The results themselves
+are cells indexed by (pair of hands, attacker advantage), where pairs of hands
+are numbered by hands.rank_hand_pair, so only pairs that don't share a card
+take up space. Each cell holds the attacker's win ratio and the number of
+trials it was calculated over (0 if it was calculated exactly); cells that
+haven't been calculated have a ratio of NaN.
+
+The cells are split into chunk files of CHUNK_PAIRS pairs each, which are only
+created once something is written to them, and memory-mapped (a few at a time)
+when used. So tables for far bigger sets of cards than fit in memory can be
+filled in (and looked up in) a bit at a time"""
+
+from collections import OrderedDict
+from pathlib import Path
+import json
+
+import numpy as np
+
+from hands import MAX_HAND_SIZE, count_hand_pairs, count_hands, rank_hand_pair
+from quantum import ATTACKER_ADVANTAGES, CARDS
+
+FORMAT = "quantum-results"
+VERSION = 2
+HEADER_NAME = "header.json"
+# Pairs of hands per chunk file
+CHUNK_PAIRS = 4096
+# The most chunk files that are kept open at once
+MAX_OPEN_CHUNKS = 16
+
+CELL_DTYPE = np.dtype([("ratio", "<f8"), ("num_trials", "<u4")])
+
+DEFAULT_RESULTS_TABLE_PATH = "all_results.table"
+
+
+class ResultsTable:
+    """A sparse, chunked table of matchup results; see the module docstring"""
+
+    def __init__(self, path, mode="r"):
+        """Open an existing table; mode is "r" (read-only) or "r+" (writable)"""
+
+        self.path = Path(path)
+        self.mode = mode
+        try:
+            header = json.loads((self.path / HEADER_NAME).read_text())
+        except (OSError, ValueError):
+            raise ValueError(f"{path} is not a results table")
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a results table")
+
+        if header["version"] != VERSION:
+            raise ValueError(
+                f"{path} is a version {header['version']} results table; "
+                f"expected version {VERSION}"
+            )
+        self.cards = header["cards"]
+        self.max_hand_size = header["max_hand_size"]
+        self.metadata = header["metadata"]
+        self.num_pairs = count_hand_pairs(len(self.cards), self.max_hand_size)
+        # Maps chunk indices to open chunks, least recently used first
+        self._chunks = OrderedDict()
+
+    @classmethod
+    def create(cls, path, metadata=None, cards=CARDS, max_hand_size=MAX_HAND_SIZE):
+        """Create a new table for the hands of up to max_hand_size of cards, with
+        every cell uncalculated
+
+        If there's already a table at path, it's replaced. metadata is anything
+        JSON-serializable, e.g. how the results are to be calculated. Return the
+        table, opened for writing"""
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        # Only remove what a table would have put there
+        for chunk_path in path.glob("chunk_*.npy"):
+            chunk_path.unlink()
+        header = {
+            "format": FORMAT,
+            "version": VERSION,
+            "cards": list(cards),
+            "max_hand_size": max_hand_size,
+            "metadata": metadata or {},
+        }
+        (path / HEADER_NAME).write_text(json.dumps(header))
+
+        return cls(path, mode="r+")
+
+    def index(self, attacker_cards, defender_cards, attacker_advantage):
+        """Return the (pair rank, advantage index) of the cell for the given
+        matchup"""
+
+        return (
+            rank_hand_pair(
+                attacker_cards or (),
+                defender_cards or (),
+                self.cards,
+                self.max_hand_size,
+            ),
+            attacker_advantage - ATTACKER_ADVANTAGES[0],
+        )
+
+    def get(self, attacker_cards, defender_cards, attacker_advantage):
+        """Return the (win ratio, number of trials) of the given matchup
+
+        Raise a KeyError if it hasn't been calculated"""
+
+        pair, advantage_index = self.index(
+            attacker_cards, defender_cards, attacker_advantage
+        )
+        chunk_index, pair_in_chunk = divmod(pair, CHUNK_PAIRS)
+        chunk = self._chunk(chunk_index)
+        if chunk is not None:
+            ratio, num_trials = chunk[pair_in_chunk, advantage_index].tolist()
+        if chunk is None or np.isnan(ratio):
+            raise KeyError(
+                f"No result for {attacker_cards} vs. {defender_cards} at "
+                f"{attacker_advantage:+}"
+            )
+        return ratio, num_trials
+
+    def set(
+        self, attacker_cards, defender_cards, attacker_advantage, ratio, num_trials
+    ):
+        pair, advantage_index = self.index(
+            attacker_cards, defender_cards, attacker_advantage
+        )
+        chunk_index, pair_in_chunk = divmod(pair, CHUNK_PAIRS)
+        self._chunk(chunk_index, create=True)[pair_in_chunk, advantage_index] = (
+            ratio,
+            num_trials,
+        )
+
+    def cells(self, first_pair, num_pairs):
+        """Return a (num_pairs, number of advantages) array of the cells of
+        num_pairs consecutive pairs of hands, starting at rank first_pair"""
+
+        cells = np.zeros((num_pairs, len(ATTACKER_ADVANTAGES)), dtype=CELL_DTYPE)
+        cells["ratio"] = np.nan
+        pair = first_pair
+        while pair < first_pair + num_pairs:
+            chunk_index, pair_in_chunk = divmod(pair, CHUNK_PAIRS)
+            num_in_chunk = min(
+                CHUNK_PAIRS - pair_in_chunk, first_pair + num_pairs - pair
+            )
+            chunk = self._chunk(chunk_index)
+            if chunk is not None:
+                cells[pair - first_pair : pair - first_pair + num_in_chunk] = chunk[
+                    pair_in_chunk : pair_in_chunk + num_in_chunk
+                ]
+            pair += num_in_chunk
+        return cells
+
+    def attacker_cells(self, attacker_cards):
+        """Return the cells of an attacker hand against every defender hand (in
+        order); see cells"""
+
+        # An attacker hand's pairs are consecutive, starting with the empty
+        # defender hand
+        return self.cells(
+            rank_hand_pair(attacker_cards, (), self.cards, self.max_hand_size),
+            count_hands(len(self.cards) - len(attacker_cards), self.max_hand_size),
+        )
+
+    def flush(self):
+        for chunk in self._chunks.values():
+            chunk.flush()
+
+    def _chunk(self, chunk_index, create=False):
+        """Return the (memory-mapped) chunk with the given index
+
+        If it doesn't exist yet, create it if create is set, and return None
+        otherwise"""
+
+        if chunk_index in self._chunks:
+            self._chunks.move_to_end(chunk_index)
+            return self._chunks[chunk_index]
+
+        chunk_path = self.path / f"chunk_{chunk_index:06d}.npy"
+        if chunk_path.exists():
+            chunk = np.load(chunk_path, mmap_mode=self.mode)
+        elif not create:
+            return None
+        elif self.mode == "r":
+            raise ValueError(f"{self.path} was opened read-only")
+        else:
+            num_pairs = min(CHUNK_PAIRS, self.num_pairs - chunk_index * CHUNK_PAIRS)
+            chunk = np.lib.format.open_memmap(
+                chunk_path,
+                mode="w+",
+                dtype=CELL_DTYPE,
+                shape=(num_pairs, len(ATTACKER_ADVANTAGES)),
+            )
+            chunk["ratio"] = np.nan
+
+        self._chunks[chunk_index] = chunk
+        if len(self._chunks) > MAX_OPEN_CHUNKS:
+            __, oldest = self._chunks.popitem(last=False)
+            oldest.flush()
+        return chunk
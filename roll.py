@@ -1,21 +1,27 @@
 # Let's say we have a situation where we are trying to roll a specific value during reconfigure?
 # What is the probability of getting it? It's not simply 1/6!
 
+from collections import defaultdict
+from fractions import Fraction
 import argparse
+import functools
 import logging
 import random
 
+# Where reconfigure_table.py saves its table by default
+DEFAULT_RECONFIGURE_TABLE_PATH = "reconfigure_table.pkl"
+
 ROLLS = None
 # ROLLS = iter((6, 4))
 
 logger = logging.getLogger(__name__)
 
 
-def roll(debug=True):
-    return random.randint(1, 6)
+def roll(debug=True, rng=random):
+    return rng.randint(1, 6)
 
 
-def _reconfigure(current_ship_die):
+def _reconfigure(current_ship_die, rng=random):
     """Return a random roll that is not equal to the current one"""
     if ROLLS is not None:
         try:
@@ -25,66 +31,72 @@ def _reconfigure(current_ship_die):
         else:
             print(f"Manually rolled {roll}")
             return roll
-    return random.choice([value for value in range(1, 7) if value != current_ship_die])
+    # Roll one of the five other values, skipping over the current one
+    value = rng.randint(1, 5)
+    return value + (value >= current_ship_die)
 
 
 def reconfigure(
-    current_ship_die, desired_ship_die, ship_abilities_remaining, actions_remaining
+    current_ship_die,
+    desired_ship_die,
+    ship_abilities_remaining,
+    actions_remaining,
+    rng=random,
 ):
+    _check_budget(ship_abilities_remaining, actions_remaining)
     new_ship_die = current_ship_die
 
-    logger.debug(
-        "!",
-        current_ship_die,
-        desired_ship_die,
-        ship_abilities_remaining,
-        actions_remaining,
-    )
     if ship_abilities_remaining == actions_remaining == 0:
         logger.debug("Done!")
         return current_ship_die, ship_abilities_remaining, actions_remaining
 
-    if ship_abilities_remaining > 0 and current_ship_die == 6:
+    while True:
+        current_ship_die = new_ship_die
         logger.debug(
-            f"RECONFIGURE: We might be able to get to our target by free reconfigure!"
-        )
-        new_ship_die, ship_abilities_remaining = (
-            _reconfigure(current_ship_die),
-            ship_abilities_remaining - 1,
-        )
-        logger.debug(f"Reconfigured from {current_ship_die} to {new_ship_die}")
-
-    elif (
-        ship_abilities_remaining > 0
-        and current_ship_die == 4
-        and desired_ship_die in [3, 5]
-    ):
-        logger.debug(f"MODIFY: We can get to our target by modifying!")
-        new_ship_die = desired_ship_die
-        logger.debug(f"Modified from {current_ship_die} to {desired_ship_die}")
-        ship_abilities_remaining -= 1
-    elif actions_remaining:
-        logger.debug("RAW RECONF: yep")
-        new_ship_die, actions_remaining = (
-            _reconfigure(current_ship_die),
-            actions_remaining - 1,
-        )
-        logger.debug(f"RAW: Reconfigured from {current_ship_die} to {new_ship_die}")
-
-    # elif not actions_remaining:
-    #     logger.debug("Out of actions :(")
-    # else:
-    #     raise AssertionError("wut")
-
-    logger.debug(f"Abilities remaining: {ship_abilities_remaining}")
-    logger.debug(f"Actions remaining: {actions_remaining}")
-
-    if (
-        actions_remaining or (new_ship_die == 6 and ship_abilities_remaining)
-    ) and new_ship_die != desired_ship_die:
-        return reconfigure(
-            new_ship_die, desired_ship_die, ship_abilities_remaining, actions_remaining,
+            "! %s %s %s %s",
+            current_ship_die,
+            desired_ship_die,
+            ship_abilities_remaining,
+            actions_remaining,
         )
+        if ship_abilities_remaining > 0 and current_ship_die == 6:
+            logger.debug(
+                "RECONFIGURE: We might be able to get to our target by free "
+                "reconfigure!"
+            )
+            new_ship_die, ship_abilities_remaining = (
+                _reconfigure(current_ship_die, rng),
+                ship_abilities_remaining - 1,
+            )
+            logger.debug("Reconfigured from %s to %s", current_ship_die, new_ship_die)
+
+        elif (
+            ship_abilities_remaining > 0
+            and current_ship_die == 4
+            and desired_ship_die in [3, 5]
+        ):
+            logger.debug("MODIFY: We can get to our target by modifying!")
+            new_ship_die = desired_ship_die
+            logger.debug("Modified from %s to %s", current_ship_die, desired_ship_die)
+            ship_abilities_remaining -= 1
+        elif actions_remaining:
+            logger.debug("RAW RECONF: yep")
+            new_ship_die, actions_remaining = (
+                _reconfigure(current_ship_die, rng),
+                actions_remaining - 1,
+            )
+            logger.debug(
+                "RAW: Reconfigured from %s to %s", current_ship_die, new_ship_die
+            )
+
+        logger.debug("Abilities remaining: %s", ship_abilities_remaining)
+        logger.debug("Actions remaining: %s", actions_remaining)
+
+        if not (
+            (actions_remaining or (new_ship_die == 6 and ship_abilities_remaining))
+            and new_ship_die != desired_ship_die
+        ):
+            break
 
     return (
         new_ship_die,
@@ -93,6 +105,187 @@ def reconfigure(
     )
 
 
+def _heuristic_step(current_ship_die, desired_ship_die, abilities, actions):
+    """Return the outcomes of a single step of reconfigure
+
+    Each outcome is a (ship die, abilities remaining, actions remaining) tuple,
+    paired with its probability"""
+
+    if abilities > 0 and current_ship_die == 6:
+        # Free reconfigure
+        return [
+            ((value, abilities - 1, actions), Fraction(1, 5))
+            for value in range(1, 7)
+            if value != current_ship_die
+        ]
+    if abilities > 0 and current_ship_die == 4 and desired_ship_die in [3, 5]:
+        # Modify
+        return [((desired_ship_die, abilities - 1, actions), Fraction(1))]
+    if actions:
+        return [
+            ((value, abilities, actions - 1), Fraction(1, 5))
+            for value in range(1, 7)
+            if value != current_ship_die
+        ]
+    return [((current_ship_die, abilities, actions), Fraction(1))]
+
+
+def _check_budget(abilities, actions):
+    """Raise a ValueError unless the abilities and actions are both >= 0"""
+
+    if abilities < 0 or actions < 0:
+        raise ValueError(
+            f"Abilities and actions must be >= 0! Got: {abilities}, {actions}"
+        )
+
+
+def reconfigure_distribution(
+    current_ship_die, desired_ship_die, ship_abilities_remaining, actions_remaining
+):
+    """Return the exact distribution of outcomes of full_reconfigure
+
+    Rather than simulating, this follows the probability of every state that
+    reconfigure can pass through (which only depends on the ship die and the
+    abilities and actions remaining), a step at a time. Every step uses up an
+    ability or an action, so this takes at most that many steps no matter what
+    the rolls are.
+
+    Return a dict mapping each possible (ship die, actions remaining, ship
+    abilities remaining) outcome, as returned by reconfigure, to its
+    probability as a Fraction"""
+
+    _check_budget(ship_abilities_remaining, actions_remaining)
+    if current_ship_die == desired_ship_die:
+        return {
+            (current_ship_die, actions_remaining, ship_abilities_remaining): Fraction(1)
+        }
+
+    outcomes = defaultdict(Fraction)
+    states = {
+        (current_ship_die, ship_abilities_remaining, actions_remaining): Fraction(1)
+    }
+    while states:
+        next_states = defaultdict(Fraction)
+        for (ship_die, abilities, actions), probability in states.items():
+            for (new_ship_die, new_abilities, new_actions), step_probability in (
+                _heuristic_step(ship_die, desired_ship_die, abilities, actions)
+            ):
+                new_probability = probability * step_probability
+                # The same condition as reconfigure's for carrying on
+                if (
+                    new_actions or (new_ship_die == 6 and new_abilities)
+                ) and new_ship_die != desired_ship_die:
+                    next_states[
+                        (new_ship_die, new_abilities, new_actions)
+                    ] += new_probability
+                else:
+                    outcomes[
+                        (new_ship_die, new_actions, new_abilities)
+                    ] += new_probability
+        states = next_states
+
+    return dict(outcomes)
+
+
+def reconfigure_probability(
+    current_ship_die, desired_ship_die, ship_abilities_remaining, actions_remaining
+):
+    """Return the exact probability that full_reconfigure succeeds"""
+
+    _check_budget(ship_abilities_remaining, actions_remaining)
+    return sum(
+        probability
+        for (ship_die, __, __), probability in reconfigure_distribution(
+            current_ship_die,
+            desired_ship_die,
+            ship_abilities_remaining,
+            actions_remaining,
+        ).items()
+        if ship_die == desired_ship_die
+    )
+
+
+def optimal_reconfigure(current_ship_die, desired_ship_die, abilities, actions):
+    """Return the best possible probability of reaching the desired ship die
+
+    Unlike reconfigure, which always follows the same heuristic, this considers
+    every move in every state: a free reconfigure (on a 6), modifying a 4 to
+    either a 3 or a 5, spending an action to reconfigure, or stopping. Each
+    state is solved once and cached, so solving many states is cheap.
+
+    Return a (probability, move) tuple, where move is the first move of the
+    best policy (None if it is to stop)"""
+
+    rewards = tuple(
+        Fraction(int(ship_die == desired_ship_die)) for ship_die in range(1, 7)
+    )
+    return best_reconfigure(current_ship_die, rewards, abilities, actions)
+
+
+def best_reconfigure(current_ship_die, rewards, abilities, actions):
+    """Return the best possible expected reward of reconfiguring
+
+    This is optimal_reconfigure, but instead of only the desired ship die
+    counting as success, stopping on each ship die is worth the corresponding
+    element of rewards (a 6-tuple, starting with the reward for a 1). For
+    example, the rewards could be the probability of winning a fight with each
+    ship die.
+
+    Return a (reward, move) tuple, as for optimal_reconfigure"""
+
+    _check_budget(abilities, actions)
+    # Solve every state with fewer actions first, so that solving this one only
+    # has to recurse through abilities, however many actions there are
+    for fewer_actions in range(actions):
+        for fewer_abilities in range(abilities + 1):
+            for ship_die in range(1, 7):
+                _best_reconfigure(ship_die, rewards, fewer_abilities, fewer_actions)
+
+    return _best_reconfigure(current_ship_die, rewards, abilities, actions)
+
+
+@functools.lru_cache(maxsize=None)
+def _best_reconfigure(current_ship_die, rewards, abilities, actions):
+    def expected(new_abilities, new_actions, ship_dice):
+        return sum(
+            _best_reconfigure(ship_die, rewards, new_abilities, new_actions)[0]
+            for ship_die in ship_dice
+        ) / len(ship_dice)
+
+    other_ship_dice = [value for value in range(1, 7) if value != current_ship_die]
+    moves = [(rewards[current_ship_die - 1], None)]
+    if abilities and current_ship_die == 6:
+        moves.append(
+            (expected(abilities - 1, actions, other_ship_dice), "free reconfigure")
+        )
+    if abilities and current_ship_die == 4:
+        for ship_die in (3, 5):
+            moves.append(
+                (expected(abilities - 1, actions, [ship_die]), f"modify to {ship_die}")
+            )
+    if actions:
+        moves.append((expected(abilities, actions - 1, other_ship_dice), "reconfigure"))
+
+    # Prefer the earliest of equally good moves, so stopping wins ties
+    return max(moves, key=lambda move: move[0])
+
+
+def optimal_policy(desired_ship_die, max_abilities, max_actions):
+    """Return the best first move for every state within the given budget
+
+    The result maps each (ship die, abilities, actions) to the same
+    (probability, move) tuple as optimal_reconfigure"""
+
+    return {
+        (ship_die, abilities, actions): optimal_reconfigure(
+            ship_die, desired_ship_die, abilities, actions
+        )
+        for ship_die in range(1, 7)
+        for abilities in range(max_abilities + 1)
+        for actions in range(max_actions + 1)
+    }
+
+
 def main():
     args = parse_args()
     if args.verbose:
@@ -102,31 +295,104 @@ def main():
     current_ship_die = args.ship_die
     desired_ship_die = args.desired_ship_die
 
-    num_success = 0
-    for i in range(args.num_trials):
-        result, actions_remaining, ship_abilities_remaining = full_reconfigure(
-            current_ship_die=current_ship_die,
-            desired_ship_die=desired_ship_die,
-            ship_abilities_remaining=args.abilities,
-            actions_remaining=args.actions,
+    if args.table:
+        # Only needed when serving from a table
+        from reconfigure_table import ReconfigureTable
+
+        res = ReconfigureTable.load(args.table).probability(
+            current_ship_die, desired_ship_die, args.abilities, args.actions
+        )
+        print(f"P(success) = {res:.4%}")
+        return
+
+    if args.optimal:
+        heuristic = reconfigure_probability(
+            current_ship_die, desired_ship_die, args.abilities, args.actions
+        )
+        optimal, move = optimal_reconfigure(
+            current_ship_die, desired_ship_die, args.abilities, args.actions
         )
-        if result:
-            num_success += 1
-        # print(result)
+        print(f"P(success) = {float(heuristic):.4%} following reconfigure")
+        print(f"P(success) = {float(optimal):.4%} following the best policy")
+        print(f"Best first move: {move or 'stop'}")
+        return
+
+    if args.exact:
+        distribution = reconfigure_distribution(
+            current_ship_die, desired_ship_die, args.abilities, args.actions
+        )
+        success = {
+            (actions_remaining, ship_abilities_remaining): probability
+            for (
+                ship_die,
+                actions_remaining,
+                ship_abilities_remaining,
+            ), probability in distribution.items()
+            if ship_die == desired_ship_die
+        }
+        res = sum(success.values())
+        print(f"P(success) = {float(res):.4%}")
+        for (actions_remaining, ship_abilities_remaining), probability in sorted(
+            success.items(), reverse=True
+        ):
+            print(
+                f"  with {actions_remaining=}, {ship_abilities_remaining=}: "
+                f"{float(probability):.2%}"
+            )
+        return
+
+    if args.batch:
+        # NumPy is only needed for batch mode
+        from roll_batch import reconfigure_batch
+
+        ship_die, actions_remaining, __ = reconfigure_batch(
+            current_ship_die,
+            desired_ship_die,
+            args.abilities,
+            args.actions,
+            args.num_trials,
+            seed=args.seed,
+        )
+        num_success = int((ship_die == desired_ship_die).sum())
+        actions_used = int(args.actions * args.num_trials - actions_remaining.sum())
+    else:
+        rng = random.Random(args.seed)
+        num_success = 0
+        actions_used = 0
+        for i in range(args.num_trials):
+            result, actions_remaining, ship_abilities_remaining = full_reconfigure(
+                current_ship_die=current_ship_die,
+                desired_ship_die=desired_ship_die,
+                ship_abilities_remaining=args.abilities,
+                actions_remaining=args.actions,
+                rng=rng,
+            )
+            if result:
+                num_success += 1
+            actions_used += args.actions - actions_remaining
 
     res = num_success / args.num_trials
     print(f"{num_success=} / {args.num_trials=} = {res:.2%}")
+    print(f"{actions_used / args.num_trials:.2f} actions used on average")
 
 
 def full_reconfigure(
-    current_ship_die, desired_ship_die, ship_abilities_remaining, actions_remaining
+    current_ship_die,
+    desired_ship_die,
+    ship_abilities_remaining,
+    actions_remaining,
+    rng=random,
 ):
     if current_ship_die == desired_ship_die:
         print("Current and desired ship die values are the same!")
-        return True, desired_ship_die, ship_abilities_remaining
+        return True, actions_remaining, ship_abilities_remaining
 
     new_ship_die, actions_remaining, ship_abilities_remaining = reconfigure(
-        current_ship_die, desired_ship_die, ship_abilities_remaining, actions_remaining
+        current_ship_die,
+        desired_ship_die,
+        ship_abilities_remaining,
+        actions_remaining,
+        rng=rng,
     )
 
     return new_ship_die == desired_ship_die, actions_remaining, ship_abilities_remaining
@@ -154,6 +420,36 @@ def parse_args():
     parser.add_argument("-a", "--abilities", type=int, default=1)
     parser.add_argument("-A", "--actions", type=int, default=3)
     parser.add_argument("-n", "--num-trials", type=int, default=10000)
+    parser.add_argument(
+        "-e",
+        "--exact",
+        action="store_true",
+        help="Calculate the exact probability of success, and of each number of "
+        "actions and abilities left over, instead of running trials",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="Run trials in vectorized batches",
+    )
+    parser.add_argument(
+        "-o",
+        "--optimal",
+        action="store_true",
+        help="Compare the exact probability of success of reconfigure to that "
+        "of the best possible policy",
+    )
+    parser.add_argument(
+        "-t",
+        "--table",
+        nargs="?",
+        const=DEFAULT_RECONFIGURE_TABLE_PATH,
+        help="Look up the probability of success in a table precomputed by "
+        "reconfigure_table.py (%(const)s if no path is given) instead of "
+        "running trials",
+    )
+    parser.add_argument("--seed", type=int, help="Random seed")
     parser.add_argument("-v", "--verbose", action="store_true")
 
     args = parser.parse_args()
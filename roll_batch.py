@@ -0,0 +1,64 @@
+"""Vectorized reconfigure simulation
+
+Rather than calling roll.reconfigure once per trial, the state of every trial
+(ship die, abilities and actions remaining) is held in arrays, and each step of
+the reconfigure heuristic is applied to every trial that is still going at
+once"""
+
+import numpy as np
+
+
+def reconfigure_batch(
+    current_ship_die,
+    desired_ship_die,
+    ship_abilities_remaining,
+    actions_remaining,
+    num_trials,
+    seed=None,
+):
+    """Vectorized equivalent of calling roll.full_reconfigure num_trials times
+
+    Return arrays of the final ship die, actions remaining, and ship abilities
+    remaining of each trial"""
+
+    rng = np.random.default_rng(seed)
+    ship_die = np.full(num_trials, current_ship_die, dtype=np.int64)
+    actions = np.full(num_trials, actions_remaining, dtype=np.int64)
+    abilities = np.full(num_trials, ship_abilities_remaining, dtype=np.int64)
+    if current_ship_die == desired_ship_die:
+        return ship_die, actions, abilities
+
+    # The trials that are still reconfiguring. Every step uses up an ability or
+    # an action, so this loops at most once per ability and action
+    trials = np.arange(num_trials)
+    while len(trials):
+        _ship_die = ship_die[trials]
+        _actions = actions[trials]
+        _abilities = abilities[trials]
+
+        free_reconfigure = (_abilities > 0) & (_ship_die == 6)
+        if desired_ship_die in [3, 5]:
+            modify = ~free_reconfigure & (_abilities > 0) & (_ship_die == 4)
+        else:
+            modify = np.zeros(len(trials), dtype=bool)
+        spend_action = ~free_reconfigure & ~modify & (_actions > 0)
+
+        # Roll one of the five other values
+        reconfigure = free_reconfigure | spend_action
+        offsets = rng.integers(1, 6, size=int(reconfigure.sum()))
+        _ship_die[reconfigure] = (_ship_die[reconfigure] - 1 + offsets) % 6 + 1
+        _ship_die[modify] = desired_ship_die
+        _abilities -= free_reconfigure | modify
+        _actions -= spend_action
+
+        ship_die[trials] = _ship_die
+        actions[trials] = _actions
+        abilities[trials] = _abilities
+
+        # The same condition as reconfigure's for carrying on
+        carry_on = (
+            (_actions > 0) | ((_ship_die == 6) & (_abilities > 0))
+        ) & (_ship_die != desired_ship_die)
+        trials = trials[carry_on]
+
+    return ship_die, actions, abilities
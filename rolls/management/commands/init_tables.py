@@ -2,7 +2,7 @@ from tqdm import tqdm
 
 from django.core.management.base import BaseCommand
 
-from quantum_nologs import CARDS
+from quantum import CARDS
 from rolls.models import Card, Encounter, Hand
 from table import get_possible_hands
 
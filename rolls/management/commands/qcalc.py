@@ -8,7 +8,7 @@ from django.db.models import Q, Count
 from django.core.management.base import BaseCommand
 
 
-from quantum_nologs import do_iterations, Attacker, Defender, CARDS
+from quantum import do_iterations, Attacker, Defender, CARDS
 from rolls.models import Card, Encounter, Hand
 from table import get_possible_hands
 from rolls.utils import handle_all_encounters, handle_all_encounters_parallel
@@ -22,14 +22,39 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("-n", "--num-trials", type=int, default=100)
         parser.add_argument("-p", "--parallel", action="store_true")
+        parser.add_argument(
+            "-e",
+            "--exact",
+            action="store_true",
+            help="Calculate exact win probabilities instead of running trials",
+        )
+        parser.add_argument(
+            "--precision",
+            type=float,
+            help="Run trials in chunks until the confidence interval half-width "
+            "of each win ratio is at most this (e.g. 0.0025). --num-trials "
+            "becomes the maximum number of trials per encounter",
+        )
+        parser.add_argument("--confidence", type=float, default=0.95)
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Root random seed. Each encounter derives its own stream from "
+            "it, so results are reproducible",
+        )
 
     def handle(self, *args, **options):
+        kwargs = dict(
+            num_trials=options["num_trials"],
+            exact=options["exact"],
+            target_half_width=options["precision"],
+            confidence=options["confidence"],
+            seed=options["seed"],
+        )
         if options["parallel"]:
-            handle_all_encounters_parallel()
+            handle_all_encounters_parallel(**kwargs)
         else:
-            all_encounters_to_create = handle_all_encounters(
-                num_trials=options["num_trials"]
-            )
+            all_encounters_to_create = handle_all_encounters(**kwargs)
             Encounter.objects.bulk_create(all_encounters_to_create)
 
 
@@ -1,9 +1,12 @@
 import argparse
 from functools import reduce
+import json
 import operator
+import sys
 
 from django.core.management.base import BaseCommand
 
+from battle import evaluate_battles
 from rolls.models import Card, Encounter, Hand
 from qq import prob_of_win2
 
@@ -39,6 +42,17 @@ def battle_summary(fights, attacker_cards, defender_cards, win_condition):
         )
 
 
+def encounter_win_ratio(
+    attacker_ship_die, defender_ship_die, attacker_cards, defender_cards
+):
+    check_hands(attacker_cards, defender_cards)
+    return Encounter.objects.get(
+        attacker_advantage=attacker_ship_die - defender_ship_die,
+        attacker_hand=Hand.objects.get_by_cards(attacker_cards),
+        defender_hand=Hand.objects.get_by_cards(defender_cards),
+    ).attacker_win_ratio
+
+
 def check_hands(attacker_cards, defender_cards):
     if attacker_cards and defender_cards:
         shared = set(attacker_cards).intersection(set(defender_cards))
@@ -54,7 +68,7 @@ class Command(BaseCommand):
         parser.add_argument(
             "fights",
             metavar="attacker:defender",
-            nargs="+",
+            nargs="*",
             help="One or more 'fight' strings. Format is 'attacker:defender' "
             "(e.g. 1:2 3:2)",
         )
@@ -75,8 +89,20 @@ class Command(BaseCommand):
         parser.add_argument(
             "-w", "--win-condition", choices=["all", "any"], default="any"
         )
+        parser.add_argument(
+            "-b",
+            "--battles",
+            help="Instead of the given fights, evaluate every battle in this "
+            "file (- for stdin), one JSON object per line (see "
+            "battle.evaluate_battles). Prints each battle with its probability "
+            "as it goes",
+        )
 
     def handle(self, *args, **options):
+        if options["battles"]:
+            self.handle_battles(options["battles"])
+            return
+
         check_hands(options["attacker_cards"], options["defender_cards"])
         
         attacker_hand = Hand.objects.get_by_cards(options["attacker_cards"])
@@ -113,3 +139,11 @@ class Command(BaseCommand):
             raise ValueError(f"Invalid win_condition: {options['win_condition']}")
 
         print(f"{prob_of_win:.2%} chance that attacker wins {win_cond_str}")
+
+    def handle_battles(self, path):
+        with open(path) if path != "-" else sys.stdin as file:
+            battles = (json.loads(line) for line in file if line.strip())
+            for battle, probability in evaluate_battles(
+                battles, fight_probability=encounter_win_ratio
+            ):
+                print(json.dumps({**battle, "probability": probability}))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from reconfigure_table import DEFAULT_RECONFIGURE_TABLE_PATH, ReconfigureTable
+
+
+def non_negative(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError("Budgets can't be negative")
+    return value
+
+
+class Command(BaseCommand):
+    help = "Look up the probability of reconfiguring to a desired ship die"
+
+    def add_arguments(self, parser):
+        parser.add_argument("ship_die", type=int, choices=range(1, 7))
+        parser.add_argument("desired_ship_die", type=int, choices=range(1, 7))
+        parser.add_argument("-a", "--abilities", type=non_negative, default=1)
+        parser.add_argument("-A", "--actions", type=non_negative, default=3)
+        parser.add_argument(
+            "-t",
+            "--table",
+            default=DEFAULT_RECONFIGURE_TABLE_PATH,
+            help="Table precomputed by reconfigure_table.py",
+        )
+
+    def handle(self, *args, **options):
+        table = ReconfigureTable.load(options["table"])
+        probability = table.probability(
+            options["ship_die"],
+            options["desired_ship_die"],
+            options["abilities"],
+            options["actions"],
+        )
+        print(
+            f"{probability:.2%} chance of reconfiguring from {options['ship_die']} "
+            f"to {options['desired_ship_die']}"
+        )
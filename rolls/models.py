@@ -1,5 +1,6 @@
 from django.db import models
 
+from quantum import wilson_interval
 from rolls.managers import HandManager
 
 
@@ -57,6 +58,19 @@ class Encounter(models.Model):
             f"{self.attacker_win_ratio:.2%}"
         )
 
+    def confidence_interval(self, confidence=0.95):
+        """Return the (low, high) Wilson interval of attacker_win_ratio"""
+
+        if not self.num_trials:
+            # Calculated exactly
+            return self.attacker_win_ratio, self.attacker_win_ratio
+
+        return wilson_interval(
+            round(self.attacker_win_ratio * self.num_trials),
+            self.num_trials,
+            confidence,
+        )
+
     def compare_to_empty_hand(self):
         """Compare this Encounter to the same Encounter without any cards"""
         
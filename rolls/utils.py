@@ -1,41 +1,57 @@
+import functools
+
 import dask
 
 from tqdm import tqdm
 
 from django.db.models import Q, Count
 
-from quantum_nologs import do_iterations, Attacker, Defender, CARDS
+from quantum import (
+    ATTACKER_ADVANTAGES,
+    CARDS,
+    DEFAULT_CHUNK_SIZE,
+    Attacker,
+    Defender,
+    canonical_ship_dice,
+    do_adaptive_iterations,
+    do_iterations,
+    exact_win_probability,
+    make_rng,
+    matchup_seed_key,
+)
 from rolls.models import Card, Hand, Encounter
 
-ATTACKER_ADVANTAGES = range(1 - 6, 6 - 1 + 1)
-UNIQUE_ENCOUNTERS = tuple(
-    (1, 1 - d) if d < 0 else (1 + d, 1) for d in ATTACKER_ADVANTAGES
-)
+UNIQUE_ENCOUNTERS = tuple(canonical_ship_dice(d) for d in ATTACKER_ADVANTAGES)
 
 
-def handle_all_encounters_parallel(num_trials=1000):
+def handle_all_encounters_parallel(num_trials=1000, **kwargs):
     execs = []
 
     for attacker_hand in tqdm(Hand.objects.all()):
         result = dask.delayed(handle_attacker_hand)(
-            attacker_hand=attacker_hand, num_trials=num_trials, do_create=True
+            attacker_hand=attacker_hand,
+            num_trials=num_trials,
+            do_create=True,
+            **kwargs,
         )
         execs.append(result)
 
     all_results = dask.compute(*execs)
 
-def handle_all_encounters(num_trials=1000):
+def handle_all_encounters(num_trials=1000, **kwargs):
     all_encounters_to_create = []
 
     for attacker_hand in tqdm(Hand.objects.all()):
         all_encounters_to_create.extend(
-            handle_attacker_hand(attacker_hand=attacker_hand, num_trials=num_trials,)
+            handle_attacker_hand(
+                attacker_hand=attacker_hand, num_trials=num_trials, **kwargs
+            )
         )
 
     return all_encounters_to_create
 
 
-def handle_attacker_hand(attacker_hand, num_trials=1000, do_create=False):
+def handle_attacker_hand(attacker_hand, num_trials=1000, do_create=False, **kwargs):
     encounters_to_create = []
     tqdm.write(f"{attacker_hand=}")
     possible_defender_hands = Hand.objects.all()
@@ -45,7 +61,7 @@ def handle_attacker_hand(attacker_hand, num_trials=1000, do_create=False):
     tqdm.write(f"{possible_defender_hands.count()=}")
     for defender_hand in possible_defender_hands:
         _encounters_to_create = handle_encounters_between_hands(
-            attacker_hand, defender_hand, num_trials=num_trials
+            attacker_hand, defender_hand, num_trials=num_trials, **kwargs
         )
         encounters_to_create.extend(_encounters_to_create)
 
@@ -55,7 +71,15 @@ def handle_attacker_hand(attacker_hand, num_trials=1000, do_create=False):
 
 
 def handle_encounters_between_hands(
-    attacker_hand, defender_hand, num_trials=1000, encounters=UNIQUE_ENCOUNTERS,
+    attacker_hand,
+    defender_hand,
+    num_trials=1000,
+    encounters=UNIQUE_ENCOUNTERS,
+    exact=False,
+    target_half_width=None,
+    confidence=0.95,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    seed=None,
 ):
     encounters_to_create = []
     for attacker_ship_die, defender_ship_die in encounters:
@@ -67,14 +91,35 @@ def handle_encounters_between_hands(
             ship_die=defender_ship_die,
             cards=defender_hand.cards.values_list("name", flat=True),
         )
-        attacker_win_count = do_iterations(_attacker, _defender, num_trials)
-        attacker_win_ratio = attacker_win_count / num_trials
+        # Each encounter derives its own stream, so results are reproducible
+        # no matter how many workers there are or what order they run in
+        rng = make_rng(seed, *matchup_seed_key(_attacker, _defender))
+        if exact:
+            attacker_win_ratio = float(exact_win_probability(_attacker, _defender))
+            # Exact ratios weren't calculated over any trials at all
+            trials_used = 0
+        elif target_half_width:
+            estimate = do_adaptive_iterations(
+                functools.partial(do_iterations, _attacker, _defender, rng=rng),
+                target_half_width,
+                max_trials=num_trials,
+                confidence=confidence,
+                chunk_size=chunk_size,
+            )
+            attacker_win_ratio = estimate.ratio
+            trials_used = estimate.num_trials
+        else:
+            attacker_win_count = do_iterations(
+                _attacker, _defender, num_trials, rng=rng
+            )
+            attacker_win_ratio = attacker_win_count / num_trials
+            trials_used = num_trials
         encounter = Encounter(
             attacker_advantage=attacker_ship_die - defender_ship_die,
             attacker_hand=attacker_hand,
             defender_hand=defender_hand,
             attacker_win_ratio=attacker_win_ratio,
-            num_trials=num_trials
+            num_trials=trials_used,
         )
         encounters_to_create.append(encounter)
 
@@ -1,102 +1,552 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import argparse
-from collections import defaultdict
+import concurrent.futures
+import functools
 import itertools
+import json
 import logging
+import os
 import pickle
+from pathlib import Path
 from pprint import pprint
 
 import dask
 
-from dask.distributed import Client, progress
+from dask.distributed import Client, as_completed, progress
+import numpy as np
 from tqdm import tqdm
 
-from quantum_nologs import do_iterations, Attacker, Defender, CARDS, load, save
+from hands import (
+    MAX_HAND_SIZE,
+    count_hand_pairs,
+    count_hands,
+    iter_hand_pairs,
+    iter_hands,
+    rank_hand,
+)
+from matchup_cache import MatchupCache
+from quantum import (
+    ATTACKER_ADVANTAGES,
+    CARDS,
+    DEFAULT_CACHE_PATH,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    Estimate,
+    behavior_key,
+    canonical_ship_dice,
+    derive_seed,
+    get_results,
+    verify_advantage_equivalence,
+    verify_behavior_equivalence,
+)
+from results_table import DEFAULT_RESULTS_TABLE_PATH, ResultsTable
 
 logger = logging.getLogger(__name__)
 
+# The default number of defender hands per work unit
+DEFAULT_TASK_SIZE = 8
+BACKENDS = ["dask", "processes"]
+# How many work units are handed to each worker ahead of time
+MAX_PENDING_PER_WORKER = 4
 
-def get_possible_hands(available_cards=None):
-    if available_cards is None:
-        available_cards = CARDS
-    return [
-        hand
-        for num_cards in range(0, 4)
-        for hand in itertools.combinations(available_cards, num_cards)
-    ]
+# One attacker advantage of one attacker hand against a few defender hands. If
+# trials_done, the results extend trials that are already in the table
+WorkUnit = namedtuple(
+    "WorkUnit", ["attacker_hand", "defender_hands", "attacker_advantage", "trials_done"]
+)
+# One cell of the results table that needs work; see WorkUnit
+Cell = namedtuple(
+    "Cell", ["attacker_hand", "defender_hand", "attacker_advantage", "trials_done"]
+)
 
 
-def handle_defender_hand(
-    num_trials,
-    attacker_cards=None,
-    defender_cards=None,
-    attacker_ship_dice=None,
-    defender_ship_dice=None,
-):
+def get_possible_hands(available_cards=None, max_hand_size=MAX_HAND_SIZE):
+    """Lazily yield every hand of up to max_hand_size of available_cards (by
+    default, CARDS); see hands.iter_hands"""
 
-    if attacker_ship_dice:
-        attacker_ship_dice = [*attacker_ship_dice]
-    else:
-        attacker_ship_dice = range(1, 7)
+    if available_cards is None:
+        available_cards = CARDS
+    return iter_hands(available_cards, max_hand_size)
 
-    if defender_ship_dice:
-        defender_ship_dice = [*defender_ship_dice]
-    else:
-        defender_ship_dice = range(1, 7)
 
-    attackers = [Attacker(ship_die=n, cards=attacker_cards) for n in attacker_ship_dice]
-    defenders = [Defender(ship_die=n, cards=defender_cards) for n in defender_ship_dice]
+def handle_defender_hand(num_trials, **kwargs):
+    """Return get_results for a pair of hands, keyed by (attacker, defender) ship
+    dice"""
+
+    return {
+        (attacker.ship_die, defender.ship_die): result
+        for (attacker, defender), result in get_results(num_trials, **kwargs).items()
+    }
 
-    results = {}
-    for attacker in attackers:
-        for defender in defenders:
-            attacker_win_count = do_iterations(attacker, defender, num_trials)
-            attacker_win_ratio = attacker_win_count / num_trials
-            results[(attacker.ship_die, defender.ship_die)] = attacker_win_ratio
-    return results
 
+def handle_attacker_hand(
+    attacker_hand, num_trials, cards=CARDS, max_hand_size=MAX_HAND_SIZE, **kwargs
+):
+    """Return handle_defender_hand for every defender hand (of up to
+    max_hand_size of the cards the attacker doesn't hold), keyed by defender
+    hand"""
 
-def handle_attacker_hand(attacker_hand, num_trials):
     # tqdm.write(f"{attacker_hand=}")
     results = {}
-    possible_defender_cards = [c for c in CARDS if c not in attacker_hand]
+    possible_defender_cards = [c for c in cards if c not in attacker_hand]
     # tqdm.write(f"{possible_defender_cards=}")
-    possible_defender_hands = get_possible_hands(possible_defender_cards)
+    possible_defender_hands = get_possible_hands(possible_defender_cards, max_hand_size)
     for defender_hand in possible_defender_hands:
         current = handle_defender_hand(
             num_trials=num_trials,
             attacker_cards=attacker_hand,
             defender_cards=defender_hand,
+            **kwargs,
         )
         results[defender_hand] = current
 
-    save(
-        results,
-        f"attacker_{','.join(attacker_hand) if attacker_hand else 'empty'}.pkl",
+    return results
+
+
+def store_results(results_table, attacker_hand, results, num_trials, trials_done=0):
+    """Store the results of handle_attacker_hand in a ResultsTable
+
+    num_trials is the number of trials each plain win ratio was calculated over
+    (0 if they are exact). If trials_done is given, the results are extra trials
+    on top of the ones already in the table, and are merged with them"""
+
+    for defender_hand, results_by_ship_dice in results.items():
+        # Every pair of ship dice with the same advantage shares a cell
+        results_by_advantage = {
+            attacker_ship_die - defender_ship_die: result
+            for (
+                attacker_ship_die,
+                defender_ship_die,
+            ), result in results_by_ship_dice.items()
+        }
+        for attacker_advantage, result in results_by_advantage.items():
+            store_result(
+                results_table,
+                attacker_hand,
+                defender_hand,
+                attacker_advantage,
+                result,
+                num_trials,
+                trials_done=trials_done,
+            )
+
+
+def store_result(
+    results_table,
+    attacker_hand,
+    defender_hand,
+    attacker_advantage,
+    result,
+    num_trials,
+    trials_done=0,
+):
+    """Store a single result in a ResultsTable; see store_results"""
+
+    if isinstance(result, Estimate):
+        ratio, result_num_trials = result.ratio, result.num_trials
+    else:
+        ratio, result_num_trials = result, num_trials
+    if trials_done:
+        old_ratio, old_num_trials = results_table.get(
+            attacker_hand, defender_hand, attacker_advantage
+        )
+        ratio = (old_ratio * old_num_trials + ratio * result_num_trials) / (
+            old_num_trials + result_num_trials
+        )
+        result_num_trials += old_num_trials
+    results_table.set(
+        attacker_hand, defender_hand, attacker_advantage, ratio, result_num_trials
     )
 
 
-def handle_results(execs):
-    print("Done!")
+def hand_num_trials(results_table, attacker_hand):
+    """Return an array of the number of trials behind each of an attacker hand's
+    results, or None if any of them are missing or invalid"""
+
+    cells = results_table.attacker_cells(attacker_hand)
+    ratios = cells["ratio"]
+    if np.isnan(ratios).any() or (ratios < 0).any() or (ratios > 1).any():
+        return None
+    return cells["num_trials"].ravel()
+
+
+def remaining_work(results_table, hands, num_trials, exact=False, adaptive=False):
+    """Lazily yield (hand, trials done) for each of hands that still needs work,
+    where trials done is 0 if it has to be calculated from scratch
+
+    A hand is done if all its results have been calculated: exactly, over
+    num_trials trials, or, if adaptive (i.e. trials stop once precise enough),
+    over any number of trials. A hand whose results all have fewer trials is
+    extended; anything else (missing, invalid or inconsistent results, e.g. from
+    an interrupted write) is redone"""
+
+    for hand in hands:
+        hand_trials = hand_num_trials(results_table, hand)
+        if hand_trials is None:
+            yield hand, 0
+        elif exact or adaptive:
+            continue
+        elif (hand_trials == hand_trials[0]).all() and hand_trials[0] > 0:
+            if hand_trials[0] < num_trials:
+                yield hand, int(hand_trials[0])
+        else:
+            yield hand, 0
+
+
+def cell_done(results_table, cell, num_trials, exact=False, adaptive=False):
+    """Return whether a cell's result is already in the table, with as many
+    trials as it needs (see remaining_work)"""
+
+    try:
+        ratio, cell_num_trials = results_table.get(
+            cell.attacker_hand, cell.defender_hand, cell.attacker_advantage
+        )
+    except KeyError:
+        return False
+    if not 0 <= ratio <= 1:
+        return False
+    return exact or adaptive or cell_num_trials >= num_trials
+
+
+def open_results_table(
+    path, metadata, resume=False, cards=CARDS, max_hand_size=MAX_HAND_SIZE
+):
+    """Create a results table, or, if resume, open the existing one at path
+
+    Raise a ValueError if the existing table is for other hands or was built
+    differently"""
+
+    if not resume or not Path(path).exists():
+        return ResultsTable.create(path, metadata, cards, max_hand_size)
+
+    results_table = ResultsTable(path, mode="r+")
+    if (results_table.cards, results_table.max_hand_size) != (
+        list(cards),
+        max_hand_size,
+    ):
+        raise ValueError(f"{path} is for a different set of hands")
+    # Compare them the way they'd be stored
+    metadata = json.loads(json.dumps(metadata))
+    if results_table.metadata != metadata:
+        raise ValueError(
+            f"{path} was built with {results_table.metadata}, not {metadata}"
+        )
+    return results_table
+
+
+def remaining_cells(remaining, cards=CARDS, max_hand_size=MAX_HAND_SIZE):
+    """Lazily yield every Cell of the (hand, trials done) pairs yielded by
+    remaining_work, against every defender hand of up to max_hand_size of the
+    rest of cards, in the order of their ranks (see hands.rank_hand_pair)"""
+
+    for attacker_hand, trials_done in remaining:
+        for defender_hand in iter_hands(
+            [card for card in cards if card not in attacker_hand], max_hand_size
+        ):
+            for attacker_advantage in ATTACKER_ADVANTAGES:
+                yield Cell(
+                    attacker_hand, defender_hand, attacker_advantage, trials_done
+                )
+
+
+def class_key(cell):
+    """Return the key of the equivalence class of a cell: the cells with the same
+    key behave identically (see quantum.behavior_key)"""
+
+    return (
+        behavior_key(cell.attacker_hand, cell.defender_hand, cell.attacker_advantage),
+        # Extra trials are only shared between cells with as many trials
+        cell.trials_done,
+    )
+
 
+def new_representatives(cells, representatives):
+    """Lazily yield each of cells whose equivalence class hasn't been seen yet
 
-def table(num_trials=1, output=None):
-    # threads_per_worker=4, n_workers=1
-    client = Client()
-    possible_attacker_hands = get_possible_hands()
+    representatives maps class keys (see class_key) to the first cell seen of
+    each class, which is the only one that needs to be evaluated; it's updated
+    as cells are yielded. There are far fewer classes than cells, so it stays
+    small"""
 
-    results = defaultdict(dict)
+    for cell in cells:
+        key = class_key(cell)
+        if key not in representatives:
+            representatives[key] = cell
+            yield cell
 
-    execs = []
 
-    for attacker_hand in set(possible_attacker_hands):
-        result = dask.delayed(handle_attacker_hand)(
-            attacker_hand, num_trials=num_trials
+def work_units(cells, task_size=DEFAULT_TASK_SIZE):
+    """Lazily group the given cells into WorkUnits of up to task_size defender
+    hands each
+
+    Cells of the same attacker hand, advantage and trials done share units;
+    every unit of such a group holds task_size defender hands but the last.
+    Since cells come grouped by attacker hand (see remaining_cells), the units
+    of an attacker hand are yielded once its cells are done, so only one
+    attacker hand's cells are ever held. Units are therefore yielded in the
+    order of their cells' ranks, not biggest first"""
+
+    # Maps (attacker hand, advantage, trials done) to defender hands not yet in
+    # a unit
+    pending = {}
+
+    def unit(group, defender_hands):
+        attacker_hand, attacker_advantage, trials_done = group
+        return WorkUnit(
+            attacker_hand, tuple(defender_hands), attacker_advantage, trials_done
+        )
+
+    attacker_hand = None
+    for cell in cells:
+        if cell.attacker_hand != attacker_hand:
+            for group, defender_hands in pending.items():
+                yield unit(group, defender_hands)
+            pending = {}
+            attacker_hand = cell.attacker_hand
+
+        group = (cell.attacker_hand, cell.attacker_advantage, cell.trials_done)
+        defender_hands = pending.setdefault(group, [])
+        defender_hands.append(cell.defender_hand)
+        if len(defender_hands) == task_size:
+            yield unit(group, pending.pop(group))
+
+    for group, defender_hands in pending.items():
+        yield unit(group, defender_hands)
+
+
+def handle_work_unit(unit, num_trials, **kwargs):
+    """Evaluate a WorkUnit, bringing it up to num_trials trials
+
+    Return its results in the form store_results takes"""
+
+    if unit.trials_done:
+        # The extra trials need their own streams
+        kwargs = {
+            **kwargs,
+            "seed": derive_seed(kwargs.get("seed"), "extend", unit.trials_done),
+        }
+    attacker_ship_die, defender_ship_die = canonical_ship_dice(unit.attacker_advantage)
+    return {
+        defender_hand: handle_defender_hand(
+            num_trials=num_trials - unit.trials_done,
+            attacker_cards=unit.attacker_hand,
+            defender_cards=defender_hand,
+            attacker_ship_dice=[attacker_ship_die],
+            defender_ship_dice=[defender_ship_die],
+            **kwargs,
         )
-        execs.append(result)
+        for defender_hand in unit.defender_hands
+    }
+
+
+def run_work_units(function, units, backend="dask", workers=None):
+    """Call function on each unit, yielding (unit, result) pairs as they finish
+
+    backend is "dask" (a dask.distributed cluster) or "processes" (a plain
+    process pool, which is much quicker to start). workers is the number of
+    worker processes (by default, one per CPU). Units are only taken from
+    units (which may be a generator) as earlier ones finish, so that at most
+    MAX_PENDING_PER_WORKER per worker are in flight at once"""
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+
+    units = iter(units)
+    max_pending = (workers or os.cpu_count() or 1) * MAX_PENDING_PER_WORKER
+    if backend == "dask":
+        # threads_per_worker=4, n_workers=1
+        client = Client(n_workers=workers) if workers else Client()
+        futures = {
+            client.submit(function, unit): unit
+            for unit in itertools.islice(units, max_pending)
+        }
+        finished = as_completed(futures, with_results=True)
+        for future, result in finished:
+            unit = futures.pop(future)
+            for next_unit in itertools.islice(units, 1):
+                next_future = client.submit(function, next_unit)
+                futures[next_future] = next_unit
+                finished.add(next_future)
+            yield unit, result
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(function, unit): unit
+                for unit in itertools.islice(units, max_pending)
+            }
+            while futures:
+                done, __ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    unit = futures.pop(future)
+                    for next_unit in itertools.islice(units, 1):
+                        futures[executor.submit(function, next_unit)] = next_unit
+                    yield unit, future.result()
+
+
+def verify_all_advantage_equivalence(cards=CARDS, max_hand_size=MAX_HAND_SIZE):
+    """Verify advantage equivalence for every legal pair of hands of cards
+
+    Return a dict mapping each (attacker hand, defender hand) that fails
+    verification to its mismatched ship dice pairs"""
+
+    failures = {}
+    for attacker_hand in tqdm(get_possible_hands(cards, max_hand_size)):
+        possible_defender_cards = [c for c in cards if c not in attacker_hand]
+        for defender_hand in get_possible_hands(possible_defender_cards, max_hand_size):
+            mismatches = verify_advantage_equivalence(attacker_hand, defender_hand)
+            if mismatches:
+                failures[(attacker_hand, defender_hand)] = mismatches
+    return failures
+
+
+def verify_all_behavior_equivalence(cards=CARDS, max_hand_size=MAX_HAND_SIZE):
+    """Verify with the exact engine that every pair of hands of cards (at every
+    advantage) that shares a behavior_key has the same outcomes
+
+    Return a list of every (attacker hand, defender hand, attacker advantage)
+    that doesn't; see quantum.verify_behavior_equivalence"""
+
+    return verify_behavior_equivalence(
+        tqdm(
+            iter_hand_pairs(cards, max_hand_size),
+            total=count_hand_pairs(len(cards), max_hand_size),
+        )
+    )
+
+
+def handle_results(execs):
+    print("Done!")
+
+
+def table(
+    num_trials=1,
+    output=DEFAULT_RESULTS_TABLE_PATH,
+    resume=False,
+    backend="dask",
+    workers=None,
+    task_size=DEFAULT_TASK_SIZE,
+    equivalence=True,
+    cards=CARDS,
+    max_hand_size=MAX_HAND_SIZE,
+    **kwargs,
+):
+    """Build the results table at output
+
+    The work is split into WorkUnits of up to task_size defender hands, which
+    are run on the given backend (see run_work_units). Their results all come
+    back to this process, which saves them as they arrive. If equivalence, only
+    one of each class of matchups that behave identically is evaluated, and
+    once everything has been, its result is copied to the rest of its class
+    (see class_key). Attacker hands, and their cells, are streamed from the table
+    in rank order (and work units submitted as workers free up) rather than all
+    read up front; besides the representatives, only the trials done of each
+    attacker hand are kept.
+
+    If resume, hands already in the table at output are skipped, and hands with
+    fewer than num_trials trials are topped up, so an interrupted build can be
+    picked up where it left off, and a finished one extended. Hands are drawn
+    from cards, and hold up to max_hand_size of them
+
+    The work is already spread across workers, so a jobs argument (see
+    quantum.get_results) is ignored: dask workers can't start processes of
+    their own"""
+
+    kwargs.pop("jobs", None)
+    # Everything that determines the results (not just how they're scheduled,
+    # or how many trials are run, which is recorded with each result)
+    metadata = {key: value for key, value in kwargs.items() if key != "cache"}
+    results_table = open_results_table(
+        output, metadata, resume=resume, cards=cards, max_hand_size=max_hand_size
+    )
+    exact = kwargs.get("exact", False)
+    adaptive = bool(kwargs.get("target_half_width"))
+    hands = functools.partial(
+        get_possible_hands, results_table.cards, results_table.max_hand_size
+    )
+    # The trials done of each attacker hand (by rank) as this build found it,
+    # or -1 if it had nothing to do, so that the same cells can be gone through
+    # again once this build's results have been saved
+    hands_trials_done = np.full(
+        count_hands(len(results_table.cards), results_table.max_hand_size), -1
+    )
+
+    def remaining_hands():
+        for hand, trials_done in remaining_work(
+            results_table, hands(), num_trials, exact=exact, adaptive=adaptive
+        ):
+            rank = rank_hand(hand, results_table.cards, results_table.max_hand_size)
+            hands_trials_done[rank] = trials_done
+            yield hand, trials_done
+
+    def remaining_hands_again():
+        # Hands are generated in rank order
+        for hand, trials_done in zip(hands(), hands_trials_done.tolist()):
+            if trials_done >= 0:
+                yield hand, trials_done
+
+    representatives = {}
+    cells = remaining_cells(
+        remaining_hands(), results_table.cards, results_table.max_hand_size
+    )
+    if equivalence:
+        cells = new_representatives(cells, representatives)
+    # Results saved before an interruption don't need to be evaluated again
+    cells = (
+        cell
+        for cell in cells
+        if not cell_done(results_table, cell, num_trials, exact, adaptive)
+    )
 
-    # foo = dask.delayed(handle_results)(execs)
-    # foo.visualize()
-    all_results = dask.compute(*execs)
+    finished = run_work_units(
+        functools.partial(handle_work_unit, num_trials=num_trials, **kwargs),
+        work_units(cells, task_size),
+        backend=backend,
+        workers=workers,
+    )
+    # Save each unit as it finishes, so that an interruption only loses the
+    # units that aren't finished
+    for unit, results in tqdm(finished):
+        for defender_hand, results_by_ship_dice in results.items():
+            (result,) = results_by_ship_dice.values()
+            store_result(
+                results_table,
+                unit.attacker_hand,
+                defender_hand,
+                unit.attacker_advantage,
+                result,
+                0 if exact else num_trials - unit.trials_done,
+                trials_done=unit.trials_done,
+            )
+        results_table.flush()
+
+    logger.info("Did %d attacker hands", (hands_trials_done >= 0).sum())
+    if equivalence:
+        logger.info("Evaluated %d equivalence classes", len(representatives))
+        # Copy each representative's result to the rest of its class
+        class_results = {}
+        for cell in remaining_cells(
+            remaining_hands_again(), results_table.cards, results_table.max_hand_size
+        ):
+            key = class_key(cell)
+            representative = representatives[key]
+            if cell == representative:
+                continue
+            if key not in class_results:
+                class_results[key] = results_table.get(
+                    representative.attacker_hand,
+                    representative.defender_hand,
+                    representative.attacker_advantage,
+                )
+            results_table.set(
+                cell.attacker_hand,
+                cell.defender_hand,
+                cell.attacker_advantage,
+                *class_results[key],
+            )
+        results_table.flush()
 
 
 def main():
@@ -106,17 +556,176 @@ def main():
     else:
         init_logging(logging.INFO)
 
-    if args.output:
-        output = args.output
-    else:
-        output = f"all_results_{args.num_trials}_trials.pkl"
-    table(args.num_trials, output)
+    if args.verify_advantage:
+        failures = verify_all_advantage_equivalence(args.cards, args.max_hand_size)
+        if failures:
+            pprint(failures)
+            raise AssertionError(
+                f"Outcomes don't only depend on advantage for {len(failures)} "
+                "pairs of hands!"
+            )
+        print("Verified that outcomes only depend on advantage for every hand")
+        return
+
+    if args.verify_equivalence:
+        mismatches = verify_all_behavior_equivalence(args.cards, args.max_hand_size)
+        if mismatches:
+            pprint(mismatches)
+            raise AssertionError(
+                f"{len(mismatches)} matchups don't behave like the rest of their "
+                "equivalence class!"
+            )
+        print("Verified that every equivalence class of matchups behaves the same")
+        return
+
+    table(
+        args.num_trials,
+        args.output,
+        resume=args.resume,
+        backend=args.backend,
+        workers=args.workers,
+        task_size=args.task_size,
+        equivalence=not args.no_equivalence,
+        cards=args.cards,
+        max_hand_size=args.max_hand_size,
+        exact=args.exact,
+        batch=args.batch,
+        target_half_width=args.precision,
+        confidence=args.confidence,
+        chunk_size=args.chunk_size,
+        cache=MatchupCache(args.cache, args.cache_size) if args.cache else None,
+        seed=args.seed,
+        importance_sampling=args.rare,
+    )
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("num_trials", type=int, nargs="?", default=100)
-    parser.add_argument("-o", "--output")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=DEFAULT_RESULTS_TABLE_PATH,
+        help="Directory to save the results table in (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Pick up the table at --output where it left off, skipping hands "
+        "that are done. Hands with fewer than num_trials trials are topped up "
+        "to num_trials",
+    )
+    parser.add_argument(
+        "-e",
+        "--exact",
+        action="store_true",
+        help="Calculate exact win probabilities instead of running trials",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="Run trials in vectorized batches",
+    )
+    parser.add_argument(
+        "-r",
+        "--rare",
+        action="store_true",
+        help="Estimate win ratios by importance sampling, which gives much "
+        "tighter intervals for lopsided matchups",
+    )
+    parser.add_argument(
+        "-p",
+        "--precision",
+        type=float,
+        help="Run trials in chunks until the confidence interval half-width of "
+        "each win ratio is at most this (e.g. 0.0025). num_trials becomes the "
+        "maximum number of trials per matchup",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the intervals used by --precision",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of trials per chunk; trials are run (and, with "
+        "--precision, checked) a chunk at a time",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        nargs="?",
+        const=DEFAULT_CACHE_PATH,
+        help="Look up (and store) matchup results in an on-disk cache (only "
+        "exact or seeded ones). Uses %(const)s if no path is given",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help="Maximum number of matchups to keep in the cache (see --cache)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Root random seed. Each matchup derives its own stream from it, so "
+        "the table is reproducible no matter how the work is scheduled",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="dask",
+        help="Run the work on a dask.distributed cluster, or a plain process "
+        "pool (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--task-size",
+        type=int,
+        default=DEFAULT_TASK_SIZE,
+        help="Maximum number of defender hands per unit of work (default: "
+        "%(default)s)",
+    )
+    parser.add_argument(
+        "--verify-advantage",
+        action="store_true",
+        help="Instead of building the table, use the exact engine to verify "
+        "that outcomes only depend on the difference between ship dice",
+    )
+    parser.add_argument(
+        "--cards",
+        nargs="+",
+        choices=CARDS,
+        default=CARDS,
+        help="Only deal hands from these cards (default: all of them)",
+    )
+    parser.add_argument(
+        "--max-hand-size",
+        type=int,
+        default=MAX_HAND_SIZE,
+        help="Most cards a hand can hold (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-equivalence",
+        action="store_true",
+        help="Evaluate every pair of hands, even ones that behave identically to "
+        "another pair",
+    )
+    parser.add_argument(
+        "--verify-equivalence",
+        action="store_true",
+        help="Instead of building the table, use the exact engine to verify that "
+        "pairs of hands treated as equivalent behave identically",
+    )
     parser.add_argument("-v", "--verbose", action="store_true")
     return parser.parse_args()
 
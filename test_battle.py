@@ -0,0 +1,189 @@
+from fractions import Fraction
+import random
+
+import pytest
+
+from battle import (
+    battle_win_probability,
+    compile_fights,
+    do_battle,
+    do_compiled_battle,
+    evaluate_battles,
+    fight_win_probabilities,
+    fight_win_probability,
+    plan_attacks,
+    win_condition_label,
+    wins_distribution,
+)
+
+
+class TestWinsDistribution:
+    def test_no_fights(self):
+        assert wins_distribution([]) == [1]
+
+    def test_binomial(self):
+        half = Fraction(1, 2)
+        assert wins_distribution([half] * 3) == [
+            Fraction(1, 8),
+            Fraction(3, 8),
+            Fraction(3, 8),
+            Fraction(1, 8),
+        ]
+
+    def test_win_conditions(self):
+        probabilities = [Fraction(1, 2), Fraction(1, 3), Fraction(3, 4)]
+        distribution = wins_distribution(probabilities)
+        assert sum(distribution) == 1
+        assert battle_win_probability(distribution, "all") == Fraction(1, 8)
+        assert battle_win_probability(distribution, "any") == 1 - Fraction(1, 12)
+        assert battle_win_probability(distribution, at_least=1) == (
+            battle_win_probability(distribution, "any")
+        )
+        assert battle_win_probability(distribution, at_least=2) == (
+            distribution[2] + distribution[3]
+        )
+
+    @pytest.mark.parametrize("at_least", [-1, 0, 4])
+    def test_invalid_at_least(self, at_least):
+        with pytest.raises(ValueError):
+            battle_win_probability([0, 0, 0, 1], at_least=at_least)
+        with pytest.raises(ValueError):
+            plan_attacks([1, 2, 3], [1, 2, 3], at_least=at_least)
+
+    def test_invalid_win_condition(self):
+        with pytest.raises(ValueError):
+            battle_win_probability([0, 1], "most")
+
+    def test_win_condition_label(self):
+        assert win_condition_label(3, "all") == "ALL fights"
+        assert win_condition_label(3, "any") == "ANY fight"
+        # at_least overrides the win condition
+        assert win_condition_label(3, "all", at_least=2) == "at least 2 fights"
+        assert win_condition_label(3, "any", at_least=3) == "ALL fights"
+
+
+def test_matches_simulation():
+    fights = [(3, 2), (4, 4), (1, 5)]
+    distribution = wins_distribution(
+        fight_win_probabilities(fights, ["relentless"], ["stubborn"])
+    )
+
+    rng = random.Random(0)
+    num_trials = 20000
+    num_wins_counts = [0] * (len(fights) + 1)
+    for __ in range(num_trials):
+        __, num_wins = do_battle(fights, ["relentless"], ["stubborn"], rng=rng)
+        num_wins_counts[num_wins] += 1
+
+    for count, probability in zip(num_wins_counts, distribution):
+        assert count / num_trials == pytest.approx(probability, abs=0.01)
+
+
+class TestCompiledBattle:
+    fights = [(3, 2), (4, 4), (1, 5), (2, 6)]
+
+    def test_matches_do_battle(self):
+        rng = random.Random(0)
+        expected = [
+            do_battle(self.fights, ["cruel"], ["scrappy"], rng=rng) for __ in range(500)
+        ]
+        compiled_fights = compile_fights(
+            self.fights, ["cruel"], ["scrappy"], rng=random.Random(0)
+        )
+        assert [
+            do_compiled_battle(compiled_fights, len(self.fights)) for __ in range(500)
+        ] == expected
+
+    @pytest.mark.parametrize("needed", [1, 2, 4])
+    def test_stop_early(self, needed):
+        # Stopping early uses fewer rolls, so give each battle its own stream
+        for seed in range(200):
+            full = do_compiled_battle(
+                compile_fights(self.fights, None, None, rng=random.Random(seed)),
+                needed,
+            )
+            early = do_compiled_battle(
+                compile_fights(self.fights, None, None, rng=random.Random(seed)),
+                needed,
+                stop_early=True,
+            )
+            assert early[0] == full[0]
+            assert early[1] <= full[1]
+
+
+class TestPlanAttacks:
+    def test_single_fight(self):
+        plan = plan_attacks([2], [3])
+        assert plan.attack == (2, 3)
+        assert plan.probability == pytest.approx(fight_win_probability(2, 3, (), ()))
+        assert plan.on_win.probability == 1
+        assert plan.on_loss.probability == 0
+
+    def test_retry(self):
+        # Whichever ship attacks first, the other gets a go if it loses
+        plan = plan_attacks([2, 5], [3])
+        assert plan.probability == pytest.approx(
+            1
+            - (1 - fight_win_probability(2, 3, (), ()))
+            * (1 - fight_win_probability(5, 3, (), ()))
+        )
+
+    def test_not_enough_ships(self):
+        assert plan_attacks([1], [5, 6]).probability == 0
+
+    def test_any(self):
+        plan = plan_attacks([1, 2], [1, 6], win_condition="any")
+        # The weakest defender is the best target
+        assert plan.attack[1] == 6
+
+    def test_at_least(self):
+        all_plan = plan_attacks(range(1, 7), range(1, 7), win_condition="all")
+        at_least_plan = plan_attacks(range(1, 7), range(1, 7), at_least=6)
+        assert all_plan.probability == pytest.approx(at_least_plan.probability)
+        assert plan_attacks(range(1, 7), range(1, 7), at_least=3).probability > (
+            all_plan.probability
+        )
+
+
+class TestEvaluateBattles:
+    def test_hands_per_fight(self):
+        battles = [
+            {"fights": [[1, 2], [3, 3]], "attacker_cards": ["cruel"]},
+            {
+                "fights": [[1, 2, ["cruel"], []], [3, 3, [], ["stubborn"]]],
+                "win_condition": "any",
+            },
+        ]
+        results = list(evaluate_battles(battles, exact=True))
+        assert [battle for battle, __ in results] == battles
+        assert results[0][1] == pytest.approx(
+            fight_win_probability(1, 2, ("cruel",), (), True)
+            * fight_win_probability(3, 3, ("cruel",), (), True)
+        )
+        assert results[1][1] == pytest.approx(
+            1
+            - (1 - fight_win_probability(1, 2, ("cruel",), (), True))
+            * (1 - fight_win_probability(3, 3, (), ("stubborn",), True))
+        )
+
+    def test_fights_looked_up_once(self):
+        lookups = []
+
+        def fight_probability(*fight):
+            lookups.append(fight)
+            return 0.5
+
+        battles = [{"fights": [[1, 2], [1, 2]], "at_least": 1}] * 100
+        for __, probability in evaluate_battles(
+            battles, fight_probability=fight_probability
+        ):
+            assert probability == 0.75
+        assert lookups == [(1, 2, (), ())]
+
+    def test_streams(self):
+        def battles():
+            yield {"fights": [[1, 2]]}
+            raise AssertionError("Read too far ahead")
+
+        results = evaluate_battles(battles(), fight_probability=lambda *fight: 1)
+        assert next(results)[1] == 1
@@ -0,0 +1,82 @@
+import itertools
+
+import pytest
+
+from hands import (
+    count_hand_pairs,
+    count_hands,
+    iter_hand_pairs,
+    iter_hands,
+    rank_hand,
+    rank_hand_pair,
+    unrank_hand,
+    unrank_hand_pair,
+)
+from quantum import CARDS
+
+
+@pytest.mark.parametrize(
+    "num_cards,max_hand_size", [(0, 3), (3, 3), (7, 3), (7, 0), (8, 5)]
+)
+class TestRanking:
+    def test_hands(self, num_cards, max_hand_size):
+        cards = [f"card{i}" for i in range(num_cards)]
+        all_hands = list(iter_hands(cards, max_hand_size))
+        assert len(all_hands) == count_hands(num_cards, max_hand_size)
+        for rank, hand in enumerate(all_hands):
+            assert rank_hand(hand, cards, max_hand_size) == rank
+            assert unrank_hand(rank, cards, max_hand_size) == hand
+
+    def test_hand_pairs(self, num_cards, max_hand_size):
+        cards = [f"card{i}" for i in range(num_cards)]
+        pairs = list(iter_hand_pairs(cards, max_hand_size))
+        assert len(pairs) == count_hand_pairs(num_cards, max_hand_size)
+        for rank, (attacker_hand, defender_hand) in enumerate(pairs):
+            assert not set(attacker_hand).intersection(defender_hand)
+            assert (
+                rank_hand_pair(attacker_hand, defender_hand, cards, max_hand_size)
+                == rank
+            )
+            assert unrank_hand_pair(rank, cards, max_hand_size) == (
+                attacker_hand,
+                defender_hand,
+            )
+
+
+def test_order_matches_combinations():
+    assert list(iter_hands(CARDS)) == [
+        hand
+        for hand_size in range(4)
+        for hand in itertools.combinations(CARDS, hand_size)
+    ]
+
+
+def test_any_card_order():
+    assert rank_hand(("rational", "cruel"), CARDS) == rank_hand(
+        ("cruel", "rational"), CARDS
+    )
+
+
+def test_large():
+    # Far too many pairs to enumerate
+    cards = [f"card{i}" for i in range(60)]
+    num_pairs = count_hand_pairs(len(cards), 8)
+    assert num_pairs > 10**18
+    for rank in [0, 1, num_pairs // 3, num_pairs // 2, num_pairs - 1]:
+        attacker_hand, defender_hand = unrank_hand_pair(rank, cards, 8)
+        assert rank_hand_pair(attacker_hand, defender_hand, cards, 8) == rank
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        rank_hand(("cruel", "cruel"), CARDS)
+    with pytest.raises(ValueError):
+        rank_hand(("sneaky",), CARDS)
+    with pytest.raises(ValueError):
+        rank_hand(("cruel", "rational", "scrappy", "stubborn"), CARDS)
+    with pytest.raises(ValueError):
+        rank_hand_pair(("cruel",), ("cruel", "rational"), CARDS)
+    with pytest.raises(IndexError):
+        unrank_hand(count_hands(len(CARDS)), CARDS)
+    with pytest.raises(IndexError):
+        unrank_hand_pair(-1, CARDS)
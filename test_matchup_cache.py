@@ -0,0 +1,121 @@
+import pickle
+
+import pytest
+
+import matchup_cache
+import quantum
+from matchup_cache import MatchupCache, matchup_key, method_kernels
+from quantum import Estimate, get_results
+
+
+def test_key_ignores_card_order():
+    assert matchup_key(["cruel", "scrappy"], [], 1, {"exact": True}) == matchup_key(
+        ("scrappy", "cruel"), None, 1, {"exact": True}
+    )
+    assert matchup_key(["cruel"], [], 1, {"exact": True}) != matchup_key(
+        ["cruel"], [], 2, {"exact": True}
+    )
+
+
+@pytest.mark.parametrize(
+    "method, kernel",
+    [
+        ({"exact": True}, quantum.exact_win_probability),
+        ({"exact": True}, quantum._combat_die_faces),
+        ({"batch": False, "num_trials": 10, "seed": 1}, quantum.do_iterations),
+        ({"batch": False, "num_trials": 10, "seed": 1}, quantum.derive_seed),
+        (
+            {"batch": False, "num_trials": 10, "seed": 1, "target_half_width": 0.1},
+            quantum.do_adaptive_iterations,
+        ),
+    ],
+)
+def test_key_covers_method_kernel(method, kernel):
+    assert kernel in method_kernels(method)
+
+
+def test_key_covers_batch_kernels():
+    quantum_batch = pytest.importorskip("quantum_batch")
+    batch = {"batch": True, "num_trials": 10, "seed": 1}
+    assert quantum_batch.batch_attack in method_kernels(batch)
+    assert quantum_batch.BatchSide in method_kernels(batch)
+    assert quantum_batch.draw_combat_dice in method_kernels(batch)
+    assert quantum.do_iterations not in method_kernels(batch)
+    importance = {**batch, "importance_sampling": True}
+    assert quantum_batch.do_iterations_importance in method_kernels(importance)
+    assert quantum_batch.importance_weights in method_kernels(importance)
+    assert quantum_batch.TILTS in method_kernels(importance)
+
+
+def test_key_covers_constants(monkeypatch):
+    quantum_batch = pytest.importorskip("quantum_batch")
+    importance = {"batch": False, "seed": 1, "importance_sampling": True}
+    key = matchup_key([], [], 0, importance)
+    monkeypatch.setattr(quantum_batch, "RARE_THRESHOLD", 0.1)
+    assert matchup_key([], [], 0, importance) != key
+
+
+def test_round_trip(tmp_path):
+    cache = MatchupCache(tmp_path / "cache.sqlite3")
+    cache.set("a", 0.5)
+    cache.set("b", Estimate(0.25, 1000, 0.2, 0.3))
+    assert cache.get("a") == 0.5
+    assert cache.get("b") == Estimate(0.25, 1000, 0.2, 0.3)
+    assert cache.get("c") is None
+
+
+def test_lru_eviction(tmp_path):
+    cache = MatchupCache(tmp_path / "cache.sqlite3", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Use "a" so that "b" is the least recently used
+    cache.get("a")
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+
+def test_reads_are_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(matchup_cache, "TOUCH_BATCH_SIZE", 2)
+    cache = MatchupCache(tmp_path / "cache.sqlite3")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    changes = cache.connection.total_changes
+    assert cache.get("a") == 1
+    assert cache.connection.total_changes == changes
+    # Both reads are written at once
+    cache.get("b")
+    assert cache.connection.total_changes == changes + 2
+
+
+def test_replace_doesnt_evict(tmp_path):
+    cache = MatchupCache(tmp_path / "cache.sqlite3", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("b", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") == 3
+
+
+def test_picklable(tmp_path):
+    cache = MatchupCache(tmp_path / "cache.sqlite3")
+    cache.set("a", 1)
+    assert pickle.loads(pickle.dumps(cache)).get("a") == 1
+
+
+def test_get_results_uses_cache(tmp_path):
+    cache = MatchupCache(tmp_path / "cache.sqlite3")
+    results = get_results(100, attacker_cards=["cruel"], seed=1, cache=cache)
+    # One entry per advantage
+    assert len(cache) == 11
+    cached_results = get_results(100, attacker_cards=["cruel"], seed=1, cache=cache)
+    assert list(results.values()) == list(cached_results.values())
+
+
+def test_get_results_unseeded(tmp_path):
+    cache = MatchupCache(tmp_path / "cache.sqlite3")
+    get_results(100, attacker_cards=["cruel"], cache=cache)
+    assert len(cache) == 0
+    get_results(100, attacker_cards=["cruel"], exact=True, cache=cache)
+    assert len(cache) == 11
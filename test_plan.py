@@ -0,0 +1,33 @@
+import pytest
+
+from battle import fight_win_probability
+from plan import plan_board, plan_reconfigure_attack
+
+
+def test_no_actions():
+    assert plan_reconfigure_attack(3, 3, 1, 0) == (0, None)
+
+
+def test_attack_only():
+    probability, move = plan_reconfigure_attack(3, 2, 0, 1)
+    assert move == "attack"
+    assert probability == fight_win_probability(3, 2, (), (), True)
+
+
+def test_one_reconfigure():
+    # With a spare action, reconfiguring a 6 beats attacking with it
+    probability, move = plan_reconfigure_attack(6, 1, 0, 2)
+    assert move == "reconfigure"
+    assert probability == pytest.approx(
+        sum(fight_win_probability(ship_die, 1, (), (), True) for ship_die in range(1, 6))
+        / 5
+    )
+
+
+def test_more_actions_never_worse():
+    for ship_die, defender_ship_die in plan_board(range(1, 7), range(1, 7), 1, 1):
+        probabilities = [
+            plan_reconfigure_attack(ship_die, defender_ship_die, 1, actions)[0]
+            for actions in range(1, 5)
+        ]
+        assert probabilities == sorted(probabilities)
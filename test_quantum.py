@@ -1,6 +1,30 @@
+from fractions import Fraction
+import functools
+import itertools
+import logging
+import pickle
+import random
+
 import pytest
 
-from quantum import Attacker, Defender
+import quantum
+from quantum import (
+    Attacker,
+    Defender,
+    Estimate,
+    behavior_key,
+    canonical_ship_dice,
+    check_shared_cards,
+    derive_seed,
+    do_adaptive_iterations,
+    do_iterations,
+    exact_win_probability,
+    get_results,
+    set_tracing,
+    verify_advantage_equivalence,
+    verify_behavior_equivalence,
+    wilson_interval,
+)
 
 
 class TestNoCards:
@@ -45,6 +69,13 @@ class TestNoCards:
             a = Attacker(ship_die=6, combat_die_rolls=[0])
 
 
+def test_check_shared_cards():
+    check_shared_cards(["cruel"], ["scrappy"])
+    check_shared_cards(None, ["scrappy"])
+    with pytest.raises(ValueError):
+        check_shared_cards(["cruel", "scrappy"], ["scrappy"])
+
+
 class TestCards:
     """Test specific card behaviours"""
 
@@ -143,3 +174,312 @@ class TestCards:
         assert a.total() == 3
         assert d.total() == 3
         assert not attacker_wins
+
+
+class TestExact:
+    """Test exact win probabilities"""
+
+    def test_no_cards(self):
+        a = Attacker(ship_die=3)
+        d = Defender(ship_die=3)
+        # Attacker wins ties, so wins whenever its combat die is <= defender's
+        assert exact_win_probability(a, d) == Fraction(21, 36)
+
+    def test_rational(self):
+        a = Attacker(ship_die=3, cards=["rational"])
+        d = Defender(ship_die=1)
+        # 3+3 only wins if the defender rolls a 5 or 6
+        assert exact_win_probability(a, d) == Fraction(1, 3)
+
+    def test_relentless_attacker(self):
+        a = Attacker(ship_die=3, cards=["relentless"])
+        d = Defender(ship_die=3)
+        # Sum over defender roll d of: d/6 + (6-d)/6 * d/6
+        assert exact_win_probability(a, d) == Fraction(161, 216)
+
+    def test_stubborn_defender(self):
+        a = Attacker(ship_die=3)
+        d = Defender(ship_die=3, cards=["stubborn"])
+        assert exact_win_probability(a, d) == Fraction(15, 36)
+
+    @pytest.mark.parametrize(
+        "attacker_cards,defender_cards",
+        [
+            ((), ()),
+            (("relentless",), ("cruel",)),
+            (("scrappy", "cruel"), ("relentless", "stubborn")),
+            (("ferocious", "scrappy"), ("rational",)),
+            (("strategic",), ("relentless", "cruel", "stubborn")),
+        ],
+    )
+    def test_matches_simulation(self, attacker_cards, defender_cards):
+        random.seed(0)
+        a = Attacker(ship_die=4, cards=attacker_cards)
+        d = Defender(ship_die=3, cards=defender_cards)
+        num_trials = 20000
+        ratio = do_iterations(a, d, num_trials) / num_trials
+        assert exact_win_probability(a, d) == pytest.approx(ratio, abs=0.015)
+
+
+class TestCombatLog:
+    def test_off_by_default(self):
+        a = Attacker(ship_die=2, combat_die_rolls=[1])
+        d = Defender(ship_die=2, combat_die_rolls=[1])
+        a.attack(d)
+        assert a.combat_log is None
+        assert a.history() == ""
+
+    def test_reset_reuses_rolls(self):
+        a = Attacker(ship_die=2)
+        combat_die_rolls = a.combat_die_rolls
+        do_iterations(a, Defender(ship_die=2), 10)
+        assert a.combat_die_rolls is combat_die_rolls
+        a.reset()
+        assert combat_die_rolls == []
+
+    def test_full(self):
+        a = Attacker(ship_die=2, cards=["relentless"], combat_log_size=None)
+        d = Defender(ship_die=1)
+        do_iterations(a, d, 100)
+        # At least one recalc per trial, and two whenever Relentless kicked in
+        assert len(a.combat_log) >= 100
+
+    def test_ring_buffer(self):
+        a = Attacker(ship_die=2, combat_log_size=3)
+        d = Defender(ship_die=1)
+        do_iterations(a, d, 100)
+        assert len(a.combat_log) == 3
+        assert len(a.history().splitlines()) == 3
+
+
+class TestAdaptive:
+    def test_wilson_interval(self):
+        low, high = wilson_interval(50, 100)
+        assert low == pytest.approx(0.4038, abs=1e-4)
+        assert high == pytest.approx(0.5962, abs=1e-4)
+        low, high = wilson_interval(0, 100)
+        assert low == 0
+        assert high == pytest.approx(0.0370, abs=1e-4)
+
+    def test_stops_early_for_lopsided_matchups(self):
+        random.seed(0)
+        a = Attacker(ship_die=6)
+        d = Defender(ship_die=1)
+        estimate = do_adaptive_iterations(
+            functools.partial(do_iterations, a, d),
+            target_half_width=0.01,
+            max_trials=100000,
+            chunk_size=500,
+        )
+        assert estimate.num_trials < 100000
+        assert (estimate.high - estimate.low) / 2 <= 0.01
+        assert estimate.low <= exact_win_probability(a, d) <= estimate.high
+
+    def test_respects_max_trials(self):
+        a = Attacker(ship_die=3)
+        d = Defender(ship_die=3)
+        estimate = do_adaptive_iterations(
+            functools.partial(do_iterations, a, d),
+            target_half_width=0.0001,
+            max_trials=1500,
+            chunk_size=1000,
+        )
+        assert estimate.num_trials == 1500
+
+    @pytest.mark.parametrize("max_trials, chunk_size", [(0, 1000), (1000, 0)])
+    def test_invalid(self, max_trials, chunk_size):
+        with pytest.raises(ValueError):
+            do_adaptive_iterations(
+                functools.partial(do_iterations, Attacker(3), Defender(3)),
+                target_half_width=0.01,
+                max_trials=max_trials,
+                chunk_size=chunk_size,
+            )
+
+
+class TestAdvantage:
+    def test_canonical_ship_dice(self):
+        assert canonical_ship_dice(0) == (1, 1)
+        assert canonical_ship_dice(5) == (6, 1)
+        assert canonical_ship_dice(-5) == (1, 6)
+
+    @pytest.mark.parametrize(
+        "attacker_cards,defender_cards",
+        [
+            ((), ()),
+            (("relentless", "scrappy", "ferocious"), ("cruel", "stubborn")),
+            (("cruel", "strategic"), ("rational", "relentless")),
+        ],
+    )
+    def test_verify_advantage_equivalence(self, attacker_cards, defender_cards):
+        assert verify_advantage_equivalence(attacker_cards, defender_cards) == []
+
+    def test_verify_behavior_equivalence(self):
+        cards = ["ferocious", "cruel", "scrappy", "rational", "stubborn"]
+        hands = [
+            hand
+            for num_cards in range(3)
+            for hand in itertools.combinations(cards, num_cards)
+        ]
+        matchups = [
+            (attacker_hand, defender_hand)
+            for attacker_hand in hands
+            for defender_hand in hands
+            if not set(attacker_hand).intersection(defender_hand)
+        ]
+        assert verify_behavior_equivalence(matchups) == []
+
+    def test_behavior_key(self):
+        assert behavior_key(["stubborn"], ["scrappy"], 0) == behavior_key([], [], 0)
+        assert behavior_key(["rational", "relentless"], ["cruel"], 0) == (
+            behavior_key(["rational"], [], 0)
+        )
+        assert behavior_key(["strategic"], [], 3) == behavior_key([], [], 1)
+        assert behavior_key(["relentless"], [], 0) != behavior_key([], [], 0)
+        assert behavior_key([], ["cruel"], 0) != behavior_key([], [], 0)
+
+    def test_results_shared_by_advantage(self):
+        results = get_results(10, attacker_cards=["cruel"])
+        by_dice = {
+            (attacker.ship_die, defender.ship_die): ratio
+            for (attacker, defender), ratio in results.items()
+        }
+        assert len(by_dice) == 36
+        for (attacker_ship_die, defender_ship_die), ratio in by_dice.items():
+            advantage = attacker_ship_die - defender_ship_die
+            assert ratio == by_dice[canonical_ship_dice(advantage)]
+
+
+class TestSeeding:
+    def test_derive_seed(self):
+        assert derive_seed(1, "a", 2) == derive_seed(1, "a", 2)
+        assert derive_seed(1, "a", 2) != derive_seed(1, "a", 3)
+        assert derive_seed(1, "a", 2) != derive_seed(2, "a", 2)
+        assert derive_seed(None, "a", 2) is None
+
+    def test_side_rng(self):
+        a = Attacker(ship_die=3, rng=random.Random(0))
+        d = Defender(ship_die=3, rng=random.Random(0))
+        a.attack(d)
+        # Both sides were given identical streams
+        assert a.combat_die == d.combat_die
+
+    def test_do_iterations_restores_rng(self):
+        rng = random.Random(0)
+        a = Attacker(ship_die=3, rng=rng)
+        d = Defender(ship_die=3)
+        do_iterations(a, d, 10, rng=random.Random(1))
+        assert a.rng is rng
+        assert d.rng is random
+        # Sides still have to be sent to worker processes
+        do_iterations(a, d, 10)
+        assert pickle.loads(pickle.dumps(d)).ship_die == 3
+
+    def test_get_results_reproducible(self):
+        def results_by_dice(ship_dice):
+            results = get_results(
+                500,
+                attacker_cards=["relentless"],
+                defender_cards=["cruel"],
+                attacker_ship_dice=ship_dice,
+                defender_ship_dice=ship_dice,
+                seed=1234,
+                canonicalize=False,
+            )
+            return {(a.ship_die, d.ship_die): r for (a, d), r in results.items()}
+
+        results = results_by_dice(range(1, 7))
+        assert results == results_by_dice(range(1, 7))
+        # The order in which matchups are evaluated doesn't matter
+        assert results == results_by_dice(range(6, 0, -1))
+
+    def test_get_results_reproducible_by_advantage(self):
+        def results_by_advantage(attacker_ship_dice, defender_ship_dice):
+            results = get_results(
+                500,
+                attacker_cards=["relentless"],
+                defender_cards=["cruel"],
+                attacker_ship_dice=attacker_ship_dice,
+                defender_ship_dice=defender_ship_dice,
+                seed=1234,
+            )
+            return {a.ship_die - d.ship_die: r for (a, d), r in results.items()}
+
+        results = results_by_advantage(range(1, 7), range(1, 7))
+        # Whichever pair of ship dice represents an advantage, its result is the
+        # same
+        assert results == results_by_advantage(range(6, 0, -1), range(6, 0, -1))
+        assert results_by_advantage([3], [3]) == {0: results[0]}
+        assert results_by_advantage([6], [2]) == {4: results[4]}
+
+    @pytest.mark.parametrize("target_half_width", [None, 0.05])
+    def test_jobs_reproducible(self, target_half_width):
+        def results(jobs):
+            return list(
+                get_results(
+                    2500,
+                    attacker_cards=["scrappy"],
+                    defender_cards=["stubborn"],
+                    seed=99,
+                    target_half_width=target_half_width,
+                    jobs=jobs,
+                ).values()
+            )
+
+        # Running trials across processes doesn't change the results
+        assert results(1) == results(2)
+
+    def test_batch_chunks(self, monkeypatch):
+        pytest.importorskip("numpy")
+        chunk_sizes = []
+
+        def run_matchup_chunk(attacker, defender, num_trials, *args, **kwargs):
+            chunk_sizes.append(num_trials)
+            return original(attacker, defender, num_trials, *args, **kwargs)
+
+        original = quantum.run_matchup_chunk
+        monkeypatch.setattr(quantum, "run_matchup_chunk", run_matchup_chunk)
+        results = get_results(2500, attacker_ship_dice=[3], seed=1, batch=True)
+        # Each matchup's trials are run at once
+        assert chunk_sizes == [2500] * len(results)
+
+        monkeypatch.undo()
+        # and running them across processes doesn't change the results
+        parallel_results = get_results(
+            2500, attacker_ship_dice=[3], seed=1, batch=True, jobs=2
+        )
+        assert list(results.values()) == list(parallel_results.values())
+
+    def test_importance_sampling(self):
+        pytest.importorskip("numpy")
+        results = get_results(
+            2000,
+            attacker_ship_dice=[6],
+            defender_ship_dice=[1, 2],
+            seed=1,
+            importance_sampling=True,
+        )
+        for (attacker, defender), estimate in results.items():
+            assert isinstance(estimate, Estimate)
+            exact = float(exact_win_probability(attacker, defender))
+            assert estimate.low <= exact <= estimate.high
+
+
+class TestTracing:
+    def test_off_by_default(self, caplog):
+        caplog.set_level(logging.DEBUG, logger="quantum")
+        a = Attacker(ship_die=2, cards=["relentless"])
+        d = Defender(ship_die=1)
+        do_iterations(a, d, 10)
+        assert not caplog.records
+
+    def test_on(self, caplog):
+        caplog.set_level(logging.DEBUG, logger="quantum")
+        a = Attacker(ship_die=2, combat_die_rolls=[1])
+        d = Defender(ship_die=1, combat_die_rolls=[1])
+        set_tracing(True)
+        try:
+            a.attack(d)
+        finally:
+            set_tracing(False)
+        assert "recalc attacker_total=3 defender_total=2" in caplog.messages
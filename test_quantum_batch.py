@@ -0,0 +1,166 @@
+import itertools
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from quantum import CARDS, Attacker, Defender, exact_win_probability
+from quantum_batch import (
+    batch_attack,
+    compare_common_random_numbers,
+    do_iterations_batch,
+    do_iterations_importance,
+    do_iterations_replayed,
+    draw_combat_dice,
+)
+
+
+HANDS = [
+    hand for num_cards in range(0, 3) for hand in itertools.combinations(CARDS, num_cards)
+]
+
+
+@pytest.mark.parametrize(
+    "attacker_cards,defender_cards",
+    [
+        (attacker_cards, defender_cards)
+        for attacker_cards, defender_cards in itertools.product(HANDS, HANDS)
+        if not set(attacker_cards).intersection(defender_cards)
+    ][::7],
+)
+def test_batch_matches_scalar(attacker_cards, defender_cards):
+    """Replaying each trial's dice through Attacker.attack gives the same result"""
+    rng = np.random.default_rng(0)
+    num_trials = 200
+    attacker_dice, defender_dice = draw_combat_dice(rng, num_trials)
+    attacker_wins, attacker_rolls, defender_rolls = batch_attack(
+        Attacker(ship_die=3, cards=attacker_cards),
+        Defender(ship_die=4, cards=defender_cards),
+        attacker_dice,
+        defender_dice,
+    )
+    for trial in range(num_trials):
+        a = Attacker(
+            ship_die=3,
+            cards=attacker_cards,
+            combat_die_rolls=attacker_dice[trial, : attacker_rolls[trial]].tolist(),
+        )
+        d = Defender(
+            ship_die=4,
+            cards=defender_cards,
+            combat_die_rolls=defender_dice[trial, : defender_rolls[trial]].tolist(),
+        )
+        # attack() itself checks that all of the predefined rolls were used
+        assert a.attack(d) == attacker_wins[trial]
+
+
+@pytest.mark.parametrize(
+    "attacker,defender",
+    [
+        (Attacker(2, ["relentless", "scrappy"]), Defender(1, ["cruel"])),
+        (Attacker(4, ["rational"]), Defender(4, ["stubborn", "relentless"])),
+        (Attacker(1, ["cruel", "ferocious"]), Defender(6, ["scrappy"])),
+    ],
+)
+def test_batch_matches_replayed(attacker, defender):
+    """The same seed gives the same count as the scalar path over the same dice"""
+    assert do_iterations_batch(
+        attacker, defender, 5000, seed=3, batch_size=2000
+    ) == do_iterations_replayed(attacker, defender, 5000, seed=3, batch_size=2000)
+
+
+def test_do_iterations_batch():
+    a = Attacker(ship_die=2, cards=["relentless", "scrappy"])
+    d = Defender(ship_die=1, cards=["cruel"])
+    num_trials = 100000
+    win_count = do_iterations_batch(a, d, num_trials, seed=1, batch_size=30000)
+    assert win_count == do_iterations_batch(a, d, num_trials, seed=1, batch_size=30000)
+    assert win_count / num_trials == pytest.approx(
+        float(exact_win_probability(a, d)), abs=0.005
+    )
+
+
+def test_compare_identical_configurations():
+    comparison = compare_common_random_numbers(
+        Attacker(ship_die=3, cards=["cruel"]),
+        Defender(ship_die=2),
+        Attacker(ship_die=3, cards=["cruel"]),
+        Defender(ship_die=2),
+        10000,
+        seed=0,
+    )
+    assert comparison.ratio == comparison.base_ratio
+    assert comparison.difference == 0
+    assert comparison.standard_error == 0
+
+
+def test_compare_common_random_numbers():
+    a = Attacker(ship_die=3, cards=["ferocious"])
+    d = Defender(ship_die=3, cards=["stubborn"])
+    base_a = Attacker(ship_die=3)
+    base_d = Defender(ship_die=3)
+    num_trials = 50000
+    comparison = compare_common_random_numbers(
+        a, d, base_a, base_d, num_trials, seed=0
+    )
+    expected = float(
+        exact_win_probability(a, d) - exact_win_probability(base_a, base_d)
+    )
+    assert comparison.difference == pytest.approx(
+        expected, abs=4 * comparison.standard_error
+    )
+    # Much smaller than if the two configurations were run independently
+    independent_standard_error = (
+        comparison.ratio * (1 - comparison.ratio) / num_trials
+        + comparison.base_ratio * (1 - comparison.base_ratio) / num_trials
+    ) ** 0.5
+    assert comparison.standard_error < independent_standard_error / 2
+
+
+@pytest.mark.parametrize(
+    "attacker,defender",
+    [
+        (Attacker(6), Defender(1, ["relentless", "cruel"])),
+        (Attacker(2, ["scrappy"]), Defender(6)),
+        (Attacker(5, ["ferocious"]), Defender(1, ["cruel"])),
+        (Attacker(3), Defender(3)),
+    ],
+)
+def test_importance_sampling(attacker, defender):
+    exact = float(exact_win_probability(attacker, defender))
+    estimate = do_iterations_importance(attacker, defender, 20000, seed=0)
+    assert estimate.low <= exact <= estimate.high
+    # Tight relative to the rarer outcome, however rare it is
+    tail = min(exact, 1 - exact)
+    assert (estimate.high - estimate.low) / 2 < 0.1 * tail
+
+
+@pytest.mark.parametrize(
+    "attacker,defender",
+    [
+        # Rerolls make these far less lopsided than their totals suggest
+        (Attacker(5, ["ferocious", "relentless", "cruel"]), Defender(1, ["scrappy"])),
+        (
+            Attacker(6, ["relentless", "scrappy", "strategic"]),
+            Defender(1, ["ferocious"]),
+        ),
+        (
+            Attacker(5, ["ferocious", "relentless", "stubborn"]),
+            Defender(1, ["cruel", "scrappy", "strategic"]),
+        ),
+    ],
+)
+def test_importance_sampling_no_worse_than_plain(attacker, defender):
+    num_trials = 10000
+    exact = float(exact_win_probability(attacker, defender))
+    estimate = do_iterations_importance(attacker, defender, num_trials, seed=0)
+    plain_half_width = 1.96 * (exact * (1 - exact) / num_trials) ** 0.5
+    assert (estimate.high - estimate.low) / 2 <= 1.05 * plain_half_width
+
+
+def test_importance_sampling_impossible():
+    # The attacker can never win this
+    attacker = Attacker(6, ["cruel"])
+    defender = Defender(1, ["stubborn"])
+    assert exact_win_probability(attacker, defender) == 0
+    assert do_iterations_importance(attacker, defender, 1000, seed=0).ratio == 0
@@ -0,0 +1,56 @@
+from array import array
+
+import pytest
+
+from reconfigure_table import ReconfigureTable
+from roll import reconfigure_probability
+
+
+@pytest.fixture(scope="module")
+def table():
+    return ReconfigureTable.build(max_abilities=2, max_actions=3)
+
+
+def test_matches_solver(table):
+    for current_ship_die in range(1, 7):
+        for desired_ship_die in range(1, 7):
+            for abilities in range(3):
+                for actions in range(4):
+                    assert table.probability(
+                        current_ship_die, desired_ship_die, abilities, actions
+                    ) == float(
+                        reconfigure_probability(
+                            current_ship_die, desired_ship_die, abilities, actions
+                        )
+                    )
+
+
+def test_beyond_table(table):
+    assert (2, 10) not in table
+    assert table.probability(1, 2, 2, 10) == float(reconfigure_probability(1, 2, 2, 10))
+
+
+@pytest.mark.parametrize("ship_dice", [(0, 2), (2, 7), (7, 1)])
+def test_invalid_ship_die(table, ship_dice):
+    # Rather than reading some other state's probability
+    with pytest.raises(ValueError):
+        table.probability(*ship_dice, 1, 1)
+
+
+@pytest.mark.parametrize("budget", [(0, -1), (-1, 2), (-1, 10)])
+def test_negative_budget(table, budget):
+    # Within the table's bounds or not, rather than hanging in the solver
+    with pytest.raises(ValueError):
+        table.probability(1, 2, *budget)
+
+
+def test_round_trip(table, tmp_path):
+    table.save(tmp_path / "table.pkl")
+    loaded = ReconfigureTable.load(tmp_path / "table.pkl")
+    assert (loaded.max_abilities, loaded.max_actions) == (2, 3)
+    assert loaded.probabilities == table.probabilities
+
+
+def test_wrong_size():
+    with pytest.raises(ValueError):
+        ReconfigureTable(1, 1, array("d", [0.5]))
@@ -0,0 +1,378 @@
+import collections
+import functools
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qq import qq
+from quantum import (
+    ATTACKER_ADVANTAGES,
+    CARDS,
+    Attacker,
+    Defender,
+    exact_win_probability,
+)
+import results_table as results_table_module
+from results_table import ResultsTable
+from table import (
+    BACKENDS,
+    MAX_PENDING_PER_WORKER,
+    Cell,
+    WorkUnit,
+    get_possible_hands,
+    handle_work_unit,
+    new_representatives,
+    class_key,
+    open_results_table,
+    remaining_cells,
+    remaining_work,
+    run_work_units,
+    store_results,
+    table,
+    verify_all_advantage_equivalence,
+    verify_all_behavior_equivalence,
+    work_units,
+)
+
+TABLE_CARDS = ["cruel", "scrappy", "rational"]
+HANDS = list(get_possible_hands(TABLE_CARDS))
+
+
+@pytest.fixture
+def results_table(tmp_path):
+    return ResultsTable.create(
+        tmp_path / "results.table", {"num_trials": 10}, cards=TABLE_CARDS
+    )
+
+
+def test_round_trip(results_table):
+    results_table.set(("scrappy",), ("rational", "cruel"), -2, 0.25, 10)
+    results_table.set((), (), 5, 1.0, 0)
+    results_table.flush()
+
+    reopened = ResultsTable(results_table.path)
+    assert reopened.metadata == {"num_trials": 10}
+    # Cards are looked up regardless of their order
+    assert reopened.get(("scrappy",), ("cruel", "rational"), -2) == (0.25, 10)
+    assert reopened.get((), (), 5) == (1.0, 0)
+
+
+def test_uncalculated(results_table):
+    with pytest.raises(KeyError):
+        results_table.get(("scrappy",), ("cruel",), 0)
+
+
+def test_read_only(results_table):
+    reopened = ResultsTable(results_table.path)
+    with pytest.raises(ValueError):
+        reopened.set((), (), 0, 0.5, 10)
+
+
+def test_sparse(results_table, monkeypatch):
+    monkeypatch.setattr(results_table_module, "CHUNK_PAIRS", 4)
+    assert not list(results_table.path.glob("chunk_*.npy"))
+    results_table.set(("scrappy", "rational"), ("cruel",), 0, 0.5, 10)
+    assert len(list(results_table.path.glob("chunk_*.npy"))) == 1
+
+    results_table.set((), ("cruel",), 0, 0.25, 10)
+    cells = results_table.cells(0, results_table.num_pairs)
+    assert cells.shape == (results_table.num_pairs, len(ATTACKER_ADVANTAGES))
+    assert cells[1, 5].tolist() == (0.25, 10)
+    pair, advantage_index = results_table.index(("scrappy", "rational"), ("cruel",), 0)
+    assert pair >= 4
+    assert cells[pair, advantage_index].tolist() == (0.5, 10)
+    assert np.isnan(cells["ratio"]).sum() == cells.size - 2
+
+
+def test_attacker_cells(results_table):
+    results_table.set(("cruel",), ("scrappy", "rational"), 5, 1.0, 0)
+    cells = results_table.attacker_cells(("cruel",))
+    assert len(cells) == len(list(get_possible_hands(["scrappy", "rational"])))
+    assert cells[-1, -1].tolist() == (1.0, 0)
+
+
+def test_not_a_table(tmp_path):
+    path = tmp_path / "results.pkl"
+    path.write_bytes(b"not a table")
+    with pytest.raises(ValueError):
+        ResultsTable(path)
+
+
+def test_store_results(results_table):
+    store_results(
+        results_table,
+        ("cruel",),
+        {("scrappy",): {(6, 2): 0.75, (2, 6): 0.125}},
+        num_trials=10,
+    )
+    assert results_table.get(("cruel",), ("scrappy",), 4) == (0.75, 10)
+    assert results_table.get(("cruel",), ("scrappy",), -4) == (0.125, 10)
+    with pytest.raises(KeyError):
+        results_table.get(("cruel",), ("scrappy",), 0)
+
+    results_table.flush()
+    assert qq(6, 2, ("cruel",), ("scrappy",), input_path=results_table.path) == 0.75
+
+
+class TestResume:
+    def fill(self, results_table, hand, ratio, num_trials):
+        for defender_hand in get_possible_hands(
+            [card for card in HANDS[-1] if card not in hand]
+        ):
+            for attacker_advantage in ATTACKER_ADVANTAGES:
+                results_table.set(
+                    hand, defender_hand, attacker_advantage, ratio, num_trials
+                )
+
+    def test_remaining_work(self, results_table):
+        self.fill(results_table, ("cruel",), 0.5, 10)
+        self.fill(results_table, ("scrappy",), 0.5, 4)
+        self.fill(results_table, ("rational",), 0.5, 4)
+        # An interrupted write
+        results_table.set(("rational",), ("cruel",), 3, 0.5, 10)
+        self.fill(results_table, ("cruel", "scrappy"), 1.5, 10)
+
+        remaining = dict(remaining_work(results_table, HANDS, 10))
+        assert ("cruel",) not in remaining
+        assert remaining[("scrappy",)] == 4
+        assert remaining[("rational",)] == 0
+        assert remaining[("cruel", "scrappy")] == 0
+        assert remaining[()] == 0
+
+        # Any number of trials will do if trials stop once precise enough
+        remaining = dict(remaining_work(results_table, HANDS, 10, adaptive=True))
+        assert ("scrappy",) not in remaining
+        assert ("rational",) not in remaining
+
+    def test_extend(self, results_table):
+        self.fill(results_table, ("cruel",), 0.5, 30)
+        store_results(
+            results_table,
+            ("cruel",),
+            {("scrappy",): {(6, 2): 0.75, (5, 1): 0.75}},
+            num_trials=10,
+            trials_done=30,
+        )
+        # Pairs of ship dice with the same advantage are only merged once
+        assert results_table.get(("cruel",), ("scrappy",), 4) == (0.5625, 40)
+
+    def test_open(self, tmp_path):
+        path = tmp_path / "results.table"
+        results_table = open_results_table(path, {"seed": 1}, cards=TABLE_CARDS)
+        results_table.set((), (), 0, 0.5, 10)
+        results_table.flush()
+
+        reopened = open_results_table(
+            path, {"seed": 1}, resume=True, cards=TABLE_CARDS
+        )
+        assert reopened.get((), (), 0) == (0.5, 10)
+        with pytest.raises(ValueError):
+            open_results_table(path, {"seed": 2}, resume=True, cards=TABLE_CARDS)
+        with pytest.raises(ValueError):
+            open_results_table(
+                path, {"seed": 1}, resume=True, cards=TABLE_CARDS, max_hand_size=2
+            )
+        # Starting over
+        with pytest.raises(KeyError):
+            open_results_table(path, {"seed": 1}, cards=TABLE_CARDS).get((), (), 0)
+
+
+class TestWorkUnits:
+    def test_covers_every_cell_once(self):
+        remaining = {(): 0, ("cruel",): 4, ("cruel", "scrappy", "rational"): 0}
+        units = list(work_units(remaining_cells(remaining.items()), task_size=5))
+        cells = [
+            (unit.attacker_hand, defender_hand, unit.attacker_advantage)
+            for unit in units
+            for defender_hand in unit.defender_hands
+        ]
+        assert len(cells) == len(set(cells))
+        assert set(cells) == {
+            (attacker_hand, defender_hand, attacker_advantage)
+            for attacker_hand in remaining
+            for defender_hand in get_possible_hands(
+                [card for card in CARDS if card not in attacker_hand]
+            )
+            for attacker_advantage in ATTACKER_ADVANTAGES
+        }
+        for unit in units:
+            assert unit.trials_done == remaining[unit.attacker_hand]
+
+    def test_sizes(self):
+        units = list(
+            work_units(
+                remaining_cells([((), 0), (("cruel", "scrappy", "rational"), 0)]),
+                task_size=5,
+            )
+        )
+        groups = collections.Counter(
+            (unit.attacker_hand, unit.attacker_advantage) for unit in units
+        )
+        # Only the last unit of each group is less than full
+        small_groups = collections.Counter(
+            (unit.attacker_hand, unit.attacker_advantage)
+            for unit in units
+            if len(unit.defender_hands) < 5
+        )
+        assert all(len(unit.defender_hands) <= 5 for unit in units)
+        assert all(count <= 1 for count in small_groups.values())
+        assert len(groups) == 2 * len(ATTACKER_ADVANTAGES)
+
+    def test_lazy(self):
+        hands_read = []
+
+        def remaining():
+            for hand in get_possible_hands():
+                hands_read.append(hand)
+                yield hand, 0
+
+        units = work_units(remaining_cells(remaining()), task_size=5)
+        assert len(next(units).defender_hands) == 5
+        # Only the first attacker hand has been read
+        assert hands_read == [()]
+
+    def test_matches_get_results(self):
+        unit = WorkUnit(("cruel",), ((), ("scrappy",)), -2, 0)
+        results = handle_work_unit(unit, 10, exact=True)
+        assert results == {
+            defender_hand: {
+                (1, 3): float(
+                    exact_win_probability(
+                        Attacker(1, ["cruel"]), Defender(3, defender_hand)
+                    )
+                )
+            }
+            for defender_hand in unit.defender_hands
+        }
+
+    def test_processes_backend(self):
+        units = list(work_units(remaining_cells([(("cruel",), 0)])))
+        finished = dict(
+            run_work_units(
+                functools.partial(handle_work_unit, num_trials=10, exact=True),
+                units,
+                backend="processes",
+                workers=2,
+            )
+        )
+        assert set(finished) == set(units)
+
+    def test_streams_units(self):
+        units_read = []
+
+        def units():
+            for unit in work_units(remaining_cells([(("cruel",), 0)])):
+                units_read.append(unit)
+                yield unit
+
+        finished = run_work_units(
+            functools.partial(handle_work_unit, num_trials=10, exact=True),
+            units(),
+            backend="processes",
+            workers=1,
+        )
+        next(finished)
+        # Only a few units are handed out ahead of the workers
+        assert len(units_read) <= MAX_PENDING_PER_WORKER + 1
+        assert len(list(finished)) + 1 == len(units_read)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            list(run_work_units(len, [], backend="threads"))
+
+
+class TestEquivalenceClasses:
+    def test_class_key(self):
+        # A Rational attacker's Scrappy, and its opponent's Cruel, are moot
+        assert class_key(Cell(("scrappy", "rational"), ("cruel",), 1, 0)) == (
+            class_key(Cell(("rational",), (), 1, 0))
+        )
+        # but only cells with as many trials done share extra trials
+        assert class_key(Cell(("rational",), (), 1, 4)) != (
+            class_key(Cell(("rational",), (), 1, 0))
+        )
+        # Ferocious is the same as a change of advantage
+        assert class_key(Cell((), ("ferocious",), 2, 0)) == (
+            class_key(Cell((), (), 3, 0))
+        )
+        assert class_key(Cell((), ("relentless",), 1, 0)) != (
+            class_key(Cell((), (), 1, 0))
+        )
+
+    def test_new_representatives(self):
+        cells = list(
+            remaining_cells([((), 0), (("scrappy", "rational"), 0), (("rational",), 4)])
+        )
+        representatives = {}
+        new = list(new_representatives(cells, representatives))
+        assert len(new) == len({class_key(cell) for cell in cells})
+        assert new == list(representatives.values())
+        for cell in cells:
+            representative = representatives[class_key(cell)]
+            assert cells.index(representative) <= cells.index(cell)
+
+
+class TestTable:
+    def test_cards(self, tmp_path):
+        path = tmp_path / "results.table"
+        table(
+            output=path,
+            backend="processes",
+            workers=1,
+            cards=["cruel", "rational"],
+            max_hand_size=2,
+            exact=True,
+        )
+        results_table = ResultsTable(path)
+        assert results_table.cards == ["cruel", "rational"]
+        assert results_table.get(("cruel",), ("rational",), 1) == (
+            float(
+                exact_win_probability(Attacker(2, ["cruel"]), Defender(1, ["rational"]))
+            ),
+            0,
+        )
+        assert not np.isnan(
+            results_table.cells(0, results_table.num_pairs)["ratio"]
+        ).any()
+
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_jobs(self, tmp_path, backend):
+        # Work units already run in worker processes, which (under dask) can't
+        # start processes of their own
+        path = tmp_path / "results.table"
+        table(
+            num_trials=20,
+            output=path,
+            backend=backend,
+            workers=1,
+            cards=["cruel"],
+            max_hand_size=1,
+            seed=1,
+            jobs=2,
+        )
+        results_table = ResultsTable(path)
+        assert results_table.get(("cruel",), (), 0)[1] == 20
+        assert "jobs" not in results_table.metadata
+
+    def test_extend(self, tmp_path):
+        path = tmp_path / "results.table"
+        build = functools.partial(
+            table,
+            output=path,
+            backend="processes",
+            workers=1,
+            cards=["cruel", "rational"],
+            max_hand_size=2,
+            seed=1,
+        )
+        build(num_trials=10)
+        build(num_trials=20, resume=True)
+        results_table = ResultsTable(path)
+        cells = results_table.cells(0, results_table.num_pairs)
+        assert (cells["num_trials"] == 20).all()
+
+    def test_verify(self):
+        cards = ["cruel", "scrappy", "rational"]
+        assert verify_all_advantage_equivalence(cards, 2) == {}
+        assert verify_all_behavior_equivalence(cards, 2) == []
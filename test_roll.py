@@ -1,8 +1,16 @@
+from fractions import Fraction
+import random
 from unittest.mock import patch
 
 import pytest
 
-from roll import full_reconfigure
+from roll import (
+    full_reconfigure,
+    optimal_policy,
+    optimal_reconfigure,
+    reconfigure_distribution,
+    reconfigure_probability,
+)
 
 
 class TestReconfigure:
@@ -48,3 +56,121 @@ class TestReconfigure:
         )
 
         assert result is False
+
+    def test_large_budget(self):
+        class Unlucky(random.Random):
+            def randint(self, a, b):
+                return a
+
+        # Bounces between 1 and 2 until out of actions, without recursing once
+        # per action
+        result, actions_remaining, ship_abilities_remaining = full_reconfigure(
+            current_ship_die=1,
+            desired_ship_die=3,
+            ship_abilities_remaining=0,
+            actions_remaining=5000,
+            rng=Unlucky(),
+        )
+        assert result is False
+        assert actions_remaining == 0
+
+    def test_rng(self):
+        results = [
+            full_reconfigure(
+                current_ship_die=1,
+                desired_ship_die=2,
+                ship_abilities_remaining=1,
+                actions_remaining=3,
+                rng=random.Random(seed),
+            )
+            for seed in (1, 1)
+        ]
+        assert results[0] == results[1]
+
+
+class TestReconfigureDistribution:
+    def test_nop(self):
+        assert reconfigure_distribution(1, 1, 1, 3) == {(1, 3, 1): 1}
+
+    def test_actions_only(self):
+        # Every action has a 1/5 chance of hitting the desired ship die
+        assert reconfigure_probability(1, 2, 0, 3) == 1 - Fraction(4, 5) ** 3
+
+    def test_modify(self):
+        assert reconfigure_distribution(4, 3, 1, 0) == {(3, 0, 0): 1}
+
+    def test_no_budget(self):
+        assert reconfigure_probability(1, 2, 0, 0) == 0
+
+    @pytest.mark.parametrize("abilities,actions", [(0, -1), (-1, 0), (-1, 2)])
+    def test_negative_budget(self, abilities, actions):
+        with pytest.raises(ValueError):
+            reconfigure_distribution(1, 2, abilities, actions)
+        with pytest.raises(ValueError):
+            reconfigure_probability(1, 2, abilities, actions)
+        with pytest.raises(ValueError):
+            optimal_reconfigure(1, 2, abilities, actions)
+        with pytest.raises(ValueError):
+            full_reconfigure(1, 2, abilities, actions)
+
+    @pytest.mark.parametrize("abilities,actions", [(1, 3), (2, 5), (0, 1)])
+    def test_sums_to_one(self, abilities, actions):
+        for current_ship_die in range(1, 7):
+            for desired_ship_die in range(1, 7):
+                distribution = reconfigure_distribution(
+                    current_ship_die, desired_ship_die, abilities, actions
+                )
+                assert sum(distribution.values()) == 1
+
+    def test_matches_simulation(self):
+        rng = random.Random(0)
+        num_trials = 20000
+        outcomes = {}
+        for __ in range(num_trials):
+            result, actions_remaining, ship_abilities_remaining = full_reconfigure(
+                current_ship_die=6,
+                desired_ship_die=3,
+                ship_abilities_remaining=2,
+                actions_remaining=2,
+                rng=rng,
+            )
+            if result:
+                key = (3, actions_remaining, ship_abilities_remaining)
+                outcomes[key] = outcomes.get(key, 0) + 1
+
+        distribution = reconfigure_distribution(6, 3, 2, 2)
+        for key, count in outcomes.items():
+            assert count / num_trials == pytest.approx(distribution[key], abs=0.01)
+        assert sum(outcomes.values()) / num_trials == pytest.approx(
+            reconfigure_probability(6, 3, 2, 2), abs=0.01
+        )
+
+
+class TestOptimalReconfigure:
+    def test_done(self):
+        assert optimal_reconfigure(3, 3, 0, 0) == (1, None)
+
+    def test_stop(self):
+        assert optimal_reconfigure(1, 3, 0, 0) == (0, None)
+
+    def test_modify(self):
+        assert optimal_reconfigure(4, 5, 1, 0) == (1, "modify to 5")
+
+    def test_beats_heuristic(self):
+        # reconfigure stops on a 4 once it's out of actions, rather than
+        # modifying to a 3
+        assert reconfigure_probability(1, 3, 1, 1) == Fraction(6, 25)
+        assert optimal_reconfigure(1, 3, 1, 1) == (Fraction(11, 25), "reconfigure")
+
+    def test_never_worse_than_heuristic(self):
+        for desired_ship_die in range(1, 7):
+            policy = optimal_policy(desired_ship_die, 2, 3)
+            for (ship_die, abilities, actions), (probability, __) in policy.items():
+                assert probability >= reconfigure_probability(
+                    ship_die, desired_ship_die, abilities, actions
+                )
+
+    def test_large_budget(self):
+        probability, move = optimal_reconfigure(1, 2, 2, 200)
+        assert move == "reconfigure"
+        assert probability > 0.99
@@ -0,0 +1,54 @@
+from collections import Counter
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from roll import reconfigure_distribution
+from roll_batch import reconfigure_batch
+
+
+def test_nop():
+    ship_die, actions, abilities = reconfigure_batch(2, 2, 1, 3, 10)
+    assert (ship_die == 2).all()
+    assert (actions == 3).all()
+    assert (abilities == 1).all()
+
+
+def test_reproducible():
+    first = reconfigure_batch(1, 3, 2, 5, 1000, seed=1)
+    second = reconfigure_batch(1, 3, 2, 5, 1000, seed=1)
+    for a, b in zip(first, second):
+        assert (a == b).all()
+
+
+@pytest.mark.parametrize(
+    "current_ship_die,desired_ship_die,abilities,actions",
+    [(1, 3, 1, 3), (6, 5, 2, 2), (4, 1, 1, 0), (2, 6, 0, 4)],
+)
+def test_matches_distribution(current_ship_die, desired_ship_die, abilities, actions):
+    num_trials = 50000
+    outcomes = Counter(
+        zip(
+            *reconfigure_batch(
+                current_ship_die,
+                desired_ship_die,
+                abilities,
+                actions,
+                num_trials,
+                seed=0,
+            )
+        )
+    )
+    distribution = reconfigure_distribution(
+        current_ship_die, desired_ship_die, abilities, actions
+    )
+    assert set(outcomes) <= set(distribution)
+    for outcome, probability in distribution.items():
+        assert outcomes[outcome] / num_trials == pytest.approx(probability, abs=0.01)
+
+
+def test_large_budget():
+    ship_die, actions, __ = reconfigure_batch(1, 2, 0, 10000, 1000, seed=0)
+    assert (ship_die == 2).all()
+    assert (actions > 0).all()